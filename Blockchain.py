@@ -5,34 +5,368 @@ fundamentales que definen la Blockchain. En específico, se implementan los obje
 AUTORES: SERGIO RODRÍGUEZ VIDAL Y JAIME PAZ RODRÍGUEZ
 """
 
+import heapq
 import json
+import multiprocessing
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from Blockchain_metricas import CerrojoMedido, RegistroMetricas
 from datetime import datetime
 from hashlib import sha256
 
-from time import time
-from typing import List, Dict, Optional, IO, Union
+from threading import Lock, RLock
+from time import perf_counter, time
+from multiprocessing.sharedctypes import Synchronized as Contador
+from multiprocessing.synchronize import Event
+from typing import Callable, List, Dict, Iterable, Optional, IO, Sequence, Tuple, Union
 
 FileIO = Union[str, IO[str]]
-TransactionLikeList = List[Optional[Dict]]
+TransactionLikeList = List['Transaccion']
+
+# Marcador que ocupa el lugar de la prueba al serializar un bloque para minarlo
+MARCADOR_PRUEBA = '\x00prueba\x00'
+
+# Versiones de bloque: en la 1 el hash se calcula sobre el bloque entero; en la 2, sobre una cabecera con la raíz de
+# Merkle de sus transacciones; en la 3 la cabecera incluye además el objetivo de la prueba de trabajo del bloque
+VERSION_COMPLETA = 1
+VERSION_MERKLE = 2
+VERSION_OBJETIVO = 3
+
+# La prueba de trabajo de un bloque es válida si su hash, como número, es menor que su objetivo
+OBJETIVO_MAXIMO = 2 ** 256 - 1
+
+
+def objetivo_dificultad(dificultad: int) -> int:
+    """
+    Objetivo equivalente a exigir un número de ceros hexadecimales iniciales en el hash (la regla de los bloques
+    anteriores a la versión 3).
+    :param dificultad: número de ceros iniciales.
+    :return: objetivo
+    """
+    return min(16 ** (64 - dificultad), OBJETIVO_MAXIMO)
+
+
+class ErrorCargaBlockchain(Exception):
+    """
+    Error al cargar una blockchain de disco: algún bloque no enlaza con el anterior o su prueba no es válida.
+    """
+    def __init__(self, indice: int):
+        self.message = f"El bloque {indice} no es valido"
+        super(ErrorCargaBlockchain, self).__init__(self.message)
+
+
+def id_transaccion(transaccion: 'Transaccion') -> str:
+    """
+    Devuelve el identificador de una transacción: el hash de su representación JSON.
+    :param transaccion: transacción.
+    :return: identificador de la transacción
+    """
+    return transaccion.id
+
+
+def _niveles_merkle(hojas: List[bytes]) -> List[List[bytes]]:
+    """
+    Calcula todos los niveles de un árbol de Merkle, desde las hojas hasta la raíz. Si un nivel tiene un número impar de
+    nodos, el último se empareja consigo mismo. Por ello las listas [a, b, c] y [a, b, c, c] tienen la misma raíz, y
+    los bloques con transacciones repetidas se rechazan (ver Blockchain.transacciones_unicas).
+    """
+    niveles = [hojas or [sha256(b'').digest()]]
+    while len(niveles[-1]) > 1:
+        nivel = niveles[-1]
+        if len(nivel) % 2:
+            nivel = nivel + nivel[-1:]
+        niveles.append([sha256(nivel[posicion] + nivel[posicion + 1]).digest()
+                        for posicion in range(0, len(nivel), 2)])
+    return niveles
+
+
+def raiz_merkle(ids_transacciones: List[str]) -> str:
+    """
+    Calcula la raíz del árbol de Merkle de una lista de transacciones.
+    :param ids_transacciones: identificadores de las transacciones, en orden.
+    :return: raíz de Merkle
+    """
+    return _niveles_merkle([bytes.fromhex(id_tx) for id_tx in ids_transacciones])[-1][0].hex()
+
+
+def prueba_merkle(ids_transacciones: List[str], posicion: int) -> List[Dict]:
+    """
+    Calcula la prueba de inclusión de una transacción en el árbol de Merkle: los hashes hermanos de cada nivel, con el
+    lado en que se concatenan. Tiene tamaño logarítmico en el número de transacciones.
+    :param ids_transacciones: identificadores de las transacciones, en orden.
+    :param posicion: posición de la transacción.
+    :return: lista de {'hash', 'lado'} desde las hojas hacia la raíz
+    """
+    prueba = []
+    for nivel in _niveles_merkle([bytes.fromhex(id_tx) for id_tx in ids_transacciones])[:-1]:
+        hermano = posicion ^ 1
+        prueba.append({
+                       'hash': nivel[min(hermano, len(nivel) - 1)].hex(),
+                       'lado': 'derecha' if hermano > posicion else 'izquierda'
+                       })
+        posicion //= 2
+    return prueba
+
+
+def verificar_prueba_merkle(id_tx: str, prueba: List[Dict], raiz: str) -> bool:
+    """
+    Comprueba una prueba de inclusión calculada con prueba_merkle.
+    :param id_tx: identificador de la transacción.
+    :param prueba: prueba de inclusión.
+    :param raiz: raíz de Merkle del bloque.
+    :return: True si la transacción está incluida, False en caso contrario
+    """
+    actual = bytes.fromhex(id_tx)
+    for paso in prueba:
+        hermano = bytes.fromhex(paso['hash'])
+        actual = sha256(actual + hermano if paso['lado'] == 'derecha' else hermano + actual).digest()
+    return actual.hex() == raiz
 
 
 class Transaccion(object):
-    def __init__(self, origen: str, destino: str, cantidad: int):
+    __slots__ = ('origen', 'destino', 'cantidad', 'timestamp', 'comision', '_id')
+
+    def __init__(self, origen: str, destino: str, cantidad: int, timestamp: Optional[float] = None,
+                 comision: int = 0):
         """
         Constructor de la clase 'Transaccion'.
         :param origen: Originario de la transacción.
         :param destino: Destinatario de la transacción.
         :param cantidad: Cantidad de dinero enviada.
+        :param timestamp: Momento de creación (default: el momento actual).
+        :param comision: Comisión ofrecida al minero; da prioridad a la transacción (default: 0).
         """
         self.origen = origen
         self.destino = destino
         self.cantidad = cantidad
-        self.timestamp = time()
+        self.timestamp = time() if timestamp is None else timestamp
+        self.comision = comision
+        self._id = None
+
+    @classmethod
+    def from_dict(cls, datos: Dict) -> 'Transaccion':
+        """
+        Crea una transacción a partir de su diccionario.
+        :param datos: diccionario de la transacción.
+        :return: transacción
+        """
+        return cls(datos["origen"], datos["destino"], datos["cantidad"], datos["timestamp"], datos.get("comision", 0))
+
+    def to_dict(self) -> Dict:
+        """
+        Convierte la transacción a un diccionario (su representación JSON). La comisión solo se incluye si no es 0, de
+        forma que las transacciones sin comisión conservan su representación (y su identificador) de siempre.
+        :return: Diccionario de la transacción
+        """
+        transaccion_dict = {
+                            'origen': self.origen,
+                            'destino': self.destino,
+                            'cantidad': self.cantidad,
+                            'timestamp': self.timestamp
+                            }
+        if self.comision:
+            transaccion_dict['comision'] = self.comision
+        return transaccion_dict
+
+    def gasto(self):
+        """
+        Cantidad que la transacción resta al saldo de su origen: la enviada más la comisión.
+        :return: cantidad
+        """
+        return self.cantidad + self.comision
+
+    def tamano(self) -> int:
+        """
+        Tamaño en bytes de la transacción en la codificación binaria de Blockchain_codec.
+        :return: tamaño en bytes
+        """
+        return 21 + len(self.origen.encode()) + len(self.destino.encode()) + (8 if self.comision else 0)
+
+    @property
+    def id(self) -> str:
+        """
+        Identificador de la transacción: el hash de su representación JSON. Se calcula una sola vez.
+        :return: identificador de la transacción
+        """
+        if self._id is None:
+            self._id = sha256(json.dumps(self.to_dict(), sort_keys=True).encode()).hexdigest()
+        return self._id
+
+    def __getstate__(self):
+        # El identificador ya calculado viaja con la transacción (por ejemplo, desde los procesos de la carga en
+        # paralelo) para no volver a calcularlo
+        return self.origen, self.destino, self.cantidad, self.timestamp, self.comision, self._id
+
+    def __setstate__(self, estado):
+        self.origen, self.destino, self.cantidad, self.timestamp, self.comision, self._id = estado
+
+
+class TransaccionRechazada(Exception):
+    """
+    Error al no poder aceptar una transacción entre las pendientes.
+    """
+    def __init__(self, message: str):
+        self.message = message
+        super(TransaccionRechazada, self).__init__(message)
+
+
+class Mempool(object):
+    def __init__(self, max_transacciones: int, max_bytes: int):
+        """
+        Constructor de la clase 'Mempool': transacciones pendientes indexadas por su identificador y ordenadas por
+        prioridad (mayor comisión primero y, a igual comisión, la más antigua). Cuando se supera alguno de los límites
+        se descarta la transacción de menor prioridad.
+        :param max_transacciones: número máximo de transacciones pendientes.
+        :param max_bytes: tamaño máximo (ver Transaccion.tamano) de las transacciones pendientes.
+        """
+        self.max_transacciones = max_transacciones
+        self.max_bytes = max_bytes
+        self.transacciones = {}
+        self.bytes = 0
+        # Cantidad (más comisión) comprometida por cada origen en las transacciones pendientes
+        self.gastos = {}
+        # Montículos de (prioridad, secuencia, id) para la mejor y la peor transacción (en peores, con la secuencia
+        # cambiada de signo). Solo es vigente la entrada con la secuencia que figura en secuencias para su id: las de
+        # transacciones retiradas, o retiradas y añadidas de nuevo, se descartan al encontrarlas.
+        self.mejores = []
+        self.peores = []
+        self.secuencia = 0
+        self.secuencias = {}
+
+    def __len__(self):
+        return len(self.transacciones)
+
+    def __iter__(self):
+        return iter(list(self.transacciones.values()))
+
+    def __contains__(self, id_tx: str):
+        return id_tx in self.transacciones
+
+    def obtener(self, id_tx: str) -> Optional[Transaccion]:
+        """
+        Busca una transacción pendiente por su identificador.
+        :param id_tx: identificador de la transacción
+        :return: la transacción, o None si no está pendiente
+        """
+        return self.transacciones.get(id_tx)
+
+    def anadir(self, transaccion: Transaccion):
+        """
+        Añade una transacción. Si con ella se supera algún límite, descarta las de menor prioridad (que pueden incluir
+        la propia transacción). Lanza TransaccionRechazada si la transacción ya estaba o acaba descartada.
+        :param transaccion: transacción
+        :return: None
+        """
+        if transaccion.id in self.transacciones:
+            raise TransaccionRechazada("La transaccion ya esta pendiente")
+        self.transacciones[transaccion.id] = transaccion
+        self.bytes += transaccion.tamano()
+        self.gastos[transaccion.origen] = self.gastos.get(transaccion.origen, 0) + transaccion.gasto()
+        self.secuencia += 1
+        self.secuencias[transaccion.id] = self.secuencia
+        heapq.heappush(self.mejores, ((-transaccion.comision, transaccion.timestamp), self.secuencia, transaccion.id))
+        heapq.heappush(self.peores, ((transaccion.comision, -transaccion.timestamp), -self.secuencia, transaccion.id))
+
+        while len(self.transacciones) > self.max_transacciones or self.bytes > self.max_bytes:
+            _, secuencia, id_peor = heapq.heappop(self.peores)
+            if self._vigente(id_peor, -secuencia):
+                self._quitar(id_peor)
+        if transaccion.id not in self.transacciones:
+            raise TransaccionRechazada("No hay sitio para la transaccion entre las pendientes")
+        self._compactar()
+
+    def _vigente(self, id_tx: str, secuencia: int) -> bool:
+        """
+        Indica si la entrada de un montículo con ese id y esa secuencia corresponde a una transacción pendiente.
+        """
+        return self.secuencias.get(id_tx) == secuencia
+
+    def _quitar(self, id_tx: str):
+        del self.secuencias[id_tx]
+        transaccion = self.transacciones.pop(id_tx)
+        self.bytes -= transaccion.tamano()
+        self.gastos[transaccion.origen] -= transaccion.gasto()
+        if not self.gastos[transaccion.origen]:
+            del self.gastos[transaccion.origen]
+
+    def gasto_pendiente(self, cuenta: str):
+        """
+        Cantidad (más comisión) que una cuenta envía en las transacciones pendientes.
+        :param cuenta: cuenta de origen
+        :return: cantidad comprometida
+        """
+        return self.gastos.get(cuenta, 0)
+
+    def retirar(self, ids_transacciones: Iterable[str]):
+        """
+        Retira las transacciones indicadas (por ejemplo, al confirmarse en un bloque). Las que no estén se ignoran.
+        :param ids_transacciones: identificadores de las transacciones
+        :return: None
+        """
+        for id_tx in ids_transacciones:
+            if id_tx in self.transacciones:
+                self._quitar(id_tx)
+        self._compactar()
+
+    def retirar_sin_saldo(self, cuentas: Iterable[str], saldos: Dict[str, int]) -> List[Transaccion]:
+        """
+        Retira, de las cuentas indicadas que envíen en las transacciones pendientes más de su saldo (por ejemplo,
+        porque un cambio de la cadena lo ha reducido), las transacciones de menor prioridad hasta que el saldo las
+        cubra. Solo recorre las transacciones pendientes si alguna cuenta se excede.
+        :param cuentas: cuentas cuyo saldo puede haber cambiado.
+        :param saldos: saldo de cada cuenta (las que no están tienen saldo 0).
+        :return: transacciones retiradas
+        """
+        excedidas = {cuenta for cuenta in cuentas if self.gasto_pendiente(cuenta) > saldos.get(cuenta, 0)}
+        if not excedidas:
+            return []
+        retiradas = []
+        for transaccion in sorted((transaccion for transaccion in self.transacciones.values()
+                                   if transaccion.origen in excedidas),
+                                  key=lambda transaccion: (transaccion.comision, -transaccion.timestamp)):
+            if self.gasto_pendiente(transaccion.origen) > saldos.get(transaccion.origen, 0):
+                self._quitar(transaccion.id)
+                retiradas.append(transaccion)
+        self._compactar()
+        return retiradas
+
+    def _compactar(self):
+        """
+        Reconstruye los montículos cuando las entradas de transacciones retiradas superan a las vigentes.
+        """
+        if len(self.mejores) > 2 * len(self.transacciones) + 64:
+            self.mejores = [entrada for entrada in self.mejores if self._vigente(entrada[2], entrada[1])]
+            heapq.heapify(self.mejores)
+        if len(self.peores) > 2 * len(self.transacciones) + 64:
+            self.peores = [entrada for entrada in self.peores if self._vigente(entrada[2], -entrada[1])]
+            heapq.heapify(self.peores)
+
+    def seleccionar(self, numero: int) -> List[Transaccion]:
+        """
+        Devuelve, sin retirarlas, las numero transacciones de mayor prioridad en O(numero log n). Cada transacción se
+        devuelve una sola vez.
+        :param numero: número máximo de transacciones
+        :return: lista de transacciones, de mayor a menor prioridad
+        """
+        extraidas, seleccionadas, tomadas = [], [], set()
+        while self.mejores and len(seleccionadas) < numero:
+            entrada = heapq.heappop(self.mejores)
+            if self._vigente(entrada[2], entrada[1]) and entrada[2] not in tomadas:
+                tomadas.add(entrada[2])
+                extraidas.append(entrada)
+                seleccionadas.append(self.transacciones[entrada[2]])
+        for entrada in extraidas:
+            heapq.heappush(self.mejores, entrada)
+        return seleccionadas
 
 
 class Bloque(object):
+    __slots__ = ('hash_bloque', 'hash_previo', 'indice', 'timestamp', 'prueba', 'transacciones', 'version',
+                 'raiz_merkle', 'objetivo')
+
     def __init__(self, indice: int, transacciones: TransactionLikeList, hash_previo: str, timestamp: float,
-                 prueba: int = 0, calcular_hash: bool = False):
+                 prueba: int = 0, calcular_hash: bool = False, version: int = VERSION_MERKLE,
+                 objetivo: Optional[int] = None):
         """
         Constructor de la clase 'Bloque'.
         :param indice: ID unico del bloque.
@@ -40,6 +374,9 @@ class Bloque(object):
         :param hash_previo: hash previo.
         :param prueba:  prueba de trabajo.
         :param calcular_hash: Calcula el hash del bloque (default: False)
+        :param version: regla con la que se calcula el hash (default: VERSION_MERKLE)
+        :param objetivo: objetivo de la prueba de trabajo; obligatorio desde la versión 3, en la que forma parte del
+        hash. En las anteriores no se guarda (ver Blockchain.objetivo_bloque) (default: None)
         """
         self.hash_bloque = None
         self.hash_previo = hash_previo
@@ -47,29 +384,533 @@ class Bloque(object):
         self.timestamp = timestamp
         self.prueba = prueba
         self.transacciones = transacciones
+        self.version = version
+        self.raiz_merkle = None
+        self.objetivo = objetivo if version >= VERSION_OBJETIVO else None
+        if version >= VERSION_OBJETIVO and objetivo is None:
+            raise ValueError("Los bloques de la version 3 deben indicar su objetivo")
+        if version >= VERSION_MERKLE:
+            self.raiz_merkle = raiz_merkle([transaccion.id for transaccion in transacciones])
         if calcular_hash:
             self.hash_bloque = self.calcular_hash()
 
+    @classmethod
+    def from_dict(cls, datos: Dict, con_hash: bool = False) -> 'Bloque':
+        """
+        Crea un bloque a partir de su diccionario (por ejemplo, recibido de otro nodo). Por defecto el hash del bloque
+        no se copia: debe comprobarse y asignarse al integrarlo.
+        :param datos: diccionario del bloque.
+        :param con_hash: copia también el hash del bloque (default: False)
+        :return: bloque
+        """
+        bloque = cls(indice=datos["indice"],
+                     transacciones=[Transaccion.from_dict(transaccion) for transaccion in datos["transacciones"]],
+                     timestamp=datos["timestamp"],
+                     hash_previo=datos["hash_previo"],
+                     prueba=datos["prueba"],
+                     version=datos.get("version", VERSION_COMPLETA),
+                     objetivo=int(datos["objetivo"], 16) if "objetivo" in datos else None)
+        if con_hash:
+            bloque.hash_bloque = datos["hash_bloque"]
+        return bloque
+
+    def to_dict(self) -> Dict:
+        """
+        Convierte el bloque a un diccionario (su representación JSON). Los bloques de la versión 1 no incluyen los
+        campos 'version' ni 'raiz_merkle', y solo los de la versión 3 incluyen 'objetivo' (64 dígitos hexadecimales).
+        :return: Diccionario del bloque
+        """
+        bloque_dict = {
+                       'hash_bloque': self.hash_bloque,
+                       'hash_previo': self.hash_previo,
+                       'indice': self.indice,
+                       'timestamp': self.timestamp,
+                       'prueba': self.prueba,
+                       'transacciones': [transaccion.to_dict() for transaccion in self.transacciones]
+                       }
+        if self.version >= VERSION_MERKLE:
+            bloque_dict['version'] = self.version
+            bloque_dict['raiz_merkle'] = self.raiz_merkle
+        if self.objetivo is not None:
+            bloque_dict['objetivo'] = format(self.objetivo, '064x')
+        return bloque_dict
+
+    def cabecera(self) -> Dict:
+        """
+        Cabecera del bloque (versión 2 o posterior): todos sus campos salvo las transacciones, sustituidas por su raíz
+        de Merkle, y el propio hash. Su tamaño no depende del número de transacciones. Desde la versión 3 incluye el
+        objetivo, de forma que no se puede cambiar sin rehacer la prueba de trabajo.
+        :return: Diccionario de la cabecera
+        """
+        cabecera = {
+                    'hash_previo': self.hash_previo,
+                    'indice': self.indice,
+                    'timestamp': self.timestamp,
+                    'prueba': self.prueba,
+                    'raiz_merkle': self.raiz_merkle,
+                    'version': self.version
+                    }
+        if self.objetivo is not None:
+            cabecera['objetivo'] = format(self.objetivo, '064x')
+        return cabecera
+
+    def datos_hash(self) -> Dict:
+        """
+        Diccionario del que se calcula el hash del bloque. En la versión 1 es su representación JSON con el hash del
+        bloque a None (el valor que tiene siempre que se calcula, antes de asignarlo); desde la versión 2, su cabecera.
+        :return: Diccionario del bloque
+        """
+        if self.version >= VERSION_MERKLE:
+            return self.cabecera()
+        return dict(self.to_dict(), hash_bloque=None)
+
     def calcular_hash(self):
         """
         Método que devuelve el hash de un bloque.
         :return: hash del bloque
         """
-        block_string = json.dumps(self.__dict__, sort_keys=True)
+        block_string = json.dumps(self.datos_hash(), sort_keys=True)
         return str(sha256(block_string.encode()).hexdigest())
 
+    def partes_hash(self) -> Tuple[bytes, bytes]:
+        """
+        Serializa el bloque una única vez dejando un hueco en el lugar de la prueba. El hash del bloque para una prueba
+        cualquiera es sha256(cabeza + str(prueba) + cola), idéntico al devuelto por calcular_hash.
+        :return: tupla (cabeza, cola) en bytes.
+        """
+        datos = dict(self.datos_hash(), prueba=MARCADOR_PRUEBA)
+        block_string = json.dumps(datos, sort_keys=True)
+        marcador = json.dumps(MARCADOR_PRUEBA)
+        if block_string.count(marcador) != 1:
+            raise ValueError("No se ha podido localizar la prueba en el bloque serializado")
+        cabeza, _, cola = block_string.partition(marcador)
+        return cabeza.encode(), cola.encode()
+
+
+class MotorMinado(object):
+    # Número de pruebas entre cada comprobación de cancelación y actualización del contador de intentos
+    intervalo = 4096
+
+    def __init__(self, cabeza: bytes, cola: bytes, objetivo: int):
+        """
+        Constructor de la clase 'MotorMinado'. Guarda el estado de sha256 tras procesar la parte fija del bloque
+        anterior a la prueba, de forma que cada intento solo tenga que procesar la prueba y la cola.
+        :param cabeza: bytes del bloque serializado anteriores a la prueba.
+        :param cola: bytes del bloque serializado posteriores a la prueba.
+        :param objetivo: número al que debe ser inferior el hash.
+        """
+        self.cabeza = cabeza
+        self.cola = cola
+        self.objetivo = objetivo
+        self.estado_inicial = sha256(cabeza)
+
+    @classmethod
+    def desde_bloque(cls, bloque: Bloque, objetivo: int) -> 'MotorMinado':
+        """
+        Crea un motor de minado a partir de un bloque.
+        :param bloque: bloque a minar.
+        :param objetivo: número al que debe ser inferior el hash.
+        :return: motor de minado
+        """
+        return cls(*bloque.partes_hash(), objetivo=objetivo)
+
+    def hash_prueba(self, prueba: int) -> str:
+        """
+        Calcula el hash del bloque para una prueba dada.
+        :param prueba: prueba de trabajo.
+        :return: hash del bloque
+        """
+        estado = self.estado_inicial.copy()
+        estado.update(str(prueba).encode())
+        estado.update(self.cola)
+        return estado.hexdigest()
+
+    def buscar(self, inicio: int = 0, paso: int = 1, parar: Optional[Event] = None,
+               intentos: Optional[Contador] = None) -> Optional[Tuple[int, str]]:
+        """
+        Prueba los nonces inicio, inicio + paso, inicio + 2 * paso... hasta encontrar un hash válido o hasta que se
+        active el evento parar.
+        :param inicio: primera prueba a intentar.
+        :param paso: separación entre pruebas consecutivas (número de trabajadores en el minado paralelo).
+        :param parar: evento que, al activarse, detiene la búsqueda (default: None).
+        :param intentos: contador compartido en el que se acumulan las pruebas realizadas (default: None).
+        :return: tupla (prueba, hash) encontrada, o None si se detuvo la búsqueda.
+        """
+        estado_inicial, cola, objetivo = self.estado_inicial, self.cola, self.objetivo
+        tramo_inicio = inicio
+        while parar is None or not parar.is_set():
+            tramo_fin = tramo_inicio + paso * self.intervalo
+            for prueba in range(tramo_inicio, tramo_fin, paso):
+                estado = estado_inicial.copy()
+                estado.update(str(prueba).encode())
+                estado.update(cola)
+                if int.from_bytes(estado.digest(), 'big') < objetivo:
+                    _sumar_intentos(intentos, (prueba - tramo_inicio) // paso + 1)
+                    return prueba, estado.hexdigest()
+            _sumar_intentos(intentos, self.intervalo)
+            tramo_inicio = tramo_fin
+        return None
+
+    def buscar_paralelo(self, procesos: int, intentos: Optional[Contador] = None,
+                        separado: bool = False) -> Tuple[int, str]:
+        """
+        Reparte el espacio de nonces entre varios procesos: el trabajador i prueba i, i + procesos, i + 2 * procesos...
+        En cuanto uno encuentra un hash válido, se detiene al resto.
+        :param procesos: número de procesos trabajadores.
+        :param intentos: contador compartido en el que se acumulan las pruebas realizadas (default: None).
+        :param separado: si es True, la búsqueda nunca se hace en el proceso actual, aunque procesos sea 1
+        (default: False).
+        :return: tupla (prueba, hash) encontrada.
+        """
+        if procesos <= 1 and not separado:
+            return self.buscar(intentos=intentos)
+        procesos = max(procesos, 1)
+
+        parar = multiprocessing.Event()
+        resultados = multiprocessing.Queue()
+        trabajadores = [multiprocessing.Process(target=_trabajador_minado,
+                                                args=(self.cabeza, self.cola, self.objetivo, inicio, procesos,
+                                                      parar, intentos, resultados),
+                                                daemon=True)
+                        for inicio in range(procesos)]
+        for trabajador in trabajadores:
+            trabajador.start()
+        try:
+            resultado = resultados.get()
+        finally:
+            parar.set()
+            for trabajador in trabajadores:
+                trabajador.join(timeout=1.)
+                if trabajador.is_alive():
+                    trabajador.terminate()
+        return resultado
+
+
+def _sumar_intentos(intentos: Optional[Contador], cantidad: int):
+    """
+    Suma una cantidad al contador compartido de intentos, si lo hay.
+    """
+    if intentos is not None:
+        with intentos.get_lock():
+            intentos.value += cantidad
+
+
+def _trabajador_minado(cabeza: bytes, cola: bytes, objetivo: int, inicio: int, paso: int, parar: Event,
+                       intentos: Optional[Contador], resultados: multiprocessing.Queue):
+    """
+    Función ejecutada por cada proceso del minado paralelo. Si encuentra una prueba válida la deja en resultados.
+    """
+    resultado = MotorMinado(cabeza, cola, objetivo).buscar(inicio, paso, parar, intentos)
+    if resultado is not None:
+        resultados.put(resultado)
+
+
+def _preparar_lote(lote: List[Union[bytes, Bloque]]) -> List[Tuple[Bloque, bool, bool]]:
+    """
+    Prepara un lote de bloques para enlazarlos en la cadena: decodifica los que llegan codificados (ver
+    Blockchain_almacen.decodificar_registro), calcula los identificadores de sus transacciones y su raíz de Merkle y
+    comprueba su prueba de trabajo. Se ejecuta en los procesos de la carga en paralelo, que devuelven los bloques ya
+    preparados.
+    :param lote: lista de bloques (con su hash asignado), codificados o no.
+    :return: por cada bloque, tupla (bloque, si su hash es el suyo, si su hash alcanza su objetivo)
+    """
+    from Blockchain_almacen import decodificar_registro
+    preparados = []
+    for elemento in lote:
+        bloque = decodificar_registro(elemento) if isinstance(elemento, bytes) else elemento
+        for transaccion in bloque.transacciones:
+            transaccion.id
+        try:
+            alcanza_objetivo = int(bloque.hash_bloque, 16) < Blockchain.objetivo_bloque(bloque)
+        except (TypeError, ValueError):
+            alcanza_objetivo = False
+        preparados.append((bloque, bloque.calcular_hash() == bloque.hash_bloque, alcanza_objetivo))
+    return preparados
+
+
+class Reorganizacion(object):
+    __slots__ = ('indice_ancestro', 'descartados', 'bloques_por_hash', 'transacciones_por_id', 'siguiente')
+
+    def __init__(self, indice_ancestro: int, descartados: List[Bloque], bloques_por_hash: Dict[str, Optional[Bloque]],
+                 transacciones_por_id: Dict[str, Optional[Tuple[str, int]]]):
+        """
+        Constructor de la clase 'Reorganizacion': registro de lo que cambia una reorganización de la cadena, para que
+        las instantáneas anteriores a ella sigan viendo su cadena (ver Instantanea). Las reorganizaciones de una
+        blockchain forman una lista enlazada, de la más antigua a la más reciente.
+        :param indice_ancestro: índice del último bloque común (los bloques a partir de esa posición se sustituyen).
+        :param descartados: bloques que ocupaban la cadena a partir del ancestro.
+        :param bloques_por_hash: valores previos de las entradas modificadas del índice de bloques (None si no
+        estaban).
+        :param transacciones_por_id: valores previos de las entradas modificadas del índice de transacciones (None si
+        no estaban).
+        """
+        self.indice_ancestro = indice_ancestro
+        self.descartados = descartados
+        self.bloques_por_hash = bloques_por_hash
+        self.transacciones_por_id = transacciones_por_id
+        self.siguiente = None
+
+
+class Instantanea(object):
+    __slots__ = ('cadena', 'longitud', 'trabajo', 'bloques_por_hash', 'transacciones_por_id', 'reorganizacion')
+
+    def __init__(self, cadena: List[Bloque], trabajo: int, bloques_por_hash: Dict[str, Bloque],
+                 transacciones_por_id: Dict[str, Tuple[str, int]], reorganizacion: Reorganizacion):
+        """
+        Constructor de la clase 'Instantanea': vista inmutable de la cadena en un momento dado, sobre la que se puede
+        leer sin cerrojos mientras la blockchain sigue cambiando. La lista de bloques y los índices se comparten con la
+        blockchain, que los modifica en el sitio: los bloques posteriores a la instantánea se ignoran y lo que cambien
+        las reorganizaciones posteriores se lee de sus registros (ver Reorganizacion), que se enlazan antes de tocar la
+        cadena. Así, una reorganización solo cuesta en proporción a los bloques que sustituye.
+        :param cadena: lista de bloques de la cadena.
+        :param trabajo: trabajo acumulado de la cadena.
+        :param bloques_por_hash: índice hash del bloque -> bloque.
+        :param transacciones_por_id: índice id de transacción -> (hash del bloque, posición).
+        :param reorganizacion: última reorganización de la cadena antes de la instantánea.
+        """
+        self.cadena = cadena
+        self.longitud = len(cadena)
+        self.trabajo = trabajo
+        self.bloques_por_hash = bloques_por_hash
+        self.transacciones_por_id = transacciones_por_id
+        self.reorganizacion = reorganizacion
+
+    def __len__(self):
+        return self.longitud
+
+    def __getitem__(self, posicion: int) -> Bloque:
+        """
+        Bloque de la cadena en una posición (el primer bloque está en la posición 0), para poder usar la instantánea
+        como la lista de sus bloques (ver Blockchain.objetivo_siguiente).
+        :param posicion: posición del bloque (negativa para contar desde el final).
+        :return: bloque
+        """
+        if posicion < 0:
+            posicion += self.longitud
+        if not 0 <= posicion < self.longitud:
+            raise IndexError(posicion)
+        return self._bloques(posicion, posicion + 1)[0]
+
+    def _bloques(self, inicio: int, fin: int) -> List[Bloque]:
+        """
+        Bloques de la cadena entre las posiciones inicio (incluida) y fin (excluida), ambas dentro de la instantánea.
+        Cada posición la fija la primera reorganización posterior que la sustituyó o, si ninguna lo hizo, la cadena
+        actual. La cadena se lee antes que las reorganizaciones, que se enlazan antes de modificarla.
+        """
+        bloques = self.cadena[inicio:fin]
+        bloques += [None] * (fin - inicio - len(bloques))
+        limite = fin
+        reorganizacion = self.reorganizacion.siguiente
+        while reorganizacion is not None and limite > inicio:
+            ancestro = reorganizacion.indice_ancestro
+            if ancestro < limite:
+                for posicion in range(max(ancestro, inicio), limite):
+                    bloques[posicion - inicio] = reorganizacion.descartados[posicion - ancestro]
+                limite = ancestro
+            reorganizacion = reorganizacion.siguiente
+        return bloques
+
+    def _buscar(self, indice: str, clave: str):
+        """
+        Valor de una entrada del índice indicado ('bloques_por_hash' o 'transacciones_por_id') en la instantánea: el
+        que tenía antes de la primera reorganización posterior que la modificó o, si ninguna lo hizo, el actual.
+        """
+        valor = getattr(self, indice).get(clave)
+        reorganizacion = self.reorganizacion.siguiente
+        while reorganizacion is not None:
+            anteriores = getattr(reorganizacion, indice)
+            if clave in anteriores:
+                return anteriores[clave]
+            reorganizacion = reorganizacion.siguiente
+        return valor
+
+    @property
+    def ultimo_bloque(self) -> Bloque:
+        """
+        Último bloque de la cadena en la instantánea
+        :return: último bloque
+        """
+        return self[self.longitud - 1]
+
+    def bloques(self, desde: int = 1, fin: Optional[int] = None) -> List[Bloque]:
+        """
+        Bloques de la cadena con índices entre desde y fin (ambos incluidos).
+        :param desde: índice del primer bloque (default: 1).
+        :param fin: índice del último bloque (default: el último de la instantánea).
+        :return: lista de bloques
+        """
+        fin = self.longitud if fin is None else min(fin, self.longitud)
+        inicio = max(desde, 1) - 1
+        return self._bloques(inicio, fin) if inicio < fin else []
+
+    def bloque_por_hash(self, hash_bloque: str) -> Optional[Bloque]:
+        """
+        Busca un bloque de la cadena por su hash.
+        :param hash_bloque: hash del bloque
+        :return: el bloque, o None si no está en la cadena
+        """
+        bloque = self._buscar('bloques_por_hash', hash_bloque)
+        if bloque is None or bloque.indice > self.longitud:
+            return None
+        return bloque
+
+    def bloque_por_indice(self, indice: int) -> Optional[Bloque]:
+        """
+        Busca un bloque de la cadena por su índice (el primer bloque tiene índice 1).
+        :param indice: índice del bloque
+        :return: el bloque, o None si no está en la cadena
+        """
+        if 1 <= indice <= self.longitud:
+            return self[indice - 1]
+        return None
+
+    def buscar_transaccion(self, id_tx: str) -> Optional[Tuple[Transaccion, Bloque]]:
+        """
+        Busca una transacción confirmada por su identificador.
+        :param id_tx: identificador de la transacción (ver id_transaccion)
+        :return: tupla (transacción, bloque que la contiene), o None si no está confirmada
+        """
+        localizacion = self._buscar('transacciones_por_id', id_tx)
+        if localizacion is None:
+            return None
+        hash_bloque, posicion = localizacion
+        bloque = self.bloque_por_hash(hash_bloque)
+        if bloque is None:
+            return None
+        return bloque.transacciones[posicion], bloque
+
+    def cabecera(self) -> Dict:
+        """
+        Resumen ligero del estado de la cadena: hash del último bloque, altura y trabajo acumulado.
+        :return: Diccionario de la cabecera
+        """
+        return {
+                'hash_bloque': self.ultimo_bloque.hash_bloque,
+                'altura': self.longitud,
+                'trabajo': self.trabajo
+                }
+
+    def localizador(self) -> List[str]:
+        """
+        Lista de hashes de bloques de la cadena, desde el último hacia el primero: los 10 últimos seguidos y después
+        con saltos que se duplican, terminando siempre en el primer bloque. Permite a otro nodo encontrar el último
+        bloque común enviando solo O(log n) hashes.
+        :return: lista de hashes
+        """
+        hashes = []
+        posicion, salto = self.longitud - 1, 1
+        while posicion > 0:
+            hashes.append(self[posicion].hash_bloque)
+            if len(hashes) >= 10:
+                salto *= 2
+            posicion -= salto
+        hashes.append(self[0].hash_bloque)
+        return hashes
+
+    def ancestro_comun(self, localizador: List[str]) -> Optional[int]:
+        """
+        Busca el primer hash del localizador de otro nodo que también esté en esta cadena.
+        :param localizador: localizador de la otra cadena (ver localizador)
+        :return: índice del bloque común, o None si las cadenas no comparten ningún bloque
+        """
+        for hash_bloque in localizador:
+            bloque = self.bloque_por_hash(hash_bloque)
+            if bloque is not None:
+                return bloque.indice
+        return None
+
+
+class _CadenaConSufijo(object):
+    def __init__(self, cadena: List[Bloque], longitud: int):
+        """
+        Los longitud primeros bloques de una cadena seguidos de los que se le añadan (sufijo), sin copiar la cadena.
+        Basta para calcular el objetivo de cada bloque de un sufijo mientras se revisa (ver objetivo_siguiente).
+        """
+        self.cadena = cadena
+        self.longitud = longitud
+        self.sufijo = []
+
+    def __len__(self):
+        return self.longitud + len(self.sufijo)
+
+    def __getitem__(self, posicion: int) -> Bloque:
+        if posicion < 0:
+            posicion += len(self)
+        if posicion < self.longitud:
+            return self.cadena[posicion]
+        return self.sufijo[posicion - self.longitud]
+
+    def append(self, bloque: Bloque):
+        self.sufijo.append(bloque)
+
 
 class Blockchain(object):
+    # Dificultad (ceros iniciales) de los bloques anteriores a la versión 3 y de partida de los nuevos
     dificultad = 4
+    # Reajuste del objetivo: cada bloques_reajuste bloques (0 para no reajustar) se acerca el tiempo entre bloques a
+    # intervalo_bloques segundos, variando el objetivo como mucho en un factor ajuste_maximo
+    intervalo_bloques = 10.
+    bloques_reajuste = 10
+    ajuste_maximo = 4
+    # Límites de las transacciones pendientes y número máximo de transacciones por bloque
+    max_transacciones_pendientes = 100000
+    max_bytes_pendientes = 32 * 1024 * 1024
+    max_transacciones_bloque = 2000
+    # Cantidad que cobra el minero de cada bloque, además de las comisiones de sus transacciones
+    recompensa_bloque = 1
+    # Bloques por lote en la verificación en paralelo de from_file
+    tamano_lote = 256
+    # Atributos anteriores que cada blockchain puede fijar al crearla sin afectar al resto (ver __init__)
+    PARAMETROS = ('intervalo_bloques', 'bloques_reajuste', 'ajuste_maximo', 'max_transacciones_pendientes',
+                  'max_bytes_pendientes', 'max_transacciones_bloque', 'recompensa_bloque')
 
-    def __init__(self):
+    def __init__(self, metricas: Optional[RegistroMetricas] = None, **parametros):
         """
-        Constructor de la clase
+        Constructor de la clase. Los atributos de PARAMETROS toman el valor de la clase salvo que se indique otro en
+        parametros, que solo se aplica a esta blockchain (por ejemplo, cada nodo de un mismo proceso con sus propios
+        límites). Las lecturas se hacen sobre la instantánea publicada tras cada cambio de la cadena (ver
+        Instantanea), sin cerrojos. Los cambios de la cadena (integrar, reorganizar, sustituir) se serializan con
+        cerrojo_cadena, y las transacciones pendientes y el estado que se consulta al admitirlas (índice de
+        transacciones y saldos) se protegen con cerrojo_pendientes, que solo se retiene mientras se modifican. Quien
+        necesite ambos toma antes cerrojo_cadena. Los tiempos de espera y de retención de ambos cerrojos y los de
+        persistir los cambios se recogen en metricas.
+        :param metricas: registro de las métricas del nodo de la blockchain (default: uno propio).
+        :param parametros: valores propios de los atributos de PARAMETROS.
         """
+        for nombre, valor in parametros.items():
+            if nombre not in self.PARAMETROS:
+                raise TypeError(f"Parametro de la blockchain desconocido: {nombre}")
+            setattr(self, nombre, valor)
+        metricas = RegistroMetricas() if metricas is None else metricas
+        self.cerrojo_cadena = CerrojoMedido(Lock(), 'cadena', metricas)
+        self.cerrojo_pendientes = CerrojoMedido(RLock(), 'pendientes', metricas)
+        self.persistencia = metricas.histograma('blockchain_persistencia_segundos',
+                                                'Tiempo de registrar en el almacen los cambios de la cadena')
+        self.instantanea = None
         self.cadena = []
-        self.transacciones_sin_confirmar = []
+        self.transacciones_sin_confirmar = Mempool(self.max_transacciones_pendientes, self.max_bytes_pendientes)
+        # Índices de la cadena: hash del bloque -> bloque, id de transacción -> (hash del bloque, posición)
+        self.bloques_por_hash = {}
+        self.transacciones_por_id = {}
+        # Trabajo acumulado de la cadena hasta cada bloque (misma posición que en la cadena)
+        self.trabajos = []
+        # Saldo de cada cuenta según los bloques de la cadena
+        self.saldos = {}
+        # Última reorganización de la cadena (al principio, un registro vacío al que enlazar la primera)
+        self.reorganizacion = Reorganizacion(0, [], {}, {})
+        # Almacén persistente en el que se registra cada cambio de la cadena (ver Blockchain_almacen)
+        self.almacen = None
         self.primer_bloque()
 
+    def publicar(self):
+        """
+        Publica una nueva instantánea con el estado actual de la cadena. La sustitución es atómica: cada lector ve la
+        instantánea anterior o la nueva.
+        :return: None
+        """
+        self.instantanea = Instantanea(self.cadena, self.trabajos[-1], self.bloques_por_hash, self.transacciones_por_id,
+                                       self.reorganizacion)
+
     def __len__(self):
         """
         Devuelve la longitud de la blockchain
@@ -85,7 +926,8 @@ class Blockchain(object):
         :return: None
         """
         if isinstance(path_or_buf, str):
-            path_or_buf = open(path_or_buf, 'w')
+            with open(path_or_buf, 'w') as fichero:
+                return json.dump(self.to_dict(), fichero, **kwargs)
         return json.dump(self.to_dict(), path_or_buf, **kwargs)
 
     def to_dict(self):
@@ -93,13 +935,157 @@ class Blockchain(object):
         Convierte la blockchain a un diccionario
         :return: Diccionario de la blockchain
         """
+        instantanea = self.instantanea
         blockchain_dict = {
-            'cadena': list(map(lambda block: block.__dict__, self.cadena)),
-            'longitud': len(self),
+            'cadena': list(map(lambda block: block.to_dict(), instantanea.bloques())),
+            'longitud': len(instantanea),
             'date': datetime.now().strftime("%d/%m/%Y %H:%M:%S")
         }
         return blockchain_dict
 
+    def parametros(self) -> Dict:
+        """
+        Valores de los atributos de PARAMETROS de esta blockchain, para crear otra con los mismos.
+        :return: Diccionario nombre -> valor
+        """
+        return {nombre: getattr(self, nombre) for nombre in self.PARAMETROS}
+
+    @classmethod
+    def from_file(cls, path: str, procesos: int = 1, punto_control: Optional[Tuple[int, str]] = None,
+                  **parametros) -> 'Blockchain':
+        """
+        Carga una blockchain de disco: un registro de bloques (ver Blockchain_almacen) o, si el path termina en
+        '.json', una copia guardada con to_json. Ver desde_bloques y desde_registros.
+        :param path: path del fichero.
+        :param procesos: número de procesos para verificar las pruebas de trabajo (default: 1).
+        :param punto_control: tupla (altura, hash) de un bloque de confianza (default: None).
+        :param parametros: parámetros de la blockchain (ver __init__).
+        :return: blockchain cargada
+        """
+        if path.endswith('.json'):
+            with open(path) as fichero:
+                bloques = (Bloque.from_dict(datos, con_hash=True) for datos in json.load(fichero)['cadena'])
+                return cls.desde_bloques(bloques, procesos, punto_control, **parametros)
+
+        from Blockchain_almacen import AlmacenBloques
+        almacen = AlmacenBloques(path)
+        try:
+            return cls.desde_registros(almacen.leer_registros(), procesos, punto_control, **parametros)
+        finally:
+            almacen.cerrar()
+
+    @classmethod
+    def desde_bloques(cls, bloques: Iterable[Bloque], procesos: int = 1,
+                      punto_control: Optional[Tuple[int, str]] = None, **parametros) -> 'Blockchain':
+        """
+        Construye una blockchain a partir de sus bloques (con su hash asignado), leídos de uno en uno. Ver
+        desde_registros.
+        :param bloques: bloques en orden, empezando por el primero.
+        :param procesos: número de procesos para preparar los bloques (default: 1).
+        :param punto_control: tupla (altura, hash) de un bloque de confianza (default: None).
+        :param parametros: parámetros de la blockchain (ver __init__).
+        :return: blockchain cargada
+        """
+        return cls._cargar(bloques, procesos, punto_control, **parametros)
+
+    @classmethod
+    def desde_registros(cls, registros: Iterable[bytes], procesos: int = 1,
+                        punto_control: Optional[Tuple[int, str]] = None, **parametros) -> 'Blockchain':
+        """
+        Construye una blockchain a partir de sus bloques codificados (ver Blockchain_almacen.decodificar_registro),
+        leídos de uno en uno. Los bloques se preparan por lotes (se decodifican, se calculan los identificadores de sus
+        transacciones y su raíz de Merkle y se comprueba su prueba de trabajo), en paralelo si procesos > 1, mientras se
+        siguen leyendo registros; el enlace de cada bloque con el anterior, su objetivo, sus transacciones y su
+        recompensa se comprueban al añadirlo a la cadena, en orden. Con un punto de control (altura, hash), de los
+        bloques hasta esa altura solo se comprueba que su hash sea el suyo, sin compararlo con su objetivo, siempre que
+        el bloque de esa altura tenga ese hash; si la cadena no llega a esa altura, se verifican por completo.
+        :param registros: bloques codificados en orden, empezando por el primero.
+        :param procesos: número de procesos para preparar los bloques (default: 1).
+        :param punto_control: tupla (altura, hash) de un bloque de confianza (default: None).
+        :param parametros: parámetros de la blockchain (ver __init__).
+        :return: blockchain cargada
+        """
+        return cls._cargar(registros, procesos, punto_control, **parametros)
+
+    @classmethod
+    def _cargar(cls, elementos: Iterable[Union[bytes, Bloque]], procesos: int,
+                punto_control: Optional[Tuple[int, str]], **parametros) -> 'Blockchain':
+        """
+        Carga común a desde_bloques y desde_registros: prepara los bloques por lotes (ver _preparar_lote), con como
+        mucho 2 * procesos lotes en curso, y los añade a la cadena en orden. Lanza ErrorCargaBlockchain con el índice
+        del primer bloque no válido.
+        """
+        blockchain = cls(**parametros)
+        altura_control, hash_control = punto_control or (0, None)
+        # Índices de los bloques hasta el punto de control cuyo hash no alcanza su objetivo
+        sin_objetivo = []
+        lote, en_curso = [], deque()
+
+        def enlazar(preparados: List[Tuple[Bloque, bool, bool]]):
+            nonlocal sin_objetivo
+            for bloque, hash_valido, alcanza_objetivo in preparados:
+                if bloque.indice == 1:
+                    blockchain.fijar_primer_bloque(bloque)
+                    continue
+
+                previo = blockchain.ultimo_bloque
+                if not hash_valido:
+                    raise ErrorCargaBlockchain(bloque.indice)
+                if bloque.indice != previo.indice + 1 or bloque.hash_previo != previo.hash_bloque:
+                    raise ErrorCargaBlockchain(bloque.indice)
+                if cls.objetivo_bloque(bloque) != blockchain.objetivo_siguiente(blockchain.cadena):
+                    raise ErrorCargaBlockchain(bloque.indice)
+                if not cls.transacciones_unicas(bloque, blockchain.transacciones_por_id.__contains__):
+                    raise ErrorCargaBlockchain(bloque.indice)
+                if not blockchain.recompensa_valida(bloque, previo):
+                    raise ErrorCargaBlockchain(bloque.indice)
+                blockchain.cadena.append(bloque)
+                blockchain.indexar_bloque(bloque)
+
+                if not alcanza_objetivo:
+                    if bloque.indice > altura_control:
+                        raise ErrorCargaBlockchain(bloque.indice)
+                    sin_objetivo.append(bloque.indice)
+                # El hash del punto de control solo cubre los bloques anteriores si cada hash es el del bloque
+                if bloque.indice == altura_control:
+                    if bloque.hash_bloque != hash_control:
+                        raise ErrorCargaBlockchain(bloque.indice)
+                    sin_objetivo = []
+
+        ejecutor = ProcessPoolExecutor(procesos) if procesos > 1 else None
+        try:
+            for elemento in elementos:
+                lote.append(elemento)
+                if len(lote) >= cls.tamano_lote:
+                    cls._preparar_en_curso(en_curso, ejecutor, lote, 2 * procesos, enlazar)
+                    lote = []
+            cls._preparar_en_curso(en_curso, ejecutor, lote, 0, enlazar)
+        finally:
+            if ejecutor is not None:
+                ejecutor.shutdown(cancel_futures=True)
+        # Si no se ha llegado al punto de control, los bloques anteriores también deben alcanzar su objetivo
+        if sin_objetivo:
+            raise ErrorCargaBlockchain(sin_objetivo[0])
+        blockchain.publicar()
+        return blockchain
+
+    @staticmethod
+    def _preparar_en_curso(en_curso: deque, ejecutor: Optional[Executor], lote: List[Union[bytes, Bloque]],
+                           max_en_curso: int, enlazar: Callable[[List[Tuple[Bloque, bool, bool]]], None]):
+        """
+        Lanza la preparación de un lote (en el ejecutor, o en el momento si no lo hay) y pasa a enlazar los lotes más
+        antiguos, en orden, hasta que no haya más de max_en_curso pendientes.
+        """
+        if lote:
+            if ejecutor is None:
+                futuro = Future()
+                futuro.set_result(_preparar_lote(lote))
+            else:
+                futuro = ejecutor.submit(_preparar_lote, lote)
+            en_curso.append(futuro)
+        while len(en_curso) > max_en_curso:
+            enlazar(en_curso.popleft().result())
+
     @property
     def ultimo_bloque(self) -> Bloque:
         """
@@ -114,79 +1100,513 @@ class Blockchain(object):
         :return: primer bloque
         """
         self.cadena.append(primer_bloque := Bloque(1, [], "1", calcular_hash=True, timestamp=time()))
+        self.indexar_bloque(primer_bloque)
+        self.publicar()
         return primer_bloque
 
+    def fijar_primer_bloque(self, bloque: Bloque):
+        """
+        Sustituye toda la cadena por un único bloque raíz (con su hash ya asignado) y reinicia los índices.
+        :param bloque: nuevo primer bloque
+        :return: None
+        """
+        self.persistir(0, [bloque])
+        self.cadena = [bloque]
+        self.bloques_por_hash = {}
+        self.transacciones_por_id = {}
+        self.trabajos = []
+        self.saldos = {}
+        self.reorganizacion = Reorganizacion(0, [], {}, {})
+        self.indexar_bloque(bloque)
+        self.publicar()
+
+    def asignar_almacen(self, almacen, reescribir: bool = True):
+        """
+        Asocia un almacén persistente a la blockchain. A partir de entonces cada cambio de la cadena se registra en él.
+        :param almacen: almacén de bloques (Blockchain_almacen.AlmacenBloques).
+        :param reescribir: si es True, el almacén se reescribe con la cadena actual; si es False, se asume que ya la
+        contiene (por ejemplo, si la cadena se acaba de cargar de él) (default: True).
+        :return: None
+        """
+        self.almacen = almacen
+        if reescribir:
+            self.persistir(0)
+
+    def persistir(self, desde: int, bloques: Optional[List[Bloque]] = None):
+        """
+        Registra en el almacén los bloques a partir de la posición desde, descartando los que hubiera almacenados a
+        partir de esa posición. Los cambios de la cadena se registran antes de aplicarlos en memoria: si el registro
+        falla, se lanza el error y la cadena no cambia. Si un bloque no se puede codificar, el almacén no se toca; si
+        falla la escritura, se intenta dejar con la cadena actual. Sin almacén no hace nada.
+        :param desde: posición del primer bloque a registrar.
+        :param bloques: bloques que ocupan la cadena a partir de desde (default: los de la cadena actual).
+        :return: None
+        """
+        if self.almacen is None:
+            return
+        inicio = perf_counter()
+        actuales = self.cadena[desde:]
+        bloques = actuales if bloques is None else bloques
+        # Los bloques que ya estén almacenados antes de desde no se reescriben
+        desde_almacen = min(desde, len(self.almacen))
+        anteriores = self.cadena[desde_almacen:desde]
+        try:
+            self.almacen.reemplazar(desde_almacen, anteriores + bloques)
+        except OSError:
+            if bloques is not actuales:
+                self.almacen.reemplazar(desde_almacen, anteriores + actuales)
+            raise
+        self.persistencia.observar(perf_counter() - inicio)
+
+    def indexar_bloque(self, bloque: Bloque):
+        """
+        Añade un bloque de la cadena y sus transacciones a los índices, acumula su trabajo y aplica sus transacciones a
+        los saldos.
+        :param bloque: bloque ya integrado en la cadena
+        :return: None
+        """
+        self.trabajos.append((self.trabajos[-1] if self.trabajos else 0) + self.trabajo_bloque(bloque))
+        self.bloques_por_hash[bloque.hash_bloque] = bloque
+        for posicion, transaccion in enumerate(bloque.transacciones):
+            self.transacciones_por_id[id_transaccion(transaccion)] = (bloque.hash_bloque, posicion)
+        self.actualizar_saldos(bloque)
+
+    def actualizar_saldos(self, bloque: Bloque, signo: int = 1):
+        """
+        Aplica (o, con signo -1, deshace) las transacciones de un bloque en los saldos. Las transacciones con origen "0"
+        crean dinero (recompensas), por lo que no restan nada a su origen.
+        :param bloque: bloque de la cadena
+        :param signo: 1 para aplicar el bloque, -1 para deshacerlo (default: 1)
+        :return: None
+        """
+        for transaccion in bloque.transacciones:
+            if transaccion.origen != "0":
+                self._sumar_saldo(transaccion.origen, -signo * transaccion.gasto())
+            self._sumar_saldo(transaccion.destino, signo * transaccion.cantidad)
+
+    def _sumar_saldo(self, cuenta: str, cantidad):
+        saldo = self.saldos.get(cuenta, 0) + cantidad
+        if saldo:
+            self.saldos[cuenta] = saldo
+        else:
+            self.saldos.pop(cuenta, None)
+
+    def saldo(self, cuenta: str) -> Dict:
+        """
+        Devuelve el saldo de una cuenta según los bloques de la cadena, lo que envía en las transacciones pendientes y
+        lo que le queda disponible para nuevas transacciones. Se lee sin cerrojos: refleja el último estado.
+        :param cuenta: cuenta
+        :return: Diccionario con 'saldo', 'pendiente' y 'disponible'
+        """
+        saldo = self.saldos.get(cuenta, 0)
+        pendiente = self.transacciones_sin_confirmar.gasto_pendiente(cuenta)
+        return {'saldo': saldo, 'pendiente': pendiente, 'disponible': saldo - pendiente}
+
+    def bloque_por_hash(self, hash_bloque: str) -> Optional[Bloque]:
+        """
+        Busca un bloque de la cadena por su hash (ver Instantanea.bloque_por_hash).
+        """
+        return self.instantanea.bloque_por_hash(hash_bloque)
+
+    def bloque_por_indice(self, indice: int) -> Optional[Bloque]:
+        """
+        Busca un bloque de la cadena por su índice (ver Instantanea.bloque_por_indice).
+        """
+        return self.instantanea.bloque_por_indice(indice)
+
+    def buscar_transaccion(self, id_tx: str) -> Optional[Tuple[Transaccion, Bloque]]:
+        """
+        Busca una transacción confirmada por su identificador (ver Instantanea.buscar_transaccion).
+        """
+        return self.instantanea.buscar_transaccion(id_tx)
+
+    @property
+    def trabajo_acumulado(self) -> int:
+        """
+        Trabajo total de la cadena: número esperado de hashes necesarios para minar todos sus bloques.
+        :return: trabajo acumulado
+        """
+        return self.trabajos[-1]
+
+    @staticmethod
+    def trabajo_bloque(bloque: Bloque) -> int:
+        """
+        Número esperado de hashes necesarios para minar un bloque (2^256 / objetivo). El primer bloque no requiere
+        prueba de trabajo.
+        :param bloque: bloque de la cadena
+        :return: trabajo del bloque
+        """
+        return 0 if bloque.indice == 1 else 2 ** 256 // Blockchain.objetivo_bloque(bloque)
+
+    @staticmethod
+    def objetivo_bloque(bloque: Bloque) -> int:
+        """
+        Objetivo de la prueba de trabajo de un bloque: el suyo desde la versión 3 y, en los anteriores, el equivalente
+        a la dificultad de la clase.
+        :param bloque: bloque
+        :return: objetivo
+        """
+        if bloque.objetivo is not None:
+            return bloque.objetivo
+        return objetivo_dificultad(Blockchain.dificultad)
+
+    def objetivo_siguiente(self, cadena: Sequence[Bloque], longitud: Optional[int] = None) -> int:
+        """
+        Objetivo que debe tener el bloque siguiente a los longitud primeros de la cadena. Se mantiene el del último
+        bloque salvo cada bloques_reajuste bloques, en que se multiplica por el cociente entre el tiempo que han
+        tardado en minarse los últimos bloques_reajuste bloques y el esperado (limitado a ajuste_maximo en ambos
+        sentidos). Solo se reajusta sobre bloques de la versión 3, de forma que las cadenas anteriores siguen siendo
+        válidas.
+        :param cadena: bloques de la cadena, en orden y empezando por el primero.
+        :param longitud: número de bloques de la cadena que se consideran (default: todos).
+        :return: objetivo
+        """
+        longitud = len(cadena) if longitud is None else longitud
+        previo = cadena[longitud - 1]
+        objetivo = self.objetivo_bloque(previo)
+        if self.bloques_reajuste <= 0 or (longitud - 1) % self.bloques_reajuste != 0:
+            return objetivo
+        # Bloque al principio de la ventana (nunca el primer bloque, cuyo timestamp es el de la creación de la cadena)
+        inicio = longitud - 1 - self.bloques_reajuste
+        if inicio < 1 or previo.objetivo is None or cadena[inicio].objetivo is None:
+            return objetivo
+        esperado = self.bloques_reajuste * self.intervalo_bloques
+        real = min(max(previo.timestamp - cadena[inicio].timestamp, esperado / self.ajuste_maximo),
+                   esperado * self.ajuste_maximo)
+        # Aritmética entera (en milisegundos) para que todos los nodos calculen el mismo objetivo
+        return max(1, min(objetivo * round(real * 1000) // round(esperado * 1000), OBJETIVO_MAXIMO))
+
+    def cabecera(self) -> Dict:
+        """
+        Resumen ligero del estado de la cadena (ver Instantanea.cabecera).
+        """
+        return self.instantanea.cabecera()
+
+    def localizador(self) -> List[str]:
+        """
+        Localizador de la cadena para buscar el último bloque común con otro nodo (ver Instantanea.localizador).
+        """
+        return self.instantanea.localizador()
+
+    def ancestro_comun(self, localizador: List[str]) -> Optional[int]:
+        """
+        Busca el último bloque común con la cadena de otro nodo (ver Instantanea.ancestro_comun).
+        """
+        return self.instantanea.ancestro_comun(localizador)
+
+    def reemplazar_sufijo(self, indice_ancestro: int, sufijo: List[Tuple[Bloque, str]]) -> bool:
+        """
+        Sustituye los bloques posteriores a indice_ancestro por los del sufijo, siempre que estos enlacen con el
+        ancestro, tengan pruebas válidas y den lugar a una cadena con más trabajo acumulado. Solo se verifican los
+        bloques del sufijo. Las transacciones pendientes que ya no cubra el saldo de su origen se retiran, y las de los
+        bloques descartados que no estén en el sufijo vuelven a quedar pendientes si su origen tiene saldo. La cadena
+        y sus índices se modifican en el sitio y lo que cambia se registra antes en una Reorganizacion, de forma que
+        las instantáneas anteriores no cambian y el coste solo depende de los bloques sustituidos.
+        :param indice_ancestro: índice del último bloque común.
+        :param sufijo: lista de tuplas (bloque, hash del bloque) que siguen al ancestro.
+        :return: bool. True si se reemplazó la cadena, False en caso contrario.
+        """
+        with self.cerrojo_cadena:
+            if not 1 <= indice_ancestro <= len(self.cadena) or not sufijo:
+                return False
+
+            nueva_cadena = _CadenaConSufijo(self.cadena, indice_ancestro)
+            trabajo = self.trabajos[indice_ancestro - 1]
+
+            # Transacciones confirmadas en la nueva cadena: las anteriores al ancestro y las del sufijo ya revisado
+            ids_sufijo = set()
+
+            def confirmada(id_tx: str) -> bool:
+                posicion = self.transacciones_por_id.get(id_tx)
+                return id_tx in ids_sufijo or (posicion is not None and
+                                               self.bloques_por_hash[posicion[0]].indice <= indice_ancestro)
+
+            for bloque, hash_bloque in sufijo:
+                previo = nueva_cadena[-1]
+                if bloque.indice != previo.indice + 1 or bloque.hash_previo != previo.hash_bloque:
+                    return False
+                if self.objetivo_bloque(bloque) != self.objetivo_siguiente(nueva_cadena):
+                    return False
+                if not self.prueba_valida(bloque, hash_bloque):
+                    return False
+                if not self.transacciones_unicas(bloque, confirmada):
+                    return False
+                if not self.recompensa_valida(bloque, previo):
+                    return False
+                ids_sufijo.update(transaccion.id for transaccion in bloque.transacciones)
+                bloque.hash_bloque = hash_bloque
+                trabajo += self.trabajo_bloque(bloque)
+                nueva_cadena.append(bloque)
+            if trabajo <= self.trabajo_acumulado:
+                return False
+
+            self.persistir(indice_ancestro, nueva_cadena.sufijo)
+            with self.cerrojo_pendientes:
+                descartados = self.cadena[indice_ancestro:]
+                modificados = descartados + nueva_cadena.sufijo
+                bloques_anteriores = {bloque.hash_bloque: self.bloques_por_hash.get(bloque.hash_bloque)
+                                      for bloque in modificados}
+                ids_modificados = (id_transaccion(transaccion) for bloque in modificados
+                                   for transaccion in bloque.transacciones)
+                transacciones_anteriores = {id_tx: self.transacciones_por_id.get(id_tx) for id_tx in ids_modificados}
+                reorganizacion = Reorganizacion(indice_ancestro, descartados, bloques_anteriores,
+                                                transacciones_anteriores)
+                # Las instantáneas anteriores ven la reorganización antes de que cambie nada
+                self.reorganizacion.siguiente = reorganizacion
+                self.reorganizacion = reorganizacion
+
+                for bloque in reversed(descartados):
+                    self.actualizar_saldos(bloque, -1)
+                    del self.bloques_por_hash[bloque.hash_bloque]
+                    for transaccion in bloque.transacciones:
+                        self.transacciones_por_id.pop(id_transaccion(transaccion), None)
+                del self.trabajos[indice_ancestro:]
+                del self.cadena[indice_ancestro:]
+                for bloque in nueva_cadena.sufijo:
+                    self.cadena.append(bloque)
+                    self.indexar_bloque(bloque)
+
+                self.transacciones_sin_confirmar.retirar(transaccion.id for bloque, _ in sufijo
+                                                         for transaccion in bloque.transacciones)
+                self._ajustar_pendientes(modificados)
+                for bloque in descartados:
+                    for transaccion in bloque.transacciones:
+                        if transaccion.origen != "0" and transaccion.id not in self.transacciones_por_id:
+                            self._reanadir(transaccion)
+            self.publicar()
+        return True
+
+    def _ajustar_pendientes(self, bloques: Iterable[Bloque]):
+        """
+        Retira de las transacciones pendientes las que ya no cubre el saldo de su origen tras añadir o descartar los
+        bloques indicados (ver Mempool.retirar_sin_saldo), de forma que los bloques que se minen con ellas no gasten
+        más de lo que tiene cada cuenta. Se llama con cerrojo_pendientes tomado.
+        :param bloques: bloques añadidos o descartados.
+        :return: None
+        """
+        cuentas = {cuenta for bloque in bloques for transaccion in bloque.transacciones
+                   for cuenta in (transaccion.origen, transaccion.destino)}
+        self.transacciones_sin_confirmar.retirar_sin_saldo(cuentas, self.saldos)
+
+    def _reanadir(self, transaccion: Transaccion):
+        """
+        Vuelve a dejar pendiente una transacción, ignorando si ya lo estaba, no cabe o ya no hay saldo para ella.
+        """
+        try:
+            self.anadir_transaccion(transaccion)
+        except TransaccionRechazada:
+            pass
+
+    @staticmethod
+    def transacciones_unicas(bloque: Bloque, confirmada: Callable[[str], bool]) -> bool:
+        """
+        Comprueba que las transacciones de un bloque no se repiten entre sí ni están ya confirmadas en la cadena. Con
+        transacciones repetidas, dos listas distintas pueden tener la misma raíz de Merkle (y el mismo hash de bloque),
+        y una transacción confirmada dos veces se aplicaría dos veces a los saldos.
+        :param bloque: bloque.
+        :param confirmada: función que indica si un identificador de transacción ya está confirmado en la cadena.
+        :return: True si no hay transacciones repetidas, False en caso contrario
+        """
+        ids_transacciones = [transaccion.id for transaccion in bloque.transacciones]
+        return (len(set(ids_transacciones)) == len(ids_transacciones) and
+                not any(map(confirmada, ids_transacciones)))
+
+    def recompensa_valida(self, bloque: Bloque, previo: Bloque) -> bool:
+        """
+        Comprueba que un bloque de la versión 3 o posterior lleva exactamente una transacción con origen "0" (el pago
+        al minero), sin comisión y por recompensa_bloque más las comisiones del resto de transacciones del bloque. Los
+        bloques anteriores a la versión 3 se aceptan como estaban, pero un bloque no puede tener una versión anterior
+        a la de su previo, para que no se pueda eludir la comprobación.
+        :param bloque: bloque.
+        :param previo: bloque anterior de la cadena.
+        :return: True si la recompensa es válida, False en caso contrario
+        """
+        if bloque.version < previo.version:
+            return False
+        if bloque.version < VERSION_OBJETIVO:
+            return True
+        recompensas = [transaccion for transaccion in bloque.transacciones if transaccion.origen == "0"]
+        if len(recompensas) != 1 or recompensas[0].comision != 0:
+            return False
+        comisiones = sum(transaccion.comision for transaccion in bloque.transacciones if transaccion.origen != "0")
+        return recompensas[0].cantidad == self.recompensa_bloque + comisiones
+
     @staticmethod
     def prueba_valida(bloque: Bloque, hash_bloque: str) -> bool:
         """
-        Método que comprueba si el hash_bloque comienza con tantos ceros como la dificultad estipulada en el blockchain.
+        Método que comprueba si el hash_bloque, como número, es menor que el objetivo del bloque (ver objetivo_bloque).
         Además, revisará que hash_bloque coincide con el valor devuelto del método de calcular hash del bloque.
-        Si cualquiera de ambas comprobaciones es falsa, devolverá falso y en caso contrario, verdadero.
+        Si cualquiera de ambas comprobaciones es falsa, devolverá falso y en caso contrario, verdadero. Que el objetivo
+        sea el que corresponde en la cadena se comprueba al enlazar el bloque (ver objetivo_siguiente).
         :param bloque: Bloque a comprobar.
         :param hash_bloque: valor de hash bloque buscado
         :return: True o False, si coincide o no coincide con el bloque dado
         """
-        return hash_bloque.startswith('0' * Blockchain.dificultad) and hash_bloque == bloque.calcular_hash()
+        try:
+            valor = int(hash_bloque, 16)
+        except (TypeError, ValueError):
+            return False
+        return valor < Blockchain.objetivo_bloque(bloque) and hash_bloque == bloque.calcular_hash()
 
     @staticmethod
-    def prueba_trabajo(bloque: Bloque) -> str:
+    def prueba_trabajo(bloque: Bloque, procesos: int = 1, intentos: Optional[Contador] = None,
+                       separado: bool = False) -> str:
         """
         Algoritmo simple de prueba de trabajo:
-        - Calculará el hash del bloque hasta que encuentre un hash que empiece
-          por tantos ceros como dificultad.
+        - Calculará el hash del bloque hasta que encuentre un hash menor que
+          el objetivo del bloque.
         - Cada vez que el bloque obtenga un hash que no sea adecuado,
           incrementara en uno el campo de ``prueba del bloque''.
+        El bloque se serializa una sola vez (ver MotorMinado), por lo que cada intento solo calcula el hash.
         :param bloque: objeto de tipo bloque.
+        :param procesos: número de procesos entre los que se reparte la búsqueda (default: 1).
+        :param intentos: contador compartido en el que se acumulan las pruebas realizadas (default: None).
+        :param separado: si es True, se mina en otros procesos aunque procesos sea 1 (default: False).
         :return: el hash del nuevo bloque (dejará el campo de hash del bloque sin modificar).
         """
-        bloque.prueba = 0
-
-        hash_calculado = bloque.calcular_hash()
-        while not hash_calculado.startswith('0' * Blockchain.dificultad):
-            bloque.prueba += 1
-            hash_calculado = bloque.calcular_hash()
+        motor = MotorMinado.desde_bloque(bloque, Blockchain.objetivo_bloque(bloque))
+        bloque.prueba, hash_calculado = motor.buscar_paralelo(procesos, intentos, separado)
         return hash_calculado
 
-    def nuevo_bloque(self, hash_previo: str) -> Bloque:
+    def nuevo_bloque(self, hash_previo: str, minero: Optional[str] = None) -> Bloque:
         """
-        Crea un nuevo bloque a partir de las transacciones que no están confirmadas.
+        Crea un nuevo bloque (de la versión 3, con el objetivo que le corresponde en la cadena) con las transacciones no
+        confirmadas de mayor prioridad (hasta max_transacciones_bloque, contando la recompensa). Las transacciones no se
+        retiran hasta que el bloque se integra, y las que lleguen mientras se mina el bloque se quedan para el
+        siguiente.
         :param hash_previo: el hash del bloque anterior de la cadena
+        :param minero: cuenta a la que se paga, al final del bloque, recompensa_bloque más las comisiones de las
+        transacciones incluidas (ver recompensa_valida). Sin ella, el bloque no tiene pago al minero y solo sirve
+        para medir el minado, pues integra_bloque no lo aceptará (default: None)
         :return: nuevo bloque
         """
-        return Bloque(self.ultimo_bloque.indice + 1, self.transacciones_sin_confirmar, hash_previo, timestamp=time())
+        numero = self.max_transacciones_bloque - (minero is not None)
+        with self.cerrojo_pendientes:
+            transacciones = self.transacciones_sin_confirmar.seleccionar(numero)
+        if minero is not None:
+            # El minero cobra además las comisiones de las transacciones del bloque
+            comisiones = sum(transaccion.comision for transaccion in transacciones)
+            transacciones.append(Transaccion("0", minero, self.recompensa_bloque + comisiones))
+        instantanea = self.instantanea
+        return Bloque(instantanea.ultimo_bloque.indice + 1, transacciones, hash_previo, timestamp=time(),
+                      version=VERSION_OBJETIVO, objetivo=self.objetivo_siguiente(instantanea))
 
     def integra_bloque(self, bloque_nuevo: Bloque, hash_prueba: str) -> bool:
         """
         Método para integrar correctamente un bloque a la cadena de bloques. Debe comprobar que la prueba de hash es
-        válida y que el hash del bloque último de la cadena coincida con el hash_previo del bloque que se va a
-        integrar. Si pasa las comprobaciones, actualiza el hash del bloque a integrar, lo inserta en la cadena y hace
-        un reset de las transacciones no confirmadas (vuelve a dejar la lista de transacciones no confirmadas a una
-        lista vacía).
+        válida, que el objetivo del bloque es el que le corresponde, que el hash del bloque último de la cadena
+        coincida con el hash_previo del bloque que se va a integrar, que sus transacciones no estén repetidas ni ya
+        confirmadas y que el pago al minero sea correcto (ver recompensa_valida). Si pasa las comprobaciones, actualiza
+        el hash del bloque a integrar, lo inserta en la cadena y retira de las transacciones no confirmadas aquellas que
+        incluye el bloque y las que ya no cubre el saldo de su origen.
         :param bloque_nuevo: el nuevo bloque que se va a integrar.
         :param hash_prueba: prueba del hash del bloque.
         :return: bool. True si se consiguió integrar, False en caso contrario.
         """
-        hash_previo = self.ultimo_bloque.hash_bloque
-        if hash_previo != bloque_nuevo.hash_previo:
-            return False
+        with self.cerrojo_cadena:
+            hash_previo = self.ultimo_bloque.hash_bloque
+            if hash_previo != bloque_nuevo.hash_previo:
+                return False
 
-        if not self.prueba_valida(bloque_nuevo, hash_prueba):
-            return False
+            if self.objetivo_bloque(bloque_nuevo) != self.objetivo_siguiente(self.cadena):
+                return False
 
-        bloque_nuevo.hash_bloque = hash_prueba
-        self.cadena.append(bloque_nuevo)
-        self.transacciones_sin_confirmar = []
+            if not self.prueba_valida(bloque_nuevo, hash_prueba):
+                return False
+
+            if not self.transacciones_unicas(bloque_nuevo, self.transacciones_por_id.__contains__):
+                return False
+
+            if not self.recompensa_valida(bloque_nuevo, self.ultimo_bloque):
+                return False
+
+            bloque_nuevo.hash_bloque = hash_prueba
+            try:
+                self.persistir(len(self.cadena), [bloque_nuevo])
+            except Exception:
+                bloque_nuevo.hash_bloque = None
+                raise
+            with self.cerrojo_pendientes:
+                self.cadena.append(bloque_nuevo)
+                self.indexar_bloque(bloque_nuevo)
+                self.transacciones_sin_confirmar.retirar(map(id_transaccion, bloque_nuevo.transacciones))
+                self._ajustar_pendientes([bloque_nuevo])
+            self.publicar()
         return True
 
-    def nueva_transaccion(self, origen: str, destino: str, cantidad: int) -> int:
+    def sustituir(self, nueva: 'Blockchain'):
+        """
+        Sustituye la cadena por la de otra blockchain, conservando las transacciones pendientes que esta no incluya y
+        reescribiendo con ella el almacén persistente. El objeto se conserva, por lo que quien tenga una referencia a
+        él pasa a ver la cadena nueva.
+        :param nueva: blockchain cuya cadena se adopta (no debe seguir usándose).
+        :return: None
+        """
+        with self.cerrojo_cadena:
+            self.persistir(0, nueva.cadena)
+            with self.cerrojo_pendientes:
+                anteriores = self.transacciones_sin_confirmar
+                self.cadena = nueva.cadena
+                self.bloques_por_hash = nueva.bloques_por_hash
+                self.transacciones_por_id = nueva.transacciones_por_id
+                self.trabajos = nueva.trabajos
+                self.saldos = nueva.saldos
+                self.reorganizacion = nueva.reorganizacion
+                self.transacciones_sin_confirmar = Mempool(self.max_transacciones_pendientes,
+                                                           self.max_bytes_pendientes)
+                for transaccion in anteriores:
+                    if transaccion.id not in self.transacciones_por_id:
+                        self._reanadir(transaccion)
+            self.publicar()
+
+    def anadir_transaccion(self, transaccion: Transaccion) -> int:
+        """
+        Incluye una transacción en las transacciones no confirmadas. Lanza TransaccionRechazada si ya está confirmada o
+        pendiente, si no cabe entre las pendientes, si la cantidad no es positiva, si su origen es "0" o si su origen
+        no tiene saldo suficiente (contando lo que ya envía en otras transacciones pendientes). Solo el pago al minero,
+        que no pasa por las pendientes (ver nuevo_bloque), puede tener origen "0".
+        :param transaccion: transacción.
+        :return: el índice del bloque en el que se espera incluirla
+        """
+        if transaccion.cantidad <= 0 or transaccion.comision < 0:
+            raise TransaccionRechazada("La cantidad debe ser positiva y la comision no negativa")
+        if transaccion.origen == "0":
+            raise TransaccionRechazada("Solo el pago al minero puede tener origen 0")
+        with self.cerrojo_pendientes:
+            if transaccion.id in self.transacciones_por_id:
+                raise TransaccionRechazada("La transaccion ya esta confirmada")
+            if self.saldo(transaccion.origen)['disponible'] < transaccion.gasto():
+                raise TransaccionRechazada(f"Saldo insuficiente en la cuenta {transaccion.origen}")
+            self.transacciones_sin_confirmar.anadir(transaccion)
+            return len(self.cadena) + 1
+
+    def anadir_transacciones(self, transacciones: Iterable[Transaccion]) -> List[Union[int, TransaccionRechazada]]:
+        """
+        Incluye varias transacciones adquiriendo cerrojo_pendientes una sola vez (ver anadir_transaccion).
+        :param transacciones: transacciones.
+        :return: por cada transacción, el índice del bloque en el que se espera incluirla o el error por el que se
+        rechazó
+        """
+        resultados = []
+        with self.cerrojo_pendientes:
+            for transaccion in transacciones:
+                try:
+                    resultados.append(self.anadir_transaccion(transaccion))
+                except TransaccionRechazada as error:
+                    resultados.append(error)
+        return resultados
+
+    def nueva_transaccion(self, origen: str, destino: str, cantidad: int, timestamp: Optional[float] = None,
+                          comision: int = 0) -> int:
         """
         Crea una nueva transaccion a partir de un origen, un destino y una cantidad y la incluye en las listas de
-        transacciones.
+        transacciones (ver anadir_transaccion).
         :param origen: Originario de la transacción.
         :param destino: Destinatario de la transacción.
         :param cantidad: la cantidad.
-        :return: el hash del nuevo bloque (dejará el campo de hash del bloque sin modificar)
+        :param timestamp: momento de creación; si se indica, reenviar la misma transacción no la duplica
+        (default: el momento actual).
+        :param comision: comisión ofrecida al minero (default: 0).
+        :return: el índice del bloque en el que se espera incluirla
         """
-        nueva_transaccion = Transaccion(origen, destino, cantidad)
-        self.transacciones_sin_confirmar.append(nueva_transaccion.__dict__)
-        return len(self.cadena) + 1
+        return self.anadir_transaccion(Transaccion(origen, destino, cantidad, timestamp, comision))
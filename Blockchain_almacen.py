@@ -0,0 +1,173 @@
+"""
+Blockchain_almacen.py implementa el almacenamiento persistente de la blockchain: un registro de solo añadido con un
+bloque por entrada (cuatro bytes con la longitud seguidos del bloque en la codificación binaria de Blockchain_codec) y
+un índice de desplazamientos con ocho bytes por bloque. Los registros escritos antes en JSON se siguen pudiendo leer.
+Cada bloque integrado se añade al final y se sincroniza con el disco, por lo que nunca se reescribe la cadena entera
+salvo que se sustituya por completo.
+
+AUTORES: SERGIO RODRÍGUEZ VIDAL Y JAIME PAZ RODRÍGUEZ
+"""
+
+import json
+import os
+import struct
+
+from array import array
+from Blockchain import Bloque
+from Blockchain_codec import codificar_bloque, decodificar_bloque
+from typing import Iterator, List
+
+CABECERA_REGISTRO = struct.Struct('>I')
+
+
+def decodificar_registro(datos: bytes) -> Bloque:
+    """
+    Decodifica un bloque del registro, en la codificación binaria o en JSON (registros antiguos).
+    :param datos: bytes del bloque, sin la longitud.
+    :return: bloque (con su hash asignado)
+    """
+    if datos[:1] == b'{':
+        return Bloque.from_dict(json.loads(datos), con_hash=True)
+    return decodificar_bloque(datos)
+
+
+class AlmacenBloques(object):
+    def __init__(self, ruta: str):
+        """
+        Constructor de la clase 'AlmacenBloques'. Abre (o crea) el registro de bloques y su índice. Si la última
+        escritura quedó a medias, descarta el registro incompleto; si el índice no está al día, lo completa.
+        :param ruta: path del registro de bloques. El índice se guarda en el mismo path con extensión '.idx'.
+        """
+        self.ruta = ruta
+        self.ruta_indice = ruta + '.idx'
+        self.registro = open(ruta, 'a+b')
+        self.indice = open(self.ruta_indice, 'a+b')
+        self.desplazamientos = array('Q')
+        self._recuperar()
+
+    def _recuperar(self):
+        """
+        Carga el índice de desplazamientos y lo contrasta con el registro, recorriendo solo los bloques posteriores al
+        último indexado.
+        """
+        self.indice.seek(0)
+        datos = self.indice.read()
+        self.desplazamientos.extend(struct.unpack(f'>{len(datos) // 8}Q', datos[:len(datos) - len(datos) % 8]))
+
+        tamano = os.path.getsize(self.ruta)
+        while self.desplazamientos and self.desplazamientos[-1] >= tamano:
+            self.desplazamientos.pop()
+        posicion = self.desplazamientos.pop() if self.desplazamientos else 0
+        indexados = len(self.desplazamientos)
+
+        self.registro.seek(posicion)
+        while posicion + CABECERA_REGISTRO.size <= tamano:
+            longitud, = CABECERA_REGISTRO.unpack(self.registro.read(CABECERA_REGISTRO.size))
+            if posicion + CABECERA_REGISTRO.size + longitud > tamano:
+                break
+            self.desplazamientos.append(posicion)
+            posicion += CABECERA_REGISTRO.size + longitud
+            self.registro.seek(posicion)
+
+        if posicion != tamano:
+            self.registro.truncate(posicion)
+        self._escribir_indice(indexados)
+
+    def _escribir_indice(self, desde: int):
+        """
+        Reescribe el índice de desplazamientos a partir del bloque desde.
+        """
+        self.indice.truncate(desde * 8)
+        self.indice.seek(0, os.SEEK_END)
+        self.indice.write(struct.pack(f'>{len(self.desplazamientos) - desde}Q', *self.desplazamientos[desde:]))
+        self.indice.flush()
+
+    def __len__(self):
+        """
+        Devuelve el número de bloques almacenados
+        :return: número de bloques
+        """
+        return len(self.desplazamientos)
+
+    def anadir(self, bloque: Bloque):
+        """
+        Añade un bloque al final del registro y lo sincroniza con el disco.
+        :param bloque: bloque (con su hash asignado).
+        :return: None
+        """
+        self._anadir_registro(codificar_bloque(bloque))
+
+    def _anadir_registro(self, datos: bytes):
+        """
+        Añade un bloque ya codificado al final del registro. Si la escritura falla, descarta lo que se haya llegado a
+        escribir y relanza el error.
+        """
+        self.registro.seek(0, os.SEEK_END)
+        posicion = self.registro.tell()
+        try:
+            self.registro.write(CABECERA_REGISTRO.pack(len(datos)) + datos)
+            self.registro.flush()
+            os.fsync(self.registro.fileno())
+        except OSError:
+            self.registro.truncate(posicion)
+            raise
+        self.desplazamientos.append(posicion)
+        self._escribir_indice(len(self.desplazamientos) - 1)
+
+    def reemplazar(self, desde: int, bloques: List[Bloque]):
+        """
+        Sustituye los bloques almacenados a partir de la posición desde por los indicados. Todos se codifican antes de
+        tocar el registro, por lo que si alguno no se puede codificar (ErrorCodificacion) el almacén no cambia.
+        :param desde: posición del primer bloque que se sustituye.
+        :param bloques: bloques (con su hash asignado).
+        :return: None
+        """
+        registros = [codificar_bloque(bloque) for bloque in bloques]
+        self.truncar(desde)
+        for datos in registros:
+            self._anadir_registro(datos)
+
+    def truncar(self, longitud: int):
+        """
+        Descarta los bloques almacenados a partir de la posición longitud (quedan los longitud primeros).
+        :param longitud: número de bloques que se conservan.
+        :return: None
+        """
+        if longitud >= len(self):
+            return
+        self.registro.truncate(self.desplazamientos[longitud])
+        self.registro.flush()
+        os.fsync(self.registro.fileno())
+        del self.desplazamientos[longitud:]
+        self._escribir_indice(longitud)
+
+    def leer(self, desde: int = 0) -> Iterator[Bloque]:
+        """
+        Lee los bloques almacenados en orden, a partir de la posición desde.
+        :param desde: posición del primer bloque a leer (default: 0).
+        :return: iterador de bloques (con su hash asignado)
+        """
+        return map(decodificar_registro, self.leer_registros(desde))
+
+    def leer_registros(self, desde: int = 0) -> Iterator[bytes]:
+        """
+        Lee los bloques almacenados en orden, a partir de la posición desde, sin decodificarlos (ver
+        decodificar_registro).
+        :param desde: posición del primer bloque a leer (default: 0).
+        :return: iterador de bloques codificados
+        """
+        if desde >= len(self):
+            return
+        with open(self.ruta, 'rb') as registro:
+            registro.seek(self.desplazamientos[desde])
+            for _ in range(len(self) - desde):
+                longitud, = CABECERA_REGISTRO.unpack(registro.read(CABECERA_REGISTRO.size))
+                yield registro.read(longitud)
+
+    def cerrar(self):
+        """
+        Cierra los ficheros del almacén.
+        :return: None
+        """
+        self.registro.close()
+        self.indice.close()
@@ -4,35 +4,169 @@ Blockchain. Esta aplicación será lanzada desde una terminal mediante el comand
 
 $ python Blockchain_app.py -p <especificar un puerto>
 
+que la sirve con un servidor WSGI multihilo (waitress). También puede crearse desde código con create_app(config), por
+ejemplo para servirla con otro servidor WSGI (con un único proceso y varios hilos: el estado del nodo vive en memoria).
+Las métricas del nodo se sirven en GET /metrics en el formato de texto de Prometheus (ver Blockchain_metricas). Los
+bloques integrados y las transacciones aceptadas se anuncian por su hash a los nodos de la red, que descargan solo los
+que no tienen (ver Nodo.anunciar).
+
 AUTORES: SERGIO RODRÍGUEZ VIDAL Y JAIME PAZ RODRÍGUEZ
 """
 
 import Blockchain
+import Blockchain_almacen
+import Blockchain_codec
+import Blockchain_metricas
+import Blockchain_red
+import gzip
 import json
-import requests
+import math
 
 import platform
 import socket
 from argparse import ArgumentParser
 
-from flask import Flask, jsonify, request
-from threading import Semaphore, Timer
-from typing import List
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, Flask, Response, current_app, jsonify, request
+from multiprocessing import Value
+from threading import Lock, Thread
+from time import perf_counter, time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from uuid import uuid4
+
+# Trabajos de minado que recuerda cada nodo (los últimos)
+MAX_TRABAJOS_MINADO = 100
+# Nivel de compresión gzip de las cadenas que se envían a otros nodos
+NIVEL_COMPRESION = 6
+# Identificadores de transacciones anunciadas que se piden en cada petición a /transacciones/pendientes, para que la
+# URL no supere el límite de la línea de petición del servidor
+MAX_IDS_PETICION = 200
+
+# Configuración de un nodo (ver create_app)
+CONFIGURACION_POR_DEFECTO = {
+    'puerto': 5000,
+    # Número de procesos entre los que se reparte la prueba de trabajo y si se mina siempre fuera del proceso del
+    # servidor, para que el minado no compita con las peticiones
+    'procesos_minado': 1,
+    'minado_separado': True,
+    'timeout_nodos': 2.,
+    # Dirección con la que otros nodos contactan con este (None: la que usan al registrarlo o, si no, la de mi_ip) y
+    # número de bloques y transacciones anunciados que recuerda para descartar los anuncios repetidos
+    'direccion': None,
+    'max_vistos': 10000,
+    # Registro de bloques del nodo (None: bloques-nodo<ip>-<puerto>.log) y, opcionalmente, fichero del que cargar la
+    # cadena al arrancar, punto de control y procesos para decodificarla y verificarla
+    'almacen': None,
+    'cargar': None,
+    'punto_control': None,
+    'procesos_carga': 1,
+    # Si se activa el perfilador por muestreo al arrancar (también se puede activar después con POST /perfilador)
+    'perfilador': False,
+    'max_pendientes': Blockchain.Blockchain.max_transacciones_pendientes,
+    'max_bytes_pendientes': Blockchain.Blockchain.max_bytes_pendientes,
+    'max_transacciones_bloque': Blockchain.Blockchain.max_transacciones_bloque,
+    # Tiempo objetivo entre bloques (en segundos) y cada cuántos bloques se reajusta el objetivo de la prueba de trabajo
+    # (0 para no reajustarlo)
+    'intervalo_bloques': Blockchain.Blockchain.intervalo_bloques,
+    'bloques_reajuste': Blockchain.Blockchain.bloques_reajuste,
+    # Cantidad que cobra el minero de cada bloque (además de las comisiones); debe ser la misma en toda la red
+    'recompensa': Blockchain.Blockchain.recompensa_bloque
+}
+# Claves de la configuración que son parámetros de la blockchain de cada nodo, con su atributo en Blockchain
+PARAMETROS_BLOCKCHAIN = {
+    'max_pendientes': 'max_transacciones_pendientes',
+    'max_bytes_pendientes': 'max_bytes_pendientes',
+    'max_transacciones_bloque': 'max_transacciones_bloque',
+    'intervalo_bloques': 'intervalo_bloques',
+    'bloques_reajuste': 'bloques_reajuste',
+    'recompensa': 'recompensa_bloque'
+}
 
-# Instancia del nodo
-app = Flask(__name__)
 
-# Instancia de la aplicación
-blockchain = Blockchain.Blockchain()
+class MetricasNodo(object):
+    def __init__(self, registro: Blockchain_metricas.RegistroMetricas):
+        """
+        Constructor de la clase 'MetricasNodo': métricas propias de un nodo (minado, sincronización, anuncios y estado
+        de la cadena), en el registro del nodo, en el que también recogen las suyas su blockchain y su cliente de red.
+        :param registro: registro de métricas del nodo.
+        """
+        self.registro = registro
+        self.intentos_minado = registro.contador('blockchain_minado_intentos_total',
+                                                 'Nonces probados en la prueba de trabajo')
+        self.trabajos_minado = registro.contador('blockchain_minado_trabajos_total', 'Trabajos de minado terminados',
+                                                 ('estado',))
+        self.duracion_minado = registro.histograma('blockchain_minado_bloque_segundos',
+                                                   'Tiempo de cada trabajo de minado completado')
+        self.hashrate_minado = registro.indicador('blockchain_minado_hashrate',
+                                                  'Hashes por segundo del ultimo trabajo de minado')
+        self.duracion_sincronizacion = registro.histograma('blockchain_sincronizacion_segundos',
+                                                           'Duracion de la resolucion de conflictos con la red',
+                                                           ('resultado',))
+        self.altura = registro.indicador('blockchain_altura', 'Numero de bloques de la cadena')
+        self.pendientes = registro.indicador('blockchain_pendientes_transacciones',
+                                             'Transacciones pendientes de confirmar')
+        self.bytes_pendientes = registro.indicador('blockchain_pendientes_bytes',
+                                                   'Tamano de las transacciones pendientes')
+        self.nodos_red = registro.indicador('blockchain_nodos_red', 'Nodos registrados en la red')
+        self.anuncios_recibidos = registro.contador('blockchain_anuncios_recibidos_total',
+                                                    'Bloques y transacciones anunciados por otros nodos',
+                                                    ('tipo', 'resultado'))
 
-# Nodos registrados en la red
-nodos_red = set()
 
-# Para saber mi ip
-mi_ip = socket.gethostbyname(socket.gethostname())
+class TrabajoMinado(object):
+    def __init__(self, bloque: Blockchain.Bloque, metricas: MetricasNodo):
+        """
+        Constructor de la clase 'TrabajoMinado'. Un trabajo mina un bloque construido a partir de una copia de las
+        transacciones pendientes en el momento de crearlo.
+        :param bloque: bloque a minar.
+        :param metricas: métricas del nodo que lanza el trabajo.
+        """
+        self.id = uuid4().hex
+        self.metricas = metricas
+        self.bloque = bloque
+        self.estado = 'minando'
+        self.mensaje = None
+        self.hash_bloque = None
+        self.intentos = Value('Q', 0)
+        self.inicio = time()
+        self.fin = None
 
-# Semáforo mutex
-mutex = Semaphore(1)
+    def terminar(self, estado: str, mensaje: str):
+        """
+        Marca el trabajo como terminado.
+        :param estado: estado final ('completado', 'descartado' o 'error').
+        :param mensaje: mensaje explicativo del resultado.
+        :return: None
+        """
+        self.fin = time()
+        self.estado = estado
+        self.mensaje = mensaje
+        self.metricas.trabajos_minado.incrementar(estado=estado)
+        self.metricas.intentos_minado.incrementar(self.intentos.value)
+        self.metricas.hashrate_minado.fijar(self.to_dict()['hashrate'])
+        if self.hash_bloque is not None:
+            self.metricas.duracion_minado.observar(self.fin - self.inicio)
+
+    def to_dict(self) -> Dict:
+        """
+        Convierte el trabajo a un diccionario con su progreso.
+        :return: Diccionario del trabajo
+        """
+        segundos = (self.fin or time()) - self.inicio
+        intentos = self.intentos.value
+        return {
+                'id': self.id,
+                'estado': self.estado,
+                'indice': self.bloque.indice,
+                'transacciones': len(self.bloque.transacciones),
+                'intentos': intentos,
+                'segundos': segundos,
+                'hashrate': intentos / segundos if segundos > 0 else 0.,
+                'prueba': self.bloque.prueba if self.hash_bloque is not None else None,
+                'hash_bloque': self.hash_bloque,
+                'mensaje': self.mensaje
+                }
 
 
 class ErrorIntegracionBloque(Exception):
@@ -44,7 +178,399 @@ class ErrorIntegracionBloque(Exception):
         super(ErrorIntegracionBloque, self).__init__()
 
 
-@app.route('/system', methods=['GET'])
+class Nodo(object):
+    def __init__(self, configuracion: Dict, registro: Blockchain_metricas.RegistroMetricas):
+        """
+        Constructor de la clase 'Nodo': reúne todo el estado de un nodo (su blockchain, los nodos de la red, el cliente
+        para contactar con ellos y los trabajos de minado). La blockchain se protege a sí misma: las lecturas usan su
+        instantánea sin bloquearse y las escrituras toman sus cerrojos internos. El atributo blockchain no se reasigna
+        mientras el nodo atiende peticiones (para cambiar de cadena se usa Blockchain.sustituir).
+        :param configuracion: configuración completa del nodo (ver CONFIGURACION_POR_DEFECTO).
+        :param registro: registro de las métricas del nodo, que se sirven en /metrics.
+        """
+        self.configuracion = configuracion
+        self.metricas = MetricasNodo(registro)
+        self.puerto = configuracion['puerto']
+        self.procesos_minado = configuracion['procesos_minado']
+        self.minado_separado = configuracion['minado_separado']
+        # Para saber mi ip
+        self.mi_ip = socket.gethostbyname(socket.gethostname())
+        # Nodos registrados en la red
+        self.nodos_red = set()
+        # Cliente para las peticiones a otros nodos (conexiones reutilizables, timeouts, reintentos y nodos caídos)
+        self.cliente = Blockchain_red.ClientePares(timeout=configuracion['timeout_nodos'], metricas=registro)
+        # Dirección que se indica a otros nodos en los anuncios, bloques y transacciones ya vistos y un único hilo que
+        # procesa los anuncios recibidos en orden
+        self.direccion = configuracion['direccion'] or f'http://{self.mi_ip}:{self.puerto}/'
+        self.vistos = Blockchain_red.CacheVistos(configuracion['max_vistos'])
+        self.ejecutor_anuncios = ThreadPoolExecutor(max_workers=1)
+        # Trabajos de minado lanzados (se recuerdan los MAX_TRABAJOS_MINADO últimos)
+        self.trabajos_minado = OrderedDict()
+        self.cerrojo_trabajos = Lock()
+        # Perfilador por muestreo (desactivado salvo que se pida)
+        self.perfilador = Blockchain_metricas.PerfiladorMuestreo()
+        if configuracion['perfilador']:
+            self.perfilador.activar()
+        # Última copia comprimida de la cadena completa servida a otros nodos: (hash del último bloque, bytes)
+        self.copia_cadena = None
+        self.cerrojo_copia = Lock()
+
+        almacen = Blockchain_almacen.AlmacenBloques(configuracion['almacen'] or
+                                                    f'bloques-nodo{self.mi_ip}-{self.puerto}.log')
+        parametros = {atributo: configuracion[clave] for clave, atributo in PARAMETROS_BLOCKCHAIN.items()}
+        self.blockchain = cargar_blockchain(almacen, configuracion['cargar'], configuracion['procesos_carga'],
+                                            configuracion['punto_control'], metricas=registro, **parametros)
+
+    def crear_trabajo_minado(self, cuenta: Optional[str] = None) -> Optional[TrabajoMinado]:
+        """
+        Crea un trabajo de minado con las transacciones pendientes de mayor prioridad y el pago al minero (a la cuenta
+        indicada o, si no, a mi_ip). Si se indica la cuenta, el bloque se mina aunque no haya transacciones pendientes,
+        con lo que la cuenta cobra la recompensa (la única forma de crear dinero).
+        :param cuenta: cuenta que cobra el pago al minero (default: None).
+        :return: el trabajo creado, o None si no hay transacciones pendientes ni se ha indicado la cuenta.
+        """
+        if not self.blockchain.transacciones_sin_confirmar and cuenta is None:
+            return None
+        nuevo_bloque = self.blockchain.nuevo_bloque(hash_previo=self.blockchain.instantanea.ultimo_bloque.hash_bloque,
+                                                    minero=cuenta or self.mi_ip)
+        trabajo = TrabajoMinado(nuevo_bloque, self.metricas)
+        with self.cerrojo_trabajos:
+            self.trabajos_minado[trabajo.id] = trabajo
+            # Solo se recuerdan los últimos trabajos
+            while len(self.trabajos_minado) > MAX_TRABAJOS_MINADO:
+                self.trabajos_minado.popitem(last=False)
+        return trabajo
+
+    def ejecutar_trabajo_minado(self, trabajo: TrabajoMinado):
+        """
+        Realiza la prueba de trabajo del bloque del trabajo sin bloquear la cadena (en otros procesos si
+        minado_separado), resuelve los conflictos con la red e integra el bloque. El resultado queda registrado en el
+        propio trabajo.
+        :param trabajo: trabajo de minado.
+        :return: None
+        """
+        nuevo_bloque = trabajo.bloque
+        try:
+            prueba = Blockchain.Blockchain.prueba_trabajo(nuevo_bloque, procesos=self.procesos_minado,
+                                                          intentos=trabajo.intentos, separado=self.minado_separado)
+            trabajo.hash_bloque = prueba
+            # Se comprueba si existen conflictos
+            resuelve_conflicto = self.resuelve_conflictos()
+            # Si ha habido conflictos, se resuelven y se descarta el bloque minado (las transacciones siguen pendientes)
+            if resuelve_conflicto:
+                trabajo.terminar('descartado',
+                                 "Ha habido un conflicto. Esta cadena se ha actualizado con una version mas larga.")
+                return
+            resultado = self.blockchain.integra_bloque(nuevo_bloque, prueba)
+            # Si no se pudo integrar correctamente, el pago al minero nunca llegó a las transacciones pendientes
+            if not resultado:
+                trabajo.terminar('descartado', "No es posible integrar el nuevo bloque.")
+            # Si sí se integra correctamente, se anuncia a la red y se manda un mensaje de minado satisfactorio.
+            else:
+                self.anunciar(bloques=[prueba])
+                trabajo.terminar('completado', f"El bloque {nuevo_bloque.indice} se ha minado satisfactoriamente.")
+        except Exception as error:
+            trabajo.terminar('error', str(error))
+
+    def resuelve_conflictos(self) -> bool:
+        """
+        Mecanismo para establecer el consenso y resolver los conflictos. Para llegar a un consenso se escoge la cadena
+        con más trabajo acumulado. Primero se piden solo las cabeceras de los nodos; del nodo elegido se descargan
+        únicamente los bloques posteriores al último bloque común, que se verifican y se enlazan sobre la cadena
+        actual. Solo si las cadenas no comparten ningún bloque se descarga la cadena completa (ver descargar_bloques).
+        La duración se recoge en las métricas según el resultado.
+        :return: True si la cadena se ha sustituido por la de otro nodo, False en caso contrario.
+        """
+        return self._medir_sincronizacion(self._resuelve_conflictos)
+
+    def sincronizar_con(self, direccion: str) -> bool:
+        """
+        Sincroniza la cadena con la de un nodo concreto: si la suya tiene más trabajo acumulado, descarga solo los
+        bloques posteriores al último bloque común (o la cadena completa, si no comparten ninguno).
+        :param direccion: dirección del nodo.
+        :return: True si la cadena se ha sustituido por la del nodo, False en caso contrario.
+        """
+        return self._medir_sincronizacion(lambda: self._sincronizar_con(direccion))
+
+    def _medir_sincronizacion(self, sincronizacion: Callable[[], Tuple[str, bool]]) -> bool:
+        """
+        Ejecuta una sincronización y recoge su duración en las métricas según su resultado.
+        """
+        inicio = perf_counter()
+        resultado = 'fallo'
+        try:
+            resultado, sustituida = sincronizacion()
+            return sustituida
+        finally:
+            self.metricas.duracion_sincronizacion.observar(perf_counter() - inicio, resultado=resultado)
+
+    def _resuelve_conflictos(self) -> Tuple[str, bool]:
+        """
+        Resuelve los conflictos con la red (ver resuelve_conflictos).
+        :return: tupla (resultado: 'sin_cambios', 'completa', 'sufijo' o 'fallo'; si se ha sustituido la cadena)
+        """
+        instantanea = self.blockchain.instantanea
+        trabajo_actual = instantanea.trabajo
+        localizador = ','.join(instantanea.localizador())
+        # Pide las cabeceras a todos los nodos en paralelo y comprueba si alguna cadena tiene más trabajo que la mejor
+        # encontrada hasta el momento
+        mejor_nodo, mejor_cabecera = None, None
+        respuestas = self.cliente.difundir('GET', list(self.nodos_red), '/chain/cabecera',
+                                           params={'localizador': localizador})
+        for direccion, respuesta in respuestas.items():
+            cabecera = self._leer_cabecera(direccion, respuesta)
+            # Un nodo que responde con una cabecera no válida no impide consultar al resto
+            if cabecera is None:
+                continue
+            if cabecera['trabajo'] > trabajo_actual:
+                trabajo_actual = cabecera['trabajo']
+                mejor_nodo, mejor_cabecera = direccion, cabecera
+
+        if mejor_nodo is None:
+            return 'sin_cambios', False
+        return self.descargar_bloques(mejor_nodo, mejor_cabecera['ancestro'])
+
+    def _sincronizar_con(self, direccion: str) -> Tuple[str, bool]:
+        """
+        Sincroniza la cadena con la de un nodo concreto (ver sincronizar_con).
+        :return: tupla (resultado, si se ha sustituido la cadena)
+        """
+        instantanea = self.blockchain.instantanea
+        respuesta = self.cliente.get(direccion, '/chain/cabecera',
+                                     params={'localizador': ','.join(instantanea.localizador())})
+        if respuesta is None or not respuesta.ok:
+            return 'fallo', False
+        cabecera = self._leer_cabecera(direccion, respuesta)
+        if cabecera is None:
+            return 'fallo', False
+        if cabecera['trabajo'] <= instantanea.trabajo:
+            return 'sin_cambios', False
+        return self.descargar_bloques(direccion, cabecera['ancestro'])
+
+    def _leer_cabecera(self, direccion: str, respuesta) -> Optional[Dict]:
+        """
+        Lee la cabecera de la cadena de un nodo (ver /chain/cabecera con localizador). Si la respuesta no es un objeto
+        JSON con el trabajo acumulado y el índice del último bloque común (enteros; el índice puede ser None), la
+        petición cuenta como fallida para la salud del nodo.
+        :param direccion: dirección del nodo.
+        :param respuesta: respuesta del nodo.
+        :return: la cabecera, o None si no es válida
+        """
+        try:
+            cabecera = respuesta.json()
+            trabajo, ancestro = cabecera['trabajo'], cabecera['ancestro']
+        except (ValueError, KeyError, TypeError):
+            cabecera, trabajo, ancestro = None, None, None
+        # type(...) is int excluye los booleanos
+        if type(trabajo) is not int or not (ancestro is None or type(ancestro) is int):
+            self.cliente.registrar_fallo(direccion)
+            return None
+        return cabecera
+
+    def descargar_bloques(self, direccion: str, ancestro: Optional[int]) -> Tuple[str, bool]:
+        """
+        Descarga de un nodo los bloques posteriores al último bloque común y los enlaza sobre la cadena actual. Si no
+        hay bloque común, descarga la copia comprimida de su cadena completa (/chain/instantanea), la verifica (en
+        paralelo, con procesos_carga procesos) y, si tiene más trabajo acumulado, sustituye la cadena por ella. Si el
+        nodo responde con datos que no se pueden decodificar o con bloques no válidos, el resultado es 'fallo'.
+        :param direccion: dirección del nodo.
+        :param ancestro: índice del último bloque común, o None si no hay ninguno.
+        :return: tupla (resultado: 'completa', 'sufijo' o 'fallo'; si se ha sustituido la cadena)
+        """
+        # Las cadenas no comparten ningún bloque: se sustituye la cadena completa
+        if ancestro is None:
+            respuesta = self.cliente.get(direccion, '/chain/instantanea')
+            if respuesta is None or not respuesta.ok:
+                return 'fallo', False
+            try:
+                nueva = Blockchain.Blockchain.desde_registros(Blockchain_codec.registros_cadena(respuesta.content),
+                                                              self.configuracion['procesos_carga'],
+                                                              **self.blockchain.parametros())
+            except (Blockchain.ErrorCargaBlockchain, Blockchain_codec.ErrorCodificacion, UnicodeDecodeError):
+                return 'fallo', False
+            if nueva.trabajo_acumulado <= self.blockchain.trabajo_acumulado:
+                return 'fallo', False
+            self.blockchain.sustituir(nueva)
+            return 'completa', True
+
+        # Solo se descargan los bloques posteriores al ancestro común
+        respuesta = self.cliente.get(direccion, '/chain', params={'desde': ancestro + 1, 'formato': 'binario'})
+        if respuesta is None or not respuesta.ok:
+            return 'fallo', False
+        try:
+            sufijo = [(bloque, bloque.hash_bloque)
+                      for bloque in Blockchain_codec.decodificar_cadena(respuesta.content)]
+            if not self.blockchain.reemplazar_sufijo(ancestro, sufijo):
+                return 'fallo', False
+        except (Blockchain_codec.ErrorCodificacion, UnicodeDecodeError, ErrorIntegracionBloque):
+            return 'fallo', False
+        return 'sufijo', True
+
+    def conocer_direccion(self, direccion: str):
+        """
+        Toma como propia la dirección con la que otro nodo (o un usuario) ha contactado con este, salvo que se haya
+        fijado en la configuración.
+        :param direccion: dirección (por ejemplo, request.host_url).
+        :return: None
+        """
+        if not self.configuracion['direccion']:
+            self.direccion = direccion
+
+    def anunciar(self, bloques: Sequence[str] = (), transacciones: Sequence[str] = (), excluir: Optional[str] = None):
+        """
+        Anuncia bloques y transacciones por su hash a los nodos de la red (salvo al nodo excluir, del que se han
+        recibido), sin esperar respuesta. Cada nodo descarga de este solo los que no tiene (ver recibir_anuncio). Lo
+        anunciado se marca como visto para no procesarlo de nuevo cuando otros nodos lo reenvíen.
+        :param bloques: hashes de los bloques.
+        :param transacciones: identificadores de las transacciones.
+        :param excluir: dirección del nodo al que no se anuncian (default: None).
+        :return: None
+        """
+        if not bloques and not transacciones:
+            return
+        self.vistos.marcar([('bloque', hash_bloque) for hash_bloque in bloques] +
+                           [('transaccion', id_tx) for id_tx in transacciones])
+        nodos = [direccion for direccion in list(self.nodos_red)
+                 if not misma_direccion(direccion, excluir) and not misma_direccion(direccion, self.direccion)]
+        aviso = {
+                 'origen': self.direccion,
+                 'bloques': list(bloques),
+                 'transacciones': list(transacciones)
+                 }
+        self.cliente.difundir_sin_esperar('POST', nodos, '/nodos/anuncio', json=aviso)
+
+    def recibir_anuncio(self, origen: str, bloques: List[str], transacciones: List[str]) -> int:
+        """
+        Recibe el anuncio de otro nodo. Descarta lo ya visto y deja lo nuevo para el hilo de anuncios, que lo procesa
+        en segundo plano (ver _procesar_anuncio).
+        :param origen: dirección del nodo que lo anuncia.
+        :param bloques: hashes de los bloques anunciados.
+        :param transacciones: identificadores de las transacciones anunciadas.
+        :return: número de bloques y transacciones nuevos
+        """
+        nuevos_bloques = [hash_bloque for _, hash_bloque in self.vistos.marcar(('bloque', hash_bloque)
+                                                                              for hash_bloque in bloques)]
+        nuevas_transacciones = [id_tx for _, id_tx in self.vistos.marcar(('transaccion', id_tx)
+                                                                         for id_tx in transacciones)]
+        for tipo, anunciados, nuevos in (('bloque', bloques, nuevos_bloques),
+                                         ('transaccion', transacciones, nuevas_transacciones)):
+            self.metricas.anuncios_recibidos.incrementar(len(nuevos), tipo=tipo, resultado='nuevo')
+            self.metricas.anuncios_recibidos.incrementar(len(anunciados) - len(nuevos), tipo=tipo,
+                                                         resultado='repetido')
+        if nuevos_bloques or nuevas_transacciones:
+            self.ejecutor_anuncios.submit(self._procesar_anuncio, origen, nuevos_bloques, nuevas_transacciones)
+        return len(nuevos_bloques) + len(nuevas_transacciones)
+
+    def _procesar_anuncio(self, origen: str, bloques: List[str], transacciones: List[str]):
+        """
+        Descarga del nodo origen las transacciones pendientes y los bloques anunciados que no se tienen, los incluye y
+        reenvía el anuncio de los que se han aceptado al resto de la red. Si un bloque no enlaza con el último de la
+        cadena (faltan bloques anteriores o es de otra rama), se sincroniza la cadena con la del origen. Lo que no se
+        ha podido descargar se olvida, para volver a intentarlo si otro nodo lo anuncia. Las transacciones se piden en
+        grupos de MAX_IDS_PETICION.
+        :return: None
+        """
+        aceptadas = []
+        for inicio in range(0, len(transacciones), MAX_IDS_PETICION):
+            ids = transacciones[inicio:inicio + MAX_IDS_PETICION]
+            respuesta = self.cliente.get(origen, '/transacciones/pendientes', params={'ids': ','.join(ids)})
+            lista = None
+            if respuesta is not None and respuesta.ok:
+                try:
+                    lista = respuesta.json()['transacciones']
+                except (ValueError, KeyError, TypeError):
+                    pass
+                if not isinstance(lista, list):
+                    self.cliente.registrar_fallo(origen)
+                    lista = None
+            if lista is None:
+                self.vistos.olvidar(('transaccion', id_tx) for id_tx in ids)
+                continue
+            recibidas = []
+            for datos in lista:
+                try:
+                    recibidas.append(transaccion_desde_valores(datos))
+                except ValueError:
+                    continue
+            admitidas = self.blockchain.anadir_transacciones(recibidas)
+            aceptadas.extend(transaccion.id for transaccion, admitida in zip(recibidas, admitidas)
+                             if not isinstance(admitida, Blockchain.TransaccionRechazada))
+        self.anunciar(transacciones=aceptadas, excluir=origen)
+
+        for hash_bloque in bloques:
+            instantanea = self.blockchain.instantanea
+            if instantanea.bloque_por_hash(hash_bloque) is not None:
+                continue
+            respuesta = self.cliente.get(origen, '/bloque/' + hash_bloque)
+            if respuesta is None or not respuesta.ok:
+                self.vistos.olvidar([('bloque', hash_bloque)])
+                continue
+            bloque = Blockchain.Bloque.from_dict(respuesta.json())
+            if self.blockchain.integra_bloque(bloque, hash_bloque):
+                self.anunciar(bloques=[hash_bloque], excluir=origen)
+            elif bloque.hash_previo != instantanea.ultimo_bloque.hash_bloque and self.sincronizar_con(origen):
+                self.anunciar(bloques=[self.blockchain.instantanea.ultimo_bloque.hash_bloque], excluir=origen)
+
+    def copia_comprimida(self) -> bytes:
+        """
+        Cadena completa en la codificación de Blockchain_codec comprimida con gzip. Se genera una sola vez por cada
+        último bloque, por muchos nodos que la pidan.
+        :return: bytes comprimidos
+        """
+        with self.cerrojo_copia:
+            instantanea = self.blockchain.instantanea
+            hash_ultimo = instantanea.ultimo_bloque.hash_bloque
+            if self.copia_cadena is None or self.copia_cadena[0] != hash_ultimo:
+                datos = Blockchain_codec.codificar_cadena(instantanea.bloques())
+                self.copia_cadena = (hash_ultimo, gzip.compress(datos, NIVEL_COMPRESION))
+            return self.copia_cadena[1]
+
+
+# Rutas de un nodo; cada aplicación creada con create_app las registra con su propio Nodo
+rutas = Blueprint('nodo', __name__)
+
+
+def nodo_actual() -> Nodo:
+    """
+    Devuelve el nodo de la aplicación que atiende la petición en curso.
+    :return: nodo
+    """
+    return current_app.extensions['nodo']
+
+
+def misma_direccion(direccion: Optional[str], otra: Optional[str]) -> bool:
+    """
+    Indica si dos direcciones de nodo son la misma (con o sin '/' final).
+    """
+    return direccion is not None and otra is not None and direccion.rstrip('/') == otra.rstrip('/')
+
+
+def cuerpo_peticion() -> bytes:
+    """
+    Devuelve el cuerpo de la petición en curso, descomprimido si llega con 'Content-Encoding: gzip'. Lanza OSError o
+    EOFError si el cuerpo comprimido no es válido.
+    :return: bytes del cuerpo
+    """
+    datos = request.get_data()
+    if request.content_encoding == 'gzip':
+        return gzip.decompress(datos)
+    return datos
+
+
+def respuesta_binaria(datos: bytes, comprimidos: bool = False) -> Response:
+    """
+    Respuesta con datos binarios, comprimida con gzip si quien pide lo admite (Accept-Encoding).
+    :param datos: bytes de la respuesta.
+    :param comprimidos: si los datos ya están comprimidos con gzip (default: False).
+    :return: respuesta
+    """
+    if 'gzip' in request.accept_encodings:
+        cuerpo = datos if comprimidos else gzip.compress(datos, NIVEL_COMPRESION)
+        return Response(cuerpo, mimetype='application/octet-stream', headers={'Content-Encoding': 'gzip'})
+    return Response(gzip.decompress(datos) if comprimidos else datos, mimetype='application/octet-stream')
+
+
+@rutas.route('/system', methods=['GET'])
 def obtener_detalles_nodo_actual():
     """
     Obtiene los detalles del nodo que los pida.
@@ -58,160 +584,520 @@ def obtener_detalles_nodo_actual():
     return jsonify(response), 200
 
 
-@app.route('/transacciones/nueva', methods=['POST'])
+@rutas.route('/metrics', methods=['GET'])
+def metricas():
+    """
+    Devuelve las métricas del nodo en el formato de texto de Prometheus: minado (nonces probados, hashrate, tiempo por
+    bloque), espera y retención de los cerrojos de la cadena, transacciones pendientes, sincronización con cada nodo
+    y latencia del almacén persistente.
+    :return: Respuesta en texto plano
+    """
+    nodo = nodo_actual()
+    nodo.metricas.altura.fijar(len(nodo.blockchain.instantanea))
+    nodo.metricas.pendientes.fijar(len(nodo.blockchain.transacciones_sin_confirmar))
+    nodo.metricas.bytes_pendientes.fijar(nodo.blockchain.transacciones_sin_confirmar.bytes)
+    nodo.metricas.nodos_red.fijar(len(nodo.nodos_red))
+    return Response(nodo.metricas.registro.exponer(), content_type=Blockchain_metricas.TIPO_CONTENIDO)
+
+
+@rutas.route('/perfilador', methods=['GET'])
+def estado_perfilador():
+    """
+    Devuelve el estado del perfilador por muestreo. Con ?formato=colapsado devuelve las pilas muestreadas, una por
+    línea, en el formato que usan las herramientas de flame graphs.
+    :return: Respuesta en formato JSON (o en texto plano)
+    """
+    nodo = nodo_actual()
+    if request.args.get('formato') == 'colapsado':
+        return Response(nodo.perfilador.colapsado(), mimetype='text/plain')
+    return jsonify(nodo.perfilador.estado()), 200
+
+
+@rutas.route('/perfilador', methods=['POST'])
+def cambiar_perfilador():
+    """
+    Activa o desactiva el perfilador por muestreo: {"activo": true, "intervalo": 0.01}. Al activarlo se descartan las
+    muestras anteriores.
+    :return: Respuesta en formato JSON
+    """
+    nodo = nodo_actual()
+    values = request.get_json(silent=True) or {}
+    if not isinstance(values.get('activo'), bool):
+        return 'Falta el valor "activo" (true o false)', 400
+    intervalo = values.get('intervalo', 0.01)
+    if not isinstance(intervalo, (int, float)) or intervalo <= 0:
+        return 'El intervalo debe ser un numero positivo de segundos', 400
+    if values['activo']:
+        nodo.perfilador.activar(intervalo)
+    else:
+        nodo.perfilador.desactivar()
+    return jsonify(nodo.perfilador.estado()), 200
+
+
+@rutas.route('/transacciones/nueva', methods=['POST'])
 def nueva_transaccion():
     """
-    Crea una nueva transacción en dicho nodo.
+    Crea una nueva transacción en dicho nodo. Además de 'origen', 'destino' y 'cantidad' admite 'comision' (da
+    prioridad a la transacción al formar los bloques) y 'timestamp' (si se indica, reenviar la misma transacción no la
+    duplica). Las transacciones incompletas o con valores del tipo incorrecto (ver transaccion_desde_valores) se
+    rechazan con un 400, y las repetidas, sin saldo suficiente en su origen o que no caben entre las pendientes con un
+    409; las aceptadas se anuncian a la red.
     :return: Respuesta en formato JSON.
     """
-    values = request.get_json()
-    # Comprobamos que todos los datos de la transaccion están completos
-    required = ['origen', 'destino', 'cantidad']
-    if not all(k in values for k in required):
-        return 'Faltan valores', 400
-    # Creamos una nueva transaccion aquí
-    mutex.acquire()
-    index = blockchain.nueva_transaccion(**values)
-    mutex.release()
+    nodo = nodo_actual()
+    values = request.get_json(silent=True)
+    # Comprobamos que todos los datos de la transaccion están completos y son del tipo correcto
+    try:
+        transaccion = transaccion_desde_valores(values)
+    except ValueError as error:
+        return str(error), 400
+    try:
+        index = nodo.blockchain.anadir_transaccion(transaccion)
+    except Blockchain.TransaccionRechazada as error:
+        return jsonify({'mensaje': error.message}), 409
+    nodo.anunciar(transacciones=[transaccion.id])
     response = {'mensaje': f'La transaccion se incluira en el bloque con indice {index}'}
     return jsonify(response), 201
 
 
-@app.route('/chain', methods=['GET'])
+def _entero_64(valor) -> bool:
+    return (isinstance(valor, int) and not isinstance(valor, bool) and
+            Blockchain_codec.MINIMO_ENTERO <= valor <= Blockchain_codec.MAXIMO_ENTERO)
+
+
+def _decimal_finito(valor) -> bool:
+    return isinstance(valor, float) and math.isfinite(valor)
+
+
+def transaccion_desde_valores(values) -> Blockchain.Transaccion:
+    """
+    Construye una transacción a partir de los valores recibidos, comprobando que estén completos y sean del tipo
+    esperado, de forma que se pueda codificar sin cambiar su identificador (ver Blockchain_codec). La cantidad debe ser
+    un entero de 64 bits o un decimal finito, la comisión un entero de 64 bits y el timestamp un número, que se
+    convierte a decimal antes de calcular el identificador. El origen no puede ser "0", que se reserva al pago al
+    minero de cada bloque. Lanza ValueError con el motivo si no se cumple algo de lo anterior.
+    :param values: diccionario con 'origen', 'destino', 'cantidad' y, opcionalmente, 'timestamp' y 'comision'.
+    :return: transacción
+    """
+    if not isinstance(values, dict) or not all(k in values for k in ('origen', 'destino', 'cantidad')):
+        raise ValueError('Faltan valores')
+    if not isinstance(values['origen'], str) or not isinstance(values['destino'], str):
+        raise ValueError('El origen y el destino deben ser textos')
+    if values['origen'] == "0":
+        raise ValueError('Solo el pago al minero puede tener origen 0')
+    cantidad, comision, timestamp = values['cantidad'], values.get('comision', 0), values.get('timestamp')
+    if not _entero_64(cantidad) and not _decimal_finito(cantidad):
+        raise ValueError('El campo cantidad debe ser un entero de 64 bits o un decimal')
+    if not _entero_64(comision):
+        raise ValueError('El campo comision debe ser un entero de 64 bits')
+    if timestamp is not None:
+        if not _entero_64(timestamp) and not _decimal_finito(timestamp):
+            raise ValueError('El campo timestamp debe ser numerico')
+        timestamp = float(timestamp)
+    return Blockchain.Transaccion(values['origen'], values['destino'], cantidad, timestamp, comision)
+
+
+@rutas.route('/transacciones/lote', methods=['POST'])
+def nuevas_transacciones():
+    """
+    Crea varias transacciones en dicho nodo con una sola petición. El cuerpo es una lista JSON de transacciones (con los
+    mismos campos que en /transacciones/nueva) o un flujo NDJSON con una transacción por línea, y puede llegar
+    comprimido con gzip (Content-Encoding). Todas se validan antes de tomar el cerrojo de las transacciones pendientes,
+    que se adquiere una única vez para incluirlas (ver Blockchain.anadir_transacciones). Cada transacción se acepta o
+    se rechaza por separado, y las aceptadas se anuncian a la red en un solo anuncio.
+    :return: Respuesta en formato JSON con el resultado de cada transacción, en el orden recibido.
+    """
+    nodo = nodo_actual()
+    try:
+        datos = cuerpo_peticion().decode()
+        if datos.lstrip().startswith('['):
+            lote = json.loads(datos)
+        else:
+            lote = [json.loads(linea) for linea in datos.splitlines() if linea.strip()]
+    except (OSError, EOFError, ValueError):
+        return 'El cuerpo debe ser una lista JSON o NDJSON de transacciones', 400
+
+    resultados, transacciones = [], []
+    for values in lote:
+        try:
+            transaccion = transaccion_desde_valores(values)
+        except ValueError as error:
+            resultados.append({'aceptada': False, 'mensaje': str(error)})
+            continue
+        resultados.append({'aceptada': True, 'id': transaccion.id})
+        transacciones.append((transaccion, resultados[-1]))
+
+    admitidas = nodo.blockchain.anadir_transacciones(transaccion for transaccion, _ in transacciones)
+    for (_, resultado), admitida in zip(transacciones, admitidas):
+        if isinstance(admitida, Blockchain.TransaccionRechazada):
+            resultado['aceptada'] = False
+            resultado['mensaje'] = admitida.message
+        else:
+            resultado['indice'] = admitida
+    nodo.anunciar(transacciones=[resultado['id'] for resultado in resultados if resultado['aceptada']])
+    response = {
+                'aceptadas': sum(resultado['aceptada'] for resultado in resultados),
+                'rechazadas': sum(not resultado['aceptada'] for resultado in resultados),
+                'resultados': resultados
+                }
+    return jsonify(response), 200
+
+
+@rutas.route('/transacciones/pendientes', methods=['GET'])
+def transacciones_pendientes():
+    """
+    Devuelve transacciones pendientes de confirmar. Con el parámetro 'ids' (identificadores separados por comas) solo
+    las indicadas que sigan pendientes; es lo que piden los nodos a los que se anuncian transacciones.
+    :return: Respuesta en formato JSON.
+    """
+    nodo = nodo_actual()
+    ids = request.args.get('ids')
+    pendientes = nodo.blockchain.transacciones_sin_confirmar
+    if ids is None:
+        transacciones = list(pendientes)
+    else:
+        transacciones = [transaccion for transaccion in map(pendientes.obtener, ids.split(',')) if transaccion]
+    response = {
+                'transacciones': [transaccion.to_dict() for transaccion in transacciones]
+                }
+    return jsonify(response), 200
+
+
+@rutas.route('/chain', methods=['GET'])
 def blockchain_completa():
-    # Solamente permitimos la cadena de aquellos bloques finales que tienen hash
-    mutex.acquire()
-    chain = [bloque.__dict__ for bloque in blockchain.cadena if bloque.hash_bloque is not None]
-    mutex.release()
+    """
+    Devuelve los bloques de la cadena. Admite los parámetros 'desde' (índice del primer bloque, por defecto 1) y
+    'limite' (número máximo de bloques). Con 'formato=ndjson' (o la cabecera Accept: application/x-ndjson) los bloques
+    se envían en streaming, uno por línea; con 'formato=binario', en la codificación de Blockchain_codec (comprimida
+    con gzip si se admite). Los bloques se leen de la instantánea de la cadena, por lo que no cambian mientras se
+    serializan ni bloquean a nadie.
+    :return: Respuesta en formato JSON o NDJSON.
+    """
+    nodo = nodo_actual()
+    desde = max(request.args.get('desde', default=1, type=int), 1)
+    limite = request.args.get('limite', default=None, type=int)
+    instantanea = nodo.blockchain.instantanea
+    longitud = len(instantanea)
+    bloques = instantanea.bloques(desde, None if limite is None else desde - 1 + max(limite, 0))
+
+    formato = request.args.get('formato')
+    if formato == 'binario':
+        return respuesta_binaria(Blockchain_codec.codificar_cadena(bloques))
+    if formato == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson':
+        return Response((json.dumps(bloque.to_dict()) + '\n' for bloque in bloques), mimetype='application/x-ndjson')
+    chain = [bloque.to_dict() for bloque in bloques]
     response = {
                 'chain': chain,
-                'longitud': len(chain)
+                'longitud': longitud,
+                'desde': desde
                 }
     return jsonify(response), 200
 
 
-@app.route('/minar', methods=['GET'])
+@rutas.route('/chain/instantanea', methods=['GET'])
+def copia_blockchain():
+    """
+    Devuelve la cadena completa en la codificación de Blockchain_codec, comprimida con gzip si se admite. La copia se
+    genera una vez por cada último bloque y se reutiliza para todos los nodos que la pidan (ver Nodo.copia_comprimida).
+    :return: Respuesta binaria
+    """
+    return respuesta_binaria(nodo_actual().copia_comprimida(), comprimidos=True)
+
+
+@rutas.route('/chain/cabecera', methods=['GET'])
+def cabecera_blockchain():
+    """
+    Devuelve la cabecera de la cadena (hash del último bloque, altura y trabajo acumulado). Si se pasa el parámetro
+    'localizador' (hashes separados por comas, ver Blockchain.localizador), incluye además el índice del último bloque
+    común con la cadena de quien pregunta.
+    :return: Respuesta en formato JSON.
+    """
+    nodo = nodo_actual()
+    localizador = request.args.get('localizador')
+    instantanea = nodo.blockchain.instantanea
+    response = instantanea.cabecera()
+    if localizador is not None:
+        response['ancestro'] = instantanea.ancestro_comun(localizador.split(','))
+    return jsonify(response), 200
+
+
+@rutas.route('/bloque/<hash_bloque>', methods=['GET'])
+def obtener_bloque(hash_bloque: str):
+    """
+    Devuelve un bloque de la cadena a partir de su hash.
+    :param hash_bloque: hash del bloque.
+    :return: Respuesta en formato JSON.
+    """
+    nodo = nodo_actual()
+    bloque = nodo.blockchain.instantanea.bloque_por_hash(hash_bloque)
+    if bloque is None:
+        return "No existe el bloque " + hash_bloque, 404
+    return jsonify(bloque.to_dict()), 200
+
+
+@rutas.route('/bloque/indice/<int:indice>', methods=['GET'])
+def obtener_bloque_indice(indice: int):
+    """
+    Devuelve un bloque de la cadena a partir de su índice.
+    :param indice: índice del bloque.
+    :return: Respuesta en formato JSON.
+    """
+    nodo = nodo_actual()
+    bloque = nodo.blockchain.instantanea.bloque_por_indice(indice)
+    if bloque is None:
+        return "No existe el bloque con indice " + str(indice), 404
+    return jsonify(bloque.to_dict()), 200
+
+
+@rutas.route('/transaccion/<id_tx>', methods=['GET'])
+def obtener_transaccion(id_tx: str):
+    """
+    Devuelve una transacción confirmada a partir de su identificador, junto al bloque que la contiene.
+    :param id_tx: identificador de la transacción.
+    :return: Respuesta en formato JSON.
+    """
+    nodo = nodo_actual()
+    encontrada = nodo.blockchain.instantanea.buscar_transaccion(id_tx)
+    if encontrada is None:
+        return "No existe la transaccion " + id_tx, 404
+    transaccion, bloque = encontrada
+    response = {
+                'transaccion': transaccion.to_dict(),
+                'hash_bloque': bloque.hash_bloque,
+                'indice': bloque.indice
+                }
+    return jsonify(response), 200
+
+
+@rutas.route('/transaccion/<id_tx>/prueba', methods=['GET'])
+def prueba_inclusion_transaccion(id_tx: str):
+    """
+    Devuelve la prueba de inclusión de una transacción confirmada en la raíz de Merkle de su bloque. Con ella y la
+    cabecera del bloque se comprueba la transacción sin descargar el bloque entero (ver
+    Blockchain.verificar_prueba_merkle).
+    :param id_tx: identificador de la transacción.
+    :return: Respuesta en formato JSON.
+    """
+    nodo = nodo_actual()
+    encontrada = nodo.blockchain.instantanea.buscar_transaccion(id_tx)
+    if encontrada is None:
+        return "No existe la transaccion " + id_tx, 404
+    transaccion, bloque = encontrada
+    if bloque.raiz_merkle is None:
+        return "El bloque " + bloque.hash_bloque + " no tiene raiz de Merkle", 400
+    ids_transacciones = [transaccion.id for transaccion in bloque.transacciones]
+    response = {
+                'id': id_tx,
+                'hash_bloque': bloque.hash_bloque,
+                'cabecera': bloque.cabecera(),
+                'raiz_merkle': bloque.raiz_merkle,
+                'prueba': Blockchain.prueba_merkle(ids_transacciones, ids_transacciones.index(id_tx))
+                }
+    return jsonify(response), 200
+
+
+@rutas.route('/saldo/<cuenta>', methods=['GET'])
+def saldo_cuenta(cuenta: str):
+    """
+    Devuelve el saldo de una cuenta según la cadena, lo que envía en transacciones pendientes y lo que tiene disponible.
+    Los saldos se mantienen al día con cada bloque, por lo que la consulta no recorre la cadena.
+    :param cuenta: cuenta.
+    :return: Respuesta en formato JSON.
+    """
+    nodo = nodo_actual()
+    response = nodo.blockchain.saldo(cuenta)
+    response['cuenta'] = cuenta
+    return jsonify(response), 200
+
+
+@rutas.route('/minar', methods=['GET'])
 def minar():
     """
     Esta función mina la blockchain y se efectúa un pago al minero. En caso de no poder minar el bloque o existir algún
-    conflicto, se eliminaría dicho pago.
+    conflicto, se eliminaría dicho pago. El minado se realiza en esta misma petición. Con el parámetro 'cuenta', el
+    pago se hace a esa cuenta y el bloque se mina aunque no haya transacciones (ver Nodo.crear_trabajo_minado).
     :return: Respuesta en formato JSON.
     """
+    nodo = nodo_actual()
+    trabajo = nodo.crear_trabajo_minado(request.args.get('cuenta'))
     # No hay transacciones
-    mutex.acquire()
-    if not blockchain.transacciones_sin_confirmar:
-        mutex.release()
+    if trabajo is None:
         return {
                 'mensaje': "No es posible crear un nuevo bloque. No hay transacciones"
                 }
-    mutex.release()
-    # Se realiza pago al minero (con IP, mi_ip)
-    mutex.acquire()
-    blockchain.nueva_transaccion(origen="0", destino=mi_ip, cantidad=1)
-    ultimo_bloque = blockchain.ultimo_bloque
-    nuevo_bloque = blockchain.nuevo_bloque(hash_previo=ultimo_bloque.hash_bloque)
-    prueba = blockchain.prueba_trabajo(nuevo_bloque)
-    mutex.release()
-    # Se comprueba si existen conflictos
-    resuelve_conflicto = resuelve_conflictos()
-
-    # Si ha habido conflictos, se resuelven y se remueven todas las transacciones
-    if resuelve_conflicto:
+    nodo.ejecutar_trabajo_minado(trabajo)
+    response = {
+                'mensaje': trabajo.mensaje
+                }
+    return jsonify(response), 200
+
+
+@rutas.route('/minar', methods=['POST'])
+def minar_asincrono():
+    """
+    Toma una copia de las transacciones pendientes y lanza su minado en segundo plano. Devuelve inmediatamente el
+    identificador del trabajo, cuyo progreso puede consultarse en /minar/<id>. Admite el parámetro 'cuenta', como GET
+    /minar.
+    :return: Respuesta en formato JSON.
+    """
+    nodo = nodo_actual()
+    trabajo = nodo.crear_trabajo_minado(request.args.get('cuenta'))
+    if trabajo is None:
         response = {
-                    'mensaje': "Ha habido un conflicto. Esta cadena se ha actualizado con una version mas larga."
+                    'mensaje': "No es posible crear un nuevo bloque. No hay transacciones"
                     }
-    else:
-        mutex.acquire()
-        resultado = blockchain.integra_bloque(nuevo_bloque, prueba)
-        mutex.release()
-        # Si no se pudo integrar correctamente, se remueve el pago al minero
-        if not resultado:
-            mutex.acquire()
-            blockchain.transacciones_sin_confirmar.pop()
-            mutex.release()
-            response = {
-                        'mensaje': "No es posible integrar el nuevo bloque."
-                        }
-        # Si sí se integra correctamente, se manda un mensaje de minado satisfactorio.
-        else:
-            response = {
-                        'mensaje': f"El bloque {nuevo_bloque.indice} se ha minado satisfactoriamente."
-                        }
-    return jsonify(response), 200
+        return jsonify(response), 400
+    hilo = Thread(target=nodo.ejecutar_trabajo_minado, args=(trabajo,), daemon=True)
+    hilo.start()
+    return jsonify(trabajo.to_dict()), 202
+
+
+@rutas.route('/minar/<id_trabajo>', methods=['GET'])
+def estado_minado(id_trabajo: str):
+    """
+    Devuelve el progreso de un trabajo de minado: pruebas realizadas, hashrate y resultado.
+    :param id_trabajo: identificador del trabajo.
+    :return: Respuesta en formato JSON.
+    """
+    nodo = nodo_actual()
+    trabajo = nodo.trabajos_minado.get(id_trabajo)
+    if trabajo is None:
+        return "No existe el trabajo de minado " + id_trabajo, 404
+    return jsonify(trabajo.to_dict()), 200
 
 
-@app.route('/nodos/registrar', methods=['POST'])
+@rutas.route('/nodos/registrar', methods=['POST'])
 def registrar_nodos_completo():
-    global blockchain, nodos_red
+    nodo = nodo_actual()
     # Extrae las direcciones de sus nuevos peers
     direccion_nodos = request.get_json().get('direccion_nodos')
 
     if direccion_nodos is None:
         return "Error: No se ha proporcionado una lista de nodos", 400
     # Actualiza su set de peers
-    nodos_red.update(direccion_nodos)
-
-    # Por cada nodo/peer, manda un diccionario copia de su blockchain, y los nuevos peers de dicho peer incluyéndose a
-    # sí
-    headers = {'Content-Type': "application/json"}
-    for nodo in direccion_nodos:
-        data = {
-                'nodos_direcciones': [request.host_url, * [n for n in direccion_nodos if n != nodo]],
-                'blockchain': blockchain.to_dict()
-                }
-        requests.post(nodo + "/nodos/registro_simple", data=json.dumps(data), headers=headers)
+    nodo.nodos_red.update(direccion_nodos)
+    nodo.conocer_direccion(request.host_url)
+
+    # Manda (en paralelo) a cada nuevo peer el mismo aviso, serializado y comprimido una sola vez: los peers de la red
+    # (incluyéndose a sí, cada peer descarta su propia dirección), su dirección y la cabecera de su cadena. Con ella
+    # cada peer decide si necesita bloques y, en ese caso, descarga solo los que le faltan (ver Nodo.sincronizar_con)
+    aviso = {
+             'nodos_direcciones': [request.host_url, *direccion_nodos],
+             'origen': request.host_url,
+             'cabecera': nodo.blockchain.instantanea.cabecera()
+             }
+    headers = {'Content-Type': "application/json", 'Content-Encoding': 'gzip'}
+    nodo.cliente.difundir('POST', direccion_nodos, "/nodos/registro_simple",
+                          data=gzip.compress(json.dumps(aviso).encode(), NIVEL_COMPRESION), headers=headers)
 
     response = {
                 'mensaje': 'Se han incluido nuevos nodos en la red',
-                'nodos_totales': list(nodos_red)
+                'nodos_totales': list(nodo.nodos_red)
                 }
     return jsonify(response), 201
 
 
-@app.route('/nodos/registro_simple', methods=['POST'])
+@rutas.route('/nodos', methods=['GET'])
+def nodos_registrados():
+    """
+    Devuelve los nodos registrados en la red y el estado de salud de aquellos con los que ha habido fallos.
+    :return: Respuesta en formato JSON
+    """
+    nodo = nodo_actual()
+    response = {
+                'nodos_totales': list(nodo.nodos_red),
+                'estado': nodo.cliente.estado()
+                }
+    return jsonify(response), 200
+
+
+@rutas.route('/nodos/registro_simple', methods=['POST'])
 def registrar_nodo_actualiza_blockchain():
     """
-    Esta función actualiza los nodos_red y blockchain a partir de unos dados. Puede haber algún error al crear la
-    blockchain si esta no es correcta.
+    Esta función actualiza los nodos_red y blockchain a partir del aviso de un nodo que se registra (el cuerpo puede
+    llegar comprimido con gzip). Si el aviso trae 'origen' y 'cabecera' y la cadena del origen tiene más trabajo
+    acumulado, se responde de inmediato con un 202 y se descargan de él en segundo plano solo los bloques que faltan
+    (ver Nodo.sincronizar_con), de forma que el registro no espera a la descarga. También se admite el aviso antiguo
+    con la cadena completa en 'blockchain', que sustituye a la actual. Si el cuerpo no es un JSON válido (o no se
+    puede descomprimir), si sus campos no son del tipo esperado o si la cadena recibida no es válida, se responde con
+    un 400.
     :return: Respuesta en formato JSON
     """
-    # Obtenemos la variable global de blockchain
-    global blockchain, nodos_red
+    nodo = nodo_actual()
 
     # Extrae los input
-    response = request.get_json()
-    direccion_nodos = response.get("nodos_direcciones")
-    # Actualiza sus peers
-    nodos_red.update(direccion_nodos)
+    try:
+        response = json.loads(cuerpo_peticion())
+    except (OSError, EOFError, ValueError):
+        return "El aviso de registro no es un JSON valido", 400
+    if not isinstance(response, dict):
+        return "El aviso de registro debe ser un objeto JSON", 400
+    direccion_nodos = response.get("nodos_direcciones") or []
+    if not isinstance(direccion_nodos, list) or not all(isinstance(direccion, str) for direccion in direccion_nodos):
+        return "Las direcciones de los nodos deben ser una lista de textos", 400
+    # Actualiza sus peers (sin incluirse a sí mismo)
+    nodo.nodos_red.update(direccion for direccion in direccion_nodos
+                          if not misma_direccion(direccion, request.host_url))
+    nodo.conocer_direccion(request.host_url)
 
-    # Crea una blockchain a partir de la leída
+    origen, cabecera = response.get("origen"), response.get("cabecera")
     blockchain_leida = response.get("blockchain")
-    if blockchain_leida is None:
+    if origen is not None and cabecera is not None:
+        trabajo = cabecera.get('trabajo') if isinstance(cabecera, dict) else None
+        if not isinstance(origen, str) or not isinstance(trabajo, int) or isinstance(trabajo, bool):
+            return "El aviso de registro debe traer el origen y el trabajo de su cadena", 400
+        # Solo se contacta con el origen si su cadena tiene más trabajo. La descarga se hace en el hilo de anuncios,
+        # que también sincroniza con los nodos que anuncian bloques, para no hacer dos sincronizaciones a la vez
+        if trabajo > nodo.blockchain.instantanea.trabajo:
+            nodo.ejecutor_anuncios.submit(nodo.sincronizar_con, origen)
+            return "La blockchain del nodo se sincronizara en segundo plano con " + origen, 202
+    elif not isinstance(blockchain_leida, dict) or not isinstance(blockchain_leida.get("cadena"), list):
         return "El blockchain de la red está corrupto", 400
     else:
-        mutex.acquire()
-        blockchain = crear_blockchain_dump(blockchain_leida["cadena"])
-        mutex.release()
-    return "La blockchain del nodo" + str(mi_ip) + ":" + str(puerto) + "ha sido correctamente actualizada", 200
+        try:
+            nodo.blockchain.sustituir(crear_blockchain_dump(blockchain_leida["cadena"],
+                                                            **nodo.blockchain.parametros()))
+        except (ErrorIntegracionBloque, Blockchain_codec.ErrorCodificacion, KeyError, TypeError, ValueError):
+            return "El blockchain de la red está corrupto", 400
+    return ("La blockchain del nodo" + str(nodo.mi_ip) + ":" + str(nodo.puerto) +
+            "ha sido correctamente actualizada"), 200
 
 
-def crear_blockchain_dump(chain: List) -> Blockchain.Blockchain:
+@rutas.route('/nodos/anuncio', methods=['POST'])
+def recibir_anuncio():
+    """
+    Recibe el anuncio de bloques ('bloques', sus hashes) y transacciones ('transacciones', sus identificadores) de otro
+    nodo ('origen'). Responde en cuanto descarta lo ya visto: lo nuevo se descarga del origen y se reenvía al resto de
+    la red en segundo plano (ver Nodo.recibir_anuncio). Si el origen no es un texto o los bloques o las transacciones
+    no son listas de textos, se responde con un 400.
+    :return: Respuesta en formato JSON
+    """
+    nodo = nodo_actual()
+    aviso = request.get_json(silent=True)
+    if not isinstance(aviso, dict) or not isinstance(aviso.get('origen'), str):
+        return "El anuncio debe indicar su origen", 400
+    bloques, transacciones = aviso.get('bloques', []), aviso.get('transacciones', [])
+    for anunciados in (bloques, transacciones):
+        if not isinstance(anunciados, list) or not all(isinstance(elemento, str) for elemento in anunciados):
+            return "Los bloques y las transacciones anunciados deben ser listas de textos", 400
+    nuevos = nodo.recibir_anuncio(aviso['origen'], bloques, transacciones)
+    return jsonify({'nuevos': nuevos}), 202
+
+
+def crear_blockchain_dump(chain: List, **parametros) -> Blockchain.Blockchain:
     """
     Crea un objeto Blockchain a partir de una cadena dada. En caso de haber habido un error al integrar bloques de
     esta cadena, entonces dará ErrorIntegracionBloque.
     :param chain: Cadena a partir de la cual se crea la blockchain.
+    :param parametros: parámetros de la blockchain (ver Blockchain.Blockchain); normalmente los del nodo.
     :return:
     """
     # Iniciamos una blockchain "vacía".
-    blockchain = Blockchain.Blockchain()
+    blockchain = Blockchain.Blockchain(**parametros)
 
     # Iteramos sobre cada bloque de la cadena y los integramos a la blockchain
     for index, data in enumerate(chain):
-        bloque = Blockchain.Bloque(indice=data["indice"],
-                                   transacciones=data["transacciones"],
-                                   timestamp=data["timestamp"],
-                                   hash_previo=data["hash_previo"],
-                                   prueba=data["prueba"])
+        bloque = Blockchain.Bloque.from_dict(data)
         prueba = data['hash_bloque']
         # El primer bloque es el mismo en todas las Blockchains, ya que se crea automáticamente, por lo que con cambiar
         # sus parámetros es necesario. No hace falta integrarlo.
@@ -221,58 +1107,112 @@ def crear_blockchain_dump(chain: List) -> Blockchain.Blockchain:
                 raise ErrorIntegracionBloque
         else:
             bloque.hash_bloque = prueba
-            blockchain.cadena = [bloque]
+            blockchain.fijar_primer_bloque(bloque)
     return blockchain
 
 
-def resuelve_conflictos():
-    """
-    Mecanismo para establecer el consenso y resolver los conflictos. Para llegar a un consenso se escoge la cadena
-    más larga.
-    """
-    global blockchain
-
-    # Coge la longitud de la blockchain del nodo actual
-    longitud_actual = len(blockchain)
-    # Iniciamos una variable cadena_mas_larga, que podrá o no contener una cadena más larga que la actual (en caso de
-    # existir)
-    cadena_mas_larga = None
-    # Por cada nodo, comprueba si su blockchain es mayor que la actual, y si es así, modifica la longitud actual por
-    # esta y la cadena más larga también por esta.
-    for nodo in nodos_red:
-        response = requests.get(f'{nodo}/chain')
-        longitud = response.json()['longitud']
-        cadena = response.json()['chain']
-        if longitud > longitud_actual:
-            # Actualiza las variables
-            longitud_actual = longitud
-            cadena_mas_larga = cadena
-
-    # Si hay una cadena más larga, haz que esta sea tu blockchain
-    if cadena_mas_larga:
-        blockchain = crear_blockchain_dump(cadena_mas_larga)
-        return True
-    else:
-        print(blockchain)
-        return False
+def cargar_blockchain(almacen: Blockchain_almacen.AlmacenBloques, ruta_carga: Optional[str] = None,
+                      procesos: int = 1, punto_control: Optional[Tuple[int, str]] = None,
+                      **parametros) -> Blockchain.Blockchain:
+    """
+    Crea la blockchain del nodo a partir de los bloques de su almacén persistente (o de otro fichero, si se indica
+    ruta_carga) y le asigna el almacén, de forma que cada bloque que se integre a partir de ahora se añada al final de
+    este. Los bloques se decodifican y se verifican en paralelo y, hasta el punto de control, sin repetir la prueba de
+    trabajo (ver Blockchain.desde_registros). Si no hay bloques que cargar, se empieza con una blockchain nueva; si la
+    cadena no es válida, se lanza ErrorCargaBlockchain sin tocar el almacén.
+    :param almacen: almacén de bloques del nodo.
+    :param ruta_carga: fichero del que cargar la cadena en lugar del almacén (default: None).
+    :param procesos: número de procesos para decodificar y verificar los bloques (default: 1).
+    :param punto_control: tupla (altura, hash) de un bloque de confianza (default: None).
+    :param parametros: parámetros de la blockchain del nodo (ver Blockchain.Blockchain).
+    :return: blockchain cargada
+    """
+    if ruta_carga is not None:
+        blockchain_cargada = Blockchain.Blockchain.from_file(ruta_carga, procesos, punto_control, **parametros)
+        blockchain_cargada.asignar_almacen(almacen)
+        return blockchain_cargada
+    if len(almacen) > 0:
+        blockchain_cargada = Blockchain.Blockchain.desde_registros(almacen.leer_registros(), procesos, punto_control,
+                                                                   **parametros)
+        blockchain_cargada.asignar_almacen(almacen, reescribir=False)
+        return blockchain_cargada
+    blockchain_cargada = Blockchain.Blockchain(**parametros)
+    blockchain_cargada.asignar_almacen(almacen)
+    return blockchain_cargada
+
+
+def punto_control_argumento(valor: str) -> Tuple[int, str]:
+    """
+    Convierte el argumento --punto-control ('altura:hash') en una tupla (altura, hash).
+    """
+    altura, _, hash_bloque = valor.partition(':')
+    return int(altura), hash_bloque
 
 
-def copia_seguridad():
+def create_app(config: Optional[Dict] = None) -> Flask:
     """
-    Realiza una copia de seguridad de la blockchain cada 60 segundos.
+    Crea la aplicación de un nodo. Todo su estado queda en un objeto Nodo asociado a la aplicación, incluidos los
+    parámetros de su blockchain (límites de las transacciones pendientes y reajuste del objetivo, ver
+    PARAMETROS_BLOCKCHAIN) y un registro de métricas propio, por lo que pueden crearse varios nodos con distinta
+    configuración en el mismo proceso (con almacenes distintos) y cada uno sirve solo sus métricas.
+    :param config: configuración del nodo; las claves que falten toman su valor de CONFIGURACION_POR_DEFECTO
+    (default: None).
+    :return: aplicación Flask
     """
-    # Iniciamos un temporizador cada 60 segundos
-    timer = Timer(60., copia_seguridad)
-    timer.daemon = True
-    timer.start()
-    # Creamos un JSON "copia de seguridad" con la blockchain de dicho nodo.
-    blockchain.to_json(f'respaldo-nodo{mi_ip}-{puerto}.json', indent=2)
+    configuracion = dict(CONFIGURACION_POR_DEFECTO, **(config or {}))
+
+    app = Flask(__name__)
+    app.extensions['nodo'] = Nodo(configuracion, Blockchain_metricas.RegistroMetricas())
+    app.register_blueprint(rutas)
+    return app
 
 
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('-p', '--puerto', default=5000, type=int, help='puerto para escuchar')
+    parser.add_argument('--mining-workers', dest='procesos_minado', default=1, type=int,
+                        help='número de procesos para la prueba de trabajo')
+    parser.add_argument('--minado-en-servidor', dest='minado_separado', action='store_false',
+                        help='con un solo proceso de minado, minar en el propio proceso del servidor')
+    parser.add_argument('--timeout-nodos', default=2., type=float,
+                        help='tiempo máximo (en segundos) de cada petición a otro nodo')
+    parser.add_argument('--direccion', default=None,
+                        help='dirección con la que otros nodos contactan con este (default: la usada al registrarlo)')
+    parser.add_argument('--max-vistos', default=10000, type=int,
+                        help='bloques y transacciones anunciados que se recuerdan para descartar los repetidos')
+    parser.add_argument('--almacen', default=None,
+                        help='registro de bloques del nodo (default: bloques-nodo<ip>-<puerto>.log)')
+    parser.add_argument('--cargar', default=None,
+                        help='fichero (registro de bloques o copia .json) del que cargar la cadena al arrancar')
+    parser.add_argument('--punto-control', default=None, type=punto_control_argumento,
+                        help='bloque de confianza "altura:hash"; los bloques hasta él no repiten la prueba de trabajo')
+    parser.add_argument('--procesos-carga', default=1, type=int,
+                        help='número de procesos para decodificar y verificar la cadena al arrancar')
+    parser.add_argument('--max-pendientes', default=Blockchain.Blockchain.max_transacciones_pendientes, type=int,
+                        help='número máximo de transacciones pendientes')
+    parser.add_argument('--max-bytes-pendientes', default=Blockchain.Blockchain.max_bytes_pendientes, type=int,
+                        help='tamaño máximo (en bytes) de las transacciones pendientes')
+    parser.add_argument('--max-transacciones-bloque', default=Blockchain.Blockchain.max_transacciones_bloque, type=int,
+                        help='número máximo de transacciones (recompensa incluida) de cada bloque minado')
+    parser.add_argument('--intervalo-bloques', default=Blockchain.Blockchain.intervalo_bloques, type=float,
+                        help='tiempo objetivo (en segundos) entre bloques')
+    parser.add_argument('--bloques-reajuste', default=Blockchain.Blockchain.bloques_reajuste, type=int,
+                        help='cada cuántos bloques se reajusta el objetivo de la prueba de trabajo (0: nunca)')
+    parser.add_argument('--recompensa', default=Blockchain.Blockchain.recompensa_bloque, type=int,
+                        help='cantidad que cobra el minero de cada bloque (la misma en todos los nodos de la red)')
+    parser.add_argument('--perfilador', action='store_true',
+                        help='activar al arrancar el perfilador por muestreo (ver /perfilador)')
+    parser.add_argument('--servidor', default='waitress', choices=['waitress', 'desarrollo'],
+                        help='servidor WSGI: waitress (multihilo) o el servidor de desarrollo de Flask')
+    parser.add_argument('--hilos', default=16, type=int, help='hilos del servidor waitress')
     args = parser.parse_args()
-    puerto = args.puerto
-    copia_seguridad()
-    app.run(host='0.0.0.0', port=puerto)
+    configuracion = {clave: valor for clave, valor in vars(args).items() if clave in CONFIGURACION_POR_DEFECTO}
+    try:
+        app = create_app(configuracion)
+    except Blockchain.ErrorCargaBlockchain as error:
+        parser.exit(1, error.message + '\n')
+    if args.servidor == 'waitress':
+        from waitress import serve
+        serve(app, host='0.0.0.0', port=args.puerto, threads=args.hilos)
+    else:
+        app.run(host='0.0.0.0', port=args.puerto, threaded=True)
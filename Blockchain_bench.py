@@ -0,0 +1,284 @@
+"""
+Batería de pruebas de rendimiento del proyecto. Mide, sin necesidad de lanzar nodos a mano:
+- minado: hashes por segundo de la prueba de trabajo con varias dificultades;
+- integracion: coste por bloque de integra_bloque a medida que crece la cadena;
+- serializacion: coste de crear_blockchain_dump, to_dict, su JSON y la respuesta de /chain según el número de bloques;
+- sincronizacion: latencia de la sincronización entre nodos locales creados con create_app en este mismo proceso
+  (registro con /nodos/registrar, descarga de la cadena completa y descarga solo de los bloques nuevos).
+Los resultados se guardan en JSON (todos los tiempos en segundos) para poder compararlos entre versiones:
+
+$ python -m Blockchain_bench --salida antes.json
+$ python -m Blockchain_bench --salida despues.json --comparar antes.json
+
+AUTORES: SERGIO RODRÍGUEZ VIDAL Y JAIME PAZ RODRÍGUEZ
+"""
+
+import Blockchain
+import Blockchain_almacen
+import Blockchain_app
+import json
+import os
+import platform
+import requests
+import subprocess
+import tempfile
+
+from argparse import ArgumentParser
+from datetime import datetime
+from multiprocessing import Value
+from threading import Thread
+from time import perf_counter, sleep, time
+from typing import Callable, Dict, List, Tuple
+from waitress.server import create_server
+
+# Configuración de los nodos de la prueba: sin reajuste del objetivo, para que todos los bloques cuesten lo mismo, y con
+# una recompensa que cubre todas las transferencias de prueba del bloque siguiente (ver minar_bloque)
+CONFIGURACION_NODOS = {'bloques_reajuste': 0, 'recompensa': 10 ** 12}
+
+
+def medir(funcion: Callable, repeticiones: int = 1) -> Tuple[float, object]:
+    """
+    Ejecuta una función varias veces y devuelve el menor tiempo de ejecución y el resultado de la última.
+    :param funcion: función sin argumentos.
+    :param repeticiones: número de ejecuciones (default: 1).
+    :return: tupla (segundos, resultado)
+    """
+    mejor, resultado = float('inf'), None
+    for _ in range(repeticiones):
+        inicio = perf_counter()
+        resultado = funcion()
+        mejor = min(mejor, perf_counter() - inicio)
+    return mejor, resultado
+
+
+def minar_bloque(blockchain: Blockchain.Blockchain, transacciones: int) -> float:
+    """
+    Añade a una blockchain un bloque con nuevas transferencias desde la cuenta 'banco', que cobra la recompensa de
+    cada bloque, y devuelve lo que tarda en integrarlo (sin contar la prueba de trabajo). En el primer bloque el banco
+    aún no tiene saldo, por lo que solo lleva la recompensa.
+    :param blockchain: blockchain.
+    :param transacciones: número de transacciones del bloque.
+    :return: segundos de integra_bloque
+    """
+    blockchain.anadir_transacciones(Blockchain.Transaccion('banco', f'cuenta{numero}', numero + 1)
+                                    for numero in range(transacciones))
+    bloque = blockchain.nuevo_bloque(blockchain.ultimo_bloque.hash_bloque, minero='banco')
+    prueba = Blockchain.Blockchain.prueba_trabajo(bloque)
+    segundos, integrado = medir(lambda: blockchain.integra_bloque(bloque, prueba))
+    assert integrado, "No se ha podido integrar un bloque de la prueba"
+    return segundos
+
+
+def bench_minado(dificultades: List[int], segundos: float, procesos: int) -> List[Dict]:
+    """
+    Mina bloques con cada dificultad durante al menos los segundos indicados y calcula los hashes por segundo.
+    """
+    resultados = []
+    dificultad_original = Blockchain.Blockchain.dificultad
+    try:
+        for dificultad in dificultades:
+            Blockchain.Blockchain.dificultad = dificultad
+            intentos, bloques, inicio = Value('Q', 0), 0, perf_counter()
+            while bloques == 0 or perf_counter() - inicio < segundos:
+                bloque = Blockchain.Bloque(bloques + 2, [Blockchain.Transaccion('0', 'minero', 1)], '0' * 64, time())
+                Blockchain.Blockchain.prueba_trabajo(bloque, procesos=procesos, intentos=intentos)
+                bloques += 1
+            total = perf_counter() - inicio
+            resultados.append({'dificultad': dificultad, 'bloques': bloques, 'hashes': intentos.value,
+                               'hashes_por_segundo': intentos.value / total, 'segundos_por_bloque': total / bloques})
+    finally:
+        Blockchain.Blockchain.dificultad = dificultad_original
+    return resultados
+
+
+def bench_integracion(tamanos: List[int], transacciones: int, directorio: str) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Construye una cadena de max(tamanos) bloques con almacén persistente y mide el coste medio de integra_bloque en
+    cada tramo de la cadena (entre un tamaño y el anterior).
+    :return: tupla (resultados, cadena construida como lista de diccionarios)
+    """
+    blockchain = Blockchain.Blockchain(bloques_reajuste=CONFIGURACION_NODOS['bloques_reajuste'],
+                                       recompensa_bloque=CONFIGURACION_NODOS['recompensa'])
+    almacen = Blockchain_almacen.AlmacenBloques(os.path.join(directorio, 'integracion.log'))
+    blockchain.asignar_almacen(almacen)
+    resultados, tiempos = [], []
+    for tamano in sorted(tamanos):
+        tiempos_tramo = [minar_bloque(blockchain, transacciones) for _ in range(tamano - len(blockchain))]
+        tiempos.extend(tiempos_tramo)
+        if tiempos_tramo:
+            resultados.append({'bloques': tamano, 'integra_bloque': sum(tiempos_tramo) / len(tiempos_tramo)})
+    almacen.cerrar()
+    return resultados, blockchain.to_dict()['cadena']
+
+
+def bench_serializacion(cadena: List[Dict], tamanos: List[int], repeticiones: int, directorio: str) -> List[Dict]:
+    """
+    Para cada tamaño, mide la reconstrucción de la cadena con crear_blockchain_dump, su conversión con to_dict, el
+    JSON resultante y la respuesta completa de /chain de un nodo con esa cadena.
+    """
+    app = Blockchain_app.create_app(dict(CONFIGURACION_NODOS, almacen=os.path.join(directorio, 'serializacion.log')))
+    nodo, cliente = app.extensions['nodo'], app.test_client()
+    resultados = []
+    for tamano in sorted(tamanos):
+        dump, blockchain = medir(lambda: Blockchain_app.crear_blockchain_dump(cadena[:tamano],
+                                                                              **nodo.blockchain.parametros()))
+        to_dict, diccionario = medir(blockchain.to_dict, repeticiones)
+        to_json, texto = medir(lambda: json.dumps(diccionario), repeticiones)
+        nodo.blockchain.sustituir(blockchain)
+        chain, respuesta = medir(lambda: cliente.get('/chain'), repeticiones)
+        resultados.append({'bloques': tamano, 'crear_blockchain_dump': dump,
+                           'crear_blockchain_dump_por_bloque': dump / tamano, 'to_dict': to_dict, 'json': to_json,
+                           'json_bytes': len(texto), 'chain': chain, 'chain_bytes': len(respuesta.data)})
+    return resultados
+
+
+class NodoLocal(object):
+    def __init__(self, nombre: str, directorio: str):
+        """
+        Constructor de la clase 'NodoLocal': un nodo creado con create_app y servido con waitress en un hilo de este
+        proceso, en un puerto libre.
+        :param nombre: nombre del nodo (para su almacén).
+        :param directorio: directorio para el almacén del nodo.
+        """
+        almacen = os.path.join(directorio, f'{nombre}.log')
+        self.app = Blockchain_app.create_app(dict(CONFIGURACION_NODOS, almacen=almacen))
+        self.nodo = self.app.extensions['nodo']
+        self.servidor = create_server(self.app, host='127.0.0.1', port=0, threads=8)
+        self.direccion = f'http://127.0.0.1:{self.servidor.effective_port}/'
+        Thread(target=self.servidor.run, daemon=True).start()
+
+    def cerrar(self):
+        self.servidor.close()
+
+
+def registrar(origen: NodoLocal, registrado: NodoLocal, tamano: int, plazo: float = 60.):
+    """
+    Registra un nodo en otro con /nodos/registrar y espera (como mucho plazo segundos) a que tenga la cadena de tamano
+    bloques, que descarga en segundo plano.
+    """
+    requests.post(origen.direccion + 'nodos/registrar', json={'direccion_nodos': [registrado.direccion]})
+    limite = perf_counter() + plazo
+    while len(registrado.nodo.blockchain) < tamano and perf_counter() < limite:
+        sleep(0.001)
+
+
+def bench_sincronizacion(cadena: List[Dict], tamanos: List[int], incremento: int, transacciones: int,
+                         directorio: str) -> List[Dict]:
+    """
+    Para cada tamaño, crea tres nodos locales; el primero tiene la cadena de ese tamaño. Mide:
+    - registro: /nodos/registrar del primero con el segundo, hasta que este tiene la cadena (que descarga en segundo
+      plano);
+    - completa: resuelve_conflictos del tercero, que no comparte ningún bloque y descarga la cadena completa;
+    - sufijo: resuelve_conflictos del segundo después de que el primero mine incremento bloques más.
+    """
+    resultados = []
+    for tamano in sorted(tamanos):
+        origen, registrado, nuevo = (NodoLocal(f'{nombre}{tamano}', directorio)
+                                     for nombre in ('origen', 'registrado', 'nuevo'))
+        try:
+            origen.nodo.blockchain.sustituir(Blockchain_app.crear_blockchain_dump(
+                cadena[:tamano], **origen.nodo.blockchain.parametros()))
+
+            registro, _ = medir(lambda: registrar(origen, registrado, tamano))
+            assert len(registrado.nodo.blockchain) == tamano, "El registro no ha copiado la cadena"
+
+            nuevo.nodo.nodos_red.add(origen.direccion)
+            completa, _ = medir(nuevo.nodo.resuelve_conflictos)
+            assert len(nuevo.nodo.blockchain) == tamano, "No se ha descargado la cadena completa"
+
+            for _ in range(incremento):
+                minar_bloque(origen.nodo.blockchain, transacciones)
+            sufijo, _ = medir(registrado.nodo.resuelve_conflictos)
+            assert len(registrado.nodo.blockchain) == tamano + incremento, "No se han descargado los bloques nuevos"
+        finally:
+            for nodo_local in (origen, registrado, nuevo):
+                nodo_local.cerrar()
+        resultados.append({'bloques': tamano, 'registro': registro, 'completa': completa, 'sufijo': sufijo,
+                           'bloques_sufijo': incremento})
+    return resultados
+
+
+def entorno() -> Dict:
+    """
+    Describe el entorno de la ejecución (versión del código, Python, máquina) para poder comparar resultados.
+    """
+    try:
+        version = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        version = None
+    return {'version': version, 'fecha': datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
+            'python': platform.python_version(), 'plataforma': platform.platform(), 'procesadores': os.cpu_count()}
+
+
+def comparar(anterior: Dict, actual: Dict) -> List[str]:
+    """
+    Compara dos resultados: para cada medida presente en ambos, muestra el valor anterior, el actual y su cociente.
+    Las entradas de cada apartado se emparejan por su primera clave (dificultad o bloques).
+    """
+    lineas = []
+    for apartado, entradas in actual.items():
+        if not isinstance(entradas, list) or not isinstance(anterior.get(apartado), list):
+            continue
+        for entrada in entradas:
+            clave = next(iter(entrada))
+            previa = next((otra for otra in anterior[apartado] if otra.get(clave) == entrada[clave]), None)
+            if previa is None:
+                continue
+            for medida, valor in entrada.items():
+                if medida == clave or not isinstance(valor, float) or not previa.get(medida):
+                    continue
+                lineas.append(f"{apartado} {clave}={entrada[clave]} {medida}: {previa[medida]:.6g} -> {valor:.6g} "
+                              f"(x{valor / previa[medida]:.2f})")
+    return lineas
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--dificultades', default=[1, 2, 3, 4], type=int, nargs='+',
+                        help='dificultades de la prueba de minado')
+    parser.add_argument('--segundos-minado', default=2., type=float, help='segundos mínimos por dificultad')
+    parser.add_argument('--procesos-minado', default=1, type=int, help='procesos de la prueba de trabajo')
+    parser.add_argument('--tamanos', default=[50, 100, 200, 400], type=int, nargs='+',
+                        help='números de bloques de la cadena en los que se mide')
+    parser.add_argument('--dificultad-cadena', default=2, type=int,
+                        help='dificultad con la que se minan los bloques de la cadena de prueba')
+    parser.add_argument('--transacciones', default=10, type=int, help='transacciones por bloque')
+    parser.add_argument('--incremento', default=10, type=int,
+                        help='bloques nuevos que se descargan en la sincronización de sufijo')
+    parser.add_argument('--repeticiones', default=3, type=int, help='repeticiones de cada medida (se toma la menor)')
+    parser.add_argument('--apartados', default=['minado', 'integracion', 'serializacion', 'sincronizacion'],
+                        nargs='+', choices=['minado', 'integracion', 'serializacion', 'sincronizacion'],
+                        help='apartados a medir')
+    parser.add_argument('--salida', default='bench.json', help='fichero JSON de resultados')
+    parser.add_argument('--comparar', default=None, help='fichero JSON de resultados anteriores con el que comparar')
+    args = parser.parse_args()
+
+    resultados = {'entorno': entorno(), 'parametros': {clave: valor for clave, valor in vars(args).items()
+                                                         if clave not in ('salida', 'comparar')}}
+    if 'minado' in args.apartados:
+        resultados['minado'] = bench_minado(args.dificultades, args.segundos_minado, args.procesos_minado)
+    with tempfile.TemporaryDirectory() as directorio:
+        # La cadena de prueba se mina con una dificultad baja y fija para que construirla no domine el tiempo de la
+        # prueba
+        Blockchain.Blockchain.dificultad = args.dificultad_cadena
+        integracion, cadena = bench_integracion(args.tamanos, args.transacciones, directorio)
+        if 'integracion' in args.apartados:
+            resultados['integracion'] = integracion
+        if 'serializacion' in args.apartados:
+            resultados['serializacion'] = bench_serializacion(cadena, args.tamanos, args.repeticiones, directorio)
+        if 'sincronizacion' in args.apartados:
+            resultados['sincronizacion'] = bench_sincronizacion(cadena, args.tamanos, args.incremento,
+                                                                args.transacciones, directorio)
+
+    with open(args.salida, 'w') as fichero:
+        json.dump(resultados, fichero, indent=2)
+    for apartado in args.apartados:
+        for entrada in resultados.get(apartado, []):
+            print(apartado, ', '.join(f'{clave}={valor:.6g}' if isinstance(valor, float) else f'{clave}={valor}'
+                                      for clave, valor in entrada.items()))
+    if args.comparar is not None:
+        with open(args.comparar) as fichero:
+            for linea in comparar(json.load(fichero), resultados):
+                print(linea)
+    print(f"Resultados guardados en {args.salida}")
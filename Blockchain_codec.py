@@ -0,0 +1,246 @@
+"""
+Blockchain_codec.py implementa una codificación binaria compacta y determinista de transacciones y bloques, pensada para
+el almacenamiento en disco y la transferencia entre nodos (el JSON se mantiene en la API). Todos los enteros se guardan
+en big-endian con ancho fijo y los textos en UTF-8 precedidos de su longitud:
+
+Transacción:
+    origen (u16 + bytes) | destino (u16 + bytes) | tipo (u8: bit 0 cantidad decimal, bit 1 con comisión) |
+    cantidad (i64 o f64) | timestamp (f64) | comisión (i64, solo si el bit 1 del tipo está activo)
+    Solo se codifican las transacciones que se decodifican sin cambios (y por tanto con el mismo identificador):
+    origen y destino textos, cantidad entera de 64 bits o decimal, timestamp decimal y comisión entera de 64 bits.
+Bloque:
+    versión (u8) | indice (u64) | timestamp (f64) | prueba (u64) | objetivo (u256, solo desde la versión 3) |
+    hash_previo (u16 + bytes) | hash_bloque (u16 + bytes; 0xFFFF si no tiene) | número de transacciones (u32) |
+    transacciones
+Cadena:
+    bloques consecutivos, cada uno precedido de su longitud (u32).
+
+Migración del hash a esta codificación: hoy el hash de un bloque es el sha256 de un JSON (del bloque entero en la
+versión 1 y de su cabecera con la raíz de Merkle en las versiones 2 y 3, que añade el objetivo; ver
+Bloque.calcular_hash). Para pasar a hash_binario sin invalidar las cadenas existentes se añade una nueva versión de
+bloque y una altura de activación: los bloques anteriores siguen validándose con su regla y los posteriores se minan y
+validan con hash_binario, que excluye hash_bloque y coloca la prueba al final. El campo de versión de cada bloque
+codificado indica con qué regla se calculó su hash.
+
+AUTORES: SERGIO RODRÍGUEZ VIDAL Y JAIME PAZ RODRÍGUEZ
+"""
+
+import struct
+
+from Blockchain import Bloque, Transaccion, VERSION_COMPLETA, VERSION_MERKLE, VERSION_OBJETIVO
+from hashlib import sha256
+from typing import Iterable, Iterator, List, Tuple
+
+VERSIONES_BLOQUE = (VERSION_COMPLETA, VERSION_MERKLE, VERSION_OBJETIVO)
+SIN_HASH = 0xFFFF
+BYTES_OBJETIVO = 32
+
+ENTERO = struct.Struct('>q')
+MINIMO_ENTERO, MAXIMO_ENTERO = -2 ** 63, 2 ** 63 - 1
+DECIMAL = struct.Struct('>d')
+CABECERA_BLOQUE = struct.Struct('>BQdQ')
+LONGITUD_TEXTO = struct.Struct('>H')
+LONGITUD_LISTA = struct.Struct('>I')
+TIPO_CANTIDAD = struct.Struct('>B')
+TIPO_DECIMAL = 0x01
+TIPO_COMISION = 0x02
+
+
+class ErrorCodificacion(Exception):
+    """
+    Error al codificar o decodificar un bloque.
+    """
+    def __init__(self, message: str):
+        self.message = message
+        super(ErrorCodificacion, self).__init__(message)
+
+
+def _codificar_texto(texto: str) -> bytes:
+    if not isinstance(texto, str):
+        raise ErrorCodificacion("Solo se pueden codificar textos")
+    datos = texto.encode()
+    if len(datos) >= SIN_HASH:
+        raise ErrorCodificacion("Texto demasiado largo para codificarlo")
+    return LONGITUD_TEXTO.pack(len(datos)) + datos
+
+
+def _decodificar_texto(datos: memoryview, posicion: int) -> Tuple[str, int]:
+    longitud, = LONGITUD_TEXTO.unpack_from(datos, posicion)
+    posicion += LONGITUD_TEXTO.size
+    return bytes(datos[posicion:posicion + longitud]).decode(), posicion + longitud
+
+
+def _entero(valor) -> bool:
+    return isinstance(valor, int) and not isinstance(valor, bool) and MINIMO_ENTERO <= valor <= MAXIMO_ENTERO
+
+
+def codificar_transaccion(transaccion: Transaccion) -> bytes:
+    """
+    Codifica una transacción. Lanza ErrorCodificacion si alguno de sus valores no se decodificaría igual (por ejemplo,
+    un timestamp entero, una cantidad booleana o una comisión decimal), ya que cambiaría su identificador.
+    :param transaccion: transacción.
+    :return: bytes de la transacción
+    """
+    if not _entero(transaccion.comision):
+        raise ErrorCodificacion("La comision debe ser un entero de 64 bits")
+    if not isinstance(transaccion.timestamp, float):
+        raise ErrorCodificacion("El timestamp debe ser decimal")
+    tipo = TIPO_COMISION if transaccion.comision else 0
+    if isinstance(transaccion.cantidad, int) and not isinstance(transaccion.cantidad, bool):
+        if not _entero(transaccion.cantidad):
+            raise ErrorCodificacion("La cantidad no cabe en un entero de 64 bits")
+        cantidad = ENTERO.pack(transaccion.cantidad)
+    elif not isinstance(transaccion.cantidad, float):
+        raise ErrorCodificacion("La cantidad debe ser entera o decimal")
+    else:
+        tipo |= TIPO_DECIMAL
+        cantidad = DECIMAL.pack(transaccion.cantidad)
+    comision = ENTERO.pack(transaccion.comision) if transaccion.comision else b''
+    return (_codificar_texto(transaccion.origen) + _codificar_texto(transaccion.destino) + TIPO_CANTIDAD.pack(tipo) +
+            cantidad + DECIMAL.pack(transaccion.timestamp) + comision)
+
+
+def _decodificar_transaccion(datos: memoryview, posicion: int) -> Tuple[Transaccion, int]:
+    origen, posicion = _decodificar_texto(datos, posicion)
+    destino, posicion = _decodificar_texto(datos, posicion)
+    tipo, = TIPO_CANTIDAD.unpack_from(datos, posicion)
+    posicion += TIPO_CANTIDAD.size
+    cantidad, = (DECIMAL if tipo & TIPO_DECIMAL else ENTERO).unpack_from(datos, posicion)
+    posicion += ENTERO.size
+    timestamp, = DECIMAL.unpack_from(datos, posicion)
+    posicion += DECIMAL.size
+    comision = 0
+    if tipo & TIPO_COMISION:
+        comision, = ENTERO.unpack_from(datos, posicion)
+        posicion += ENTERO.size
+    return Transaccion(origen, destino, cantidad, timestamp, comision), posicion
+
+
+def _natural(valor, bits: int = 64) -> bool:
+    return isinstance(valor, int) and not isinstance(valor, bool) and 0 <= valor < 2 ** bits
+
+
+def _codificar_objetivo(bloque: Bloque) -> bytes:
+    if bloque.objetivo is None:
+        return b''
+    if not _natural(bloque.objetivo, 8 * BYTES_OBJETIVO):
+        raise ErrorCodificacion("El objetivo no cabe en 256 bits")
+    return bloque.objetivo.to_bytes(BYTES_OBJETIVO, 'big')
+
+
+def _comprobar_cabecera(bloque: Bloque):
+    if bloque.version not in VERSIONES_BLOQUE:
+        raise ErrorCodificacion(f"Version de bloque desconocida: {bloque.version}")
+    if not _natural(bloque.indice) or not _natural(bloque.prueba):
+        raise ErrorCodificacion("El indice y la prueba deben ser enteros de 64 bits sin signo")
+    if not isinstance(bloque.timestamp, float):
+        raise ErrorCodificacion("El timestamp del bloque debe ser decimal")
+
+
+def codificar_bloque(bloque: Bloque) -> bytes:
+    """
+    Codifica un bloque, incluido su hash si lo tiene. Lanza ErrorCodificacion si alguno de sus valores no se
+    decodificaría igual (ver codificar_transaccion).
+    :param bloque: bloque.
+    :return: bytes del bloque
+    """
+    _comprobar_cabecera(bloque)
+    partes = [CABECERA_BLOQUE.pack(bloque.version, bloque.indice, bloque.timestamp, bloque.prueba),
+              _codificar_objetivo(bloque),
+              _codificar_texto(bloque.hash_previo),
+              _codificar_texto(bloque.hash_bloque) if bloque.hash_bloque is not None else LONGITUD_TEXTO.pack(SIN_HASH),
+              LONGITUD_LISTA.pack(len(bloque.transacciones))]
+    partes.extend(map(codificar_transaccion, bloque.transacciones))
+    return b''.join(partes)
+
+
+def decodificar_bloque(datos: bytes) -> Bloque:
+    """
+    Decodifica un bloque codificado con codificar_bloque.
+    :param datos: bytes del bloque.
+    :return: bloque (con su hash, si lo tenía)
+    """
+    datos = memoryview(datos)
+    try:
+        version, indice, timestamp, prueba = CABECERA_BLOQUE.unpack_from(datos, 0)
+        if version not in VERSIONES_BLOQUE:
+            raise ErrorCodificacion(f"Version de bloque desconocida: {version}")
+        objetivo, posicion = None, CABECERA_BLOQUE.size
+        if version >= VERSION_OBJETIVO:
+            if posicion + BYTES_OBJETIVO > len(datos):
+                raise ErrorCodificacion("Bloque codificado incompleto")
+            objetivo = int.from_bytes(datos[posicion:posicion + BYTES_OBJETIVO], 'big')
+            posicion += BYTES_OBJETIVO
+        hash_previo, posicion = _decodificar_texto(datos, posicion)
+        if LONGITUD_TEXTO.unpack_from(datos, posicion)[0] == SIN_HASH:
+            hash_bloque, posicion = None, posicion + LONGITUD_TEXTO.size
+        else:
+            hash_bloque, posicion = _decodificar_texto(datos, posicion)
+        numero, = LONGITUD_LISTA.unpack_from(datos, posicion)
+        posicion += LONGITUD_LISTA.size
+        transacciones = []
+        for _ in range(numero):
+            transaccion, posicion = _decodificar_transaccion(datos, posicion)
+            transacciones.append(transaccion)
+    except struct.error:
+        raise ErrorCodificacion("Bloque codificado incompleto")
+    bloque = Bloque(indice, transacciones, hash_previo, timestamp, prueba, version=version, objetivo=objetivo)
+    bloque.hash_bloque = hash_bloque
+    return bloque
+
+
+def codificar_cadena(bloques: Iterable[Bloque]) -> bytes:
+    """
+    Codifica una secuencia de bloques, cada uno precedido de su longitud.
+    :param bloques: bloques.
+    :return: bytes de la cadena
+    """
+    partes = []
+    for bloque in bloques:
+        datos = codificar_bloque(bloque)
+        partes.append(LONGITUD_LISTA.pack(len(datos)))
+        partes.append(datos)
+    return b''.join(partes)
+
+
+def registros_cadena(datos: bytes) -> Iterator[bytes]:
+    """
+    Separa una secuencia de bloques codificada con codificar_cadena en los bloques codificados, sin decodificarlos
+    (ver decodificar_bloque).
+    :param datos: bytes de la cadena.
+    :return: iterador de bloques codificados
+    """
+    posicion = 0
+    while posicion < len(datos):
+        if posicion + LONGITUD_LISTA.size > len(datos):
+            raise ErrorCodificacion("Cadena codificada incompleta")
+        longitud, = LONGITUD_LISTA.unpack_from(datos, posicion)
+        posicion += LONGITUD_LISTA.size
+        yield bytes(datos[posicion:posicion + longitud])
+        posicion += longitud
+
+
+def decodificar_cadena(datos: bytes) -> List[Bloque]:
+    """
+    Decodifica una secuencia de bloques codificada con codificar_cadena.
+    :param datos: bytes de la cadena.
+    :return: lista de bloques
+    """
+    return [decodificar_bloque(registro) for registro in registros_cadena(datos)]
+
+
+def hash_binario(bloque: Bloque) -> str:
+    """
+    Hash de un bloque calculado sobre su codificación binaria (sin hash_bloque y con la prueba al final). No se usa
+    todavía para validar bloques; ver la nota de migración al principio del módulo.
+    :param bloque: bloque.
+    :return: hash del bloque
+    """
+    _comprobar_cabecera(bloque)
+    cuerpo = b''.join([struct.pack('>BQd', bloque.version, bloque.indice, bloque.timestamp),
+                       _codificar_objetivo(bloque),
+                       _codificar_texto(bloque.hash_previo),
+                       LONGITUD_LISTA.pack(len(bloque.transacciones)),
+                       *map(codificar_transaccion, bloque.transacciones),
+                       struct.pack('>Q', bloque.prueba)])
+    return sha256(cuerpo).hexdigest()
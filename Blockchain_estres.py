@@ -0,0 +1,203 @@
+"""
+Prueba de carga de un nodo de Blockchain_app.py. Lanza varios hilos lectores (/chain, /chain/cabecera, /bloque y
+/saldo) primero solos y después a la vez que varios hilos escritores (transacciones en lote y minado), mide las lecturas
+por segundo en ambos casos y comprueba al terminar que el resultado es correcto: la cadena está bien enlazada, cada
+transacción aceptada está confirmada una sola vez o sigue pendiente y los saldos coinciden con los de la cadena. Para su
+uso será necesario iniciar antes el nodo, con una recompensa por bloque con la que las cuentas de prueba tengan saldo
+(cada una mina un bloque antes de empezar), por ejemplo:
+
+$ python Blockchain_app.py -p 5000 --recompensa 10000
+$ python Blockchain_estres.py --nodo http://localhost:5000 --lectores 16 --escritores 4 --segundos 10
+
+AUTORES: SERGIO RODRÍGUEZ VIDAL Y JAIME PAZ RODRÍGUEZ
+"""
+
+import Blockchain
+import json
+import random
+import requests
+
+from argparse import ArgumentParser
+from threading import Event, Lock, Thread
+from time import sleep, time
+from typing import Dict, List
+
+CUENTAS = [f'cuenta{numero}' for numero in range(20)]
+
+
+class Resultados(object):
+    def __init__(self):
+        """
+        Constructor de la clase 'Resultados': contadores compartidos por los hilos de la prueba.
+        """
+        self.cerrojo = Lock()
+        self.lecturas = 0
+        self.latencia_maxima = 0.
+        self.errores = []
+        # Transacciones aceptadas por el nodo: id -> transacción enviada
+        self.aceptadas = {}
+
+    def lectura(self, latencia: float):
+        with self.cerrojo:
+            self.lecturas += 1
+            self.latencia_maxima = max(self.latencia_maxima, latencia)
+
+    def error(self, mensaje: str):
+        with self.cerrojo:
+            self.errores.append(mensaje)
+
+
+def comprobar_cadena(cadena: List[Dict]) -> bool:
+    """
+    Comprueba que los bloques recibidos son consecutivos y cada uno enlaza con el anterior.
+    """
+    return all(bloque['indice'] == previo['indice'] + 1 and bloque['hash_previo'] == previo['hash_bloque']
+               for previo, bloque in zip(cadena, cadena[1:]))
+
+
+def lector(nodo: str, parar: Event, resultados: Resultados):
+    """
+    Hace lecturas variadas hasta que se le indique parar, comprobando que cada respuesta es coherente y que la altura de
+    la cadena nunca retrocede.
+    """
+    sesion = requests.Session()
+    altura = 0
+    while not parar.is_set():
+        inicio = time()
+        eleccion = random.random()
+        try:
+            if eleccion < 0.4:
+                datos = sesion.get(nodo + '/chain', params={'desde': max(altura - 20, 1)}).json()
+                completa = datos['desde'] - 1 + len(datos['chain']) == datos['longitud']
+                if not completa or not comprobar_cadena(datos['chain']):
+                    resultados.error(f"Cadena incoherente de longitud {datos['longitud']}")
+                altura_leida = datos['longitud']
+            elif eleccion < 0.7:
+                altura_leida = sesion.get(nodo + '/chain/cabecera').json()['altura']
+            elif eleccion < 0.85:
+                respuesta = sesion.get(nodo + f'/bloque/indice/{random.randint(1, max(altura, 1))}')
+                if respuesta.status_code != 200:
+                    resultados.error(f"No se encuentra un bloque ya leido ({respuesta.status_code})")
+                altura_leida = altura
+            else:
+                sesion.get(nodo + '/saldo/' + random.choice(CUENTAS)).raise_for_status()
+                altura_leida = altura
+        except (requests.RequestException, ValueError, KeyError) as error:
+            resultados.error(f"Lectura fallida: {error}")
+            continue
+        if altura_leida < altura:
+            resultados.error(f"La altura ha retrocedido de {altura} a {altura_leida}")
+        altura = max(altura, altura_leida)
+        resultados.lectura(time() - inicio)
+
+
+def escritor(nodo: str, parar: Event, resultados: Resultados):
+    """
+    Envía lotes de transferencias entre las cuentas de prueba hasta que se le indique parar.
+    """
+    sesion = requests.Session()
+    while not parar.is_set():
+        lote = [{'origen': random.choice(CUENTAS), 'destino': random.choice(CUENTAS), 'cantidad': random.randint(1, 5),
+                 'comision': random.randint(0, 2)} for _ in range(50)]
+        try:
+            respuesta = sesion.post(nodo + '/transacciones/lote', data=json.dumps(lote)).json()
+        except (requests.RequestException, ValueError) as error:
+            resultados.error(f"Escritura fallida: {error}")
+            continue
+        with resultados.cerrojo:
+            resultados.aceptadas.update((resultado['id'], datos)
+                                        for resultado, datos in zip(respuesta['resultados'], lote)
+                                        if resultado['aceptada'])
+
+
+def minero(nodo: str, parar: Event, resultados: Resultados):
+    """
+    Mina bloques sin pausa hasta que se le indique parar.
+    """
+    sesion = requests.Session()
+    while not parar.is_set():
+        try:
+            sesion.get(nodo + '/minar').raise_for_status()
+        except requests.RequestException as error:
+            resultados.error(f"Minado fallido: {error}")
+
+
+def fase(nodo: str, lectores: int, escritores: int, segundos: float) -> Resultados:
+    """
+    Ejecuta los hilos de una fase de la prueba durante los segundos indicados.
+    """
+    resultados, parar = Resultados(), Event()
+    hilos = [Thread(target=lector, args=(nodo, parar, resultados)) for _ in range(lectores)]
+    hilos += [Thread(target=escritor, args=(nodo, parar, resultados)) for _ in range(escritores)]
+    if escritores:
+        hilos.append(Thread(target=minero, args=(nodo, parar, resultados)))
+    for hilo in hilos:
+        hilo.start()
+    sleep(segundos)
+    parar.set()
+    for hilo in hilos:
+        hilo.join()
+    return resultados
+
+
+def comprobar_estado(nodo: str, aceptadas: Dict[str, Dict]) -> List[str]:
+    """
+    Comprueba el estado final del nodo: cadena enlazada, transacciones aceptadas confirmadas una sola vez o todavía
+    pendientes, y saldos iguales a los calculados recorriendo la cadena.
+    """
+    errores = []
+    cadena = requests.get(nodo + '/chain').json()['chain']
+    if not comprobar_cadena(cadena):
+        errores.append("La cadena final no esta bien enlazada")
+
+    saldos, confirmadas = {}, set()
+    for bloque in cadena:
+        for datos in bloque['transacciones']:
+            transaccion = Blockchain.Transaccion.from_dict(datos)
+            if transaccion.id in confirmadas:
+                errores.append(f"La transaccion {transaccion.id} esta confirmada mas de una vez")
+            confirmadas.add(transaccion.id)
+            if transaccion.origen != '0':
+                saldos[transaccion.origen] = saldos.get(transaccion.origen, 0) - transaccion.gasto()
+            saldos[transaccion.destino] = saldos.get(transaccion.destino, 0) + transaccion.cantidad
+
+    # Lo que sigue pendiente de cada cuenta son sus transacciones aceptadas que no se han confirmado
+    pendientes = {}
+    for id_tx, datos in aceptadas.items():
+        if id_tx not in confirmadas:
+            pendientes[datos['origen']] = pendientes.get(datos['origen'], 0) + datos['cantidad'] + datos['comision']
+    for cuenta in CUENTAS:
+        saldo = requests.get(nodo + '/saldo/' + cuenta).json()
+        if saldo['saldo'] != saldos.get(cuenta, 0):
+            errores.append(f"El saldo de {cuenta} es {saldo['saldo']} y segun la cadena {saldos.get(cuenta, 0)}")
+        if saldo['pendiente'] != pendientes.get(cuenta, 0):
+            errores.append(f"{cuenta} tiene {saldo['pendiente']} pendiente y se esperaba {pendientes.get(cuenta, 0)}")
+        if saldo['disponible'] < 0:
+            errores.append(f"La cuenta {cuenta} ha gastado mas de lo que tiene")
+    return errores
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--nodo', default='http://localhost:5000', help='dirección del nodo')
+    parser.add_argument('--lectores', default=16, type=int, help='número de hilos lectores')
+    parser.add_argument('--escritores', default=4, type=int, help='número de hilos escritores')
+    parser.add_argument('--segundos', default=10., type=float, help='duración de cada fase')
+    args = parser.parse_args()
+
+    # Las cuentas de prueba reciben saldo (la recompensa de un bloque minado para cada una) antes de empezar
+    for cuenta in CUENTAS:
+        requests.get(args.nodo + '/minar', params={'cuenta': cuenta})
+
+    solo_lecturas = fase(args.nodo, args.lectores, 0, args.segundos)
+    con_escrituras = fase(args.nodo, args.lectores, args.escritores, args.segundos)
+    print(f"Solo lecturas: {solo_lecturas.lecturas / args.segundos:.1f} lecturas/s "
+          f"(latencia maxima {solo_lecturas.latencia_maxima:.3f} s)")
+    print(f"Con escrituras: {con_escrituras.lecturas / args.segundos:.1f} lecturas/s "
+          f"(latencia maxima {con_escrituras.latencia_maxima:.3f} s), "
+          f"{len(con_escrituras.aceptadas)} transacciones aceptadas")
+
+    errores = solo_lecturas.errores + con_escrituras.errores + comprobar_estado(args.nodo, con_escrituras.aceptadas)
+    for error in errores[:20]:
+        print("ERROR:", error)
+    print("Resultado correcto" if not errores else f"{len(errores)} errores")
@@ -0,0 +1,301 @@
+"""
+Blockchain_metricas.py implementa las métricas de un nodo (contadores, indicadores e histogramas con etiquetas) y su
+exposición en el formato de texto de Prometheus, que la aplicación sirve en GET /metrics. Cada nodo tiene su propio
+registro de métricas (RegistroMetricas), que create_app crea y pasa a su blockchain y a su cliente de red, de forma que
+los nodos de un mismo proceso no mezclan sus métricas. Incluye además un cerrojo que mide sus tiempos de espera y de
+retención y un perfilador por muestreo que se puede activar y desactivar con el nodo en marcha.
+
+AUTORES: SERGIO RODRÍGUEZ VIDAL Y JAIME PAZ RODRÍGUEZ
+"""
+
+import os
+import sys
+
+from collections import Counter
+from threading import Event, Lock, Thread, get_ident, local
+from time import perf_counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+TIPO_CONTENIDO = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Límites por defecto de los histogramas (en segundos)
+LIMITES_SEGUNDOS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1., 5., 10., 60.)
+LIMITES_CERROJOS = (0.00001, 0.0001, 0.001, 0.01, 0.1, 1.)
+
+
+def _escapar(valor: str) -> str:
+    return valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatear(valor: float) -> str:
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if not float(valor).is_integer() else str(int(valor))
+
+
+class Metrica(object):
+    tipo = None
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()):
+        """
+        Constructor de la clase 'Metrica': una serie de valores por combinación de etiquetas.
+        :param nombre: nombre de la métrica.
+        :param ayuda: descripción de la métrica.
+        :param etiquetas: nombres de las etiquetas (default: ninguna).
+        """
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.valores = {}
+        self.cerrojo = Lock()
+
+    def _clave(self, etiquetas: Dict[str, str]) -> Tuple[str, ...]:
+        if set(etiquetas) != set(self.etiquetas):
+            raise ValueError(f"La metrica {self.nombre} lleva las etiquetas {self.etiquetas}")
+        return tuple(str(etiquetas[etiqueta]) for etiqueta in self.etiquetas)
+
+    def _serie(self, clave: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None, sufijo: str = '') -> str:
+        pares = list(zip(self.etiquetas, clave)) + ([extra] if extra else [])
+        etiquetas = ','.join(f'{nombre}="{_escapar(valor)}"' for nombre, valor in pares)
+        return self.nombre + sufijo + (f'{{{etiquetas}}}' if etiquetas else '')
+
+    def muestras(self) -> List[str]:
+        with self.cerrojo:
+            return [f'{self._serie(clave)} {_formatear(valor)}' for clave, valor in sorted(self.valores.items())]
+
+    def exponer(self) -> List[str]:
+        """
+        Devuelve las líneas de la métrica en el formato de texto de Prometheus.
+        :return: lista de líneas
+        """
+        return [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} {self.tipo}'] + self.muestras()
+
+
+class ContadorMetrica(Metrica):
+    tipo = 'counter'
+
+    def incrementar(self, cantidad: float = 1, **etiquetas):
+        """
+        Suma una cantidad (no negativa) al contador.
+        """
+        clave = self._clave(etiquetas)
+        with self.cerrojo:
+            self.valores[clave] = self.valores.get(clave, 0) + cantidad
+
+
+class Indicador(Metrica):
+    tipo = 'gauge'
+
+    def fijar(self, valor: float, **etiquetas):
+        """
+        Fija el valor del indicador.
+        """
+        clave = self._clave(etiquetas)
+        with self.cerrojo:
+            self.valores[clave] = valor
+
+
+class Histograma(Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = (),
+                 limites: Iterable[float] = LIMITES_SEGUNDOS):
+        """
+        Constructor de la clase 'Histograma': cuenta las observaciones que caen por debajo de cada límite, su suma y su
+        número.
+        :param limites: límites superiores de los intervalos (default: LIMITES_SEGUNDOS).
+        """
+        super(Histograma, self).__init__(nombre, ayuda, etiquetas)
+        self.limites = tuple(sorted(limites)) + (float('inf'),)
+
+    def observar(self, valor: float, **etiquetas):
+        """
+        Añade una observación al histograma.
+        """
+        clave = self._clave(etiquetas)
+        with self.cerrojo:
+            cubetas, suma = self.valores.get(clave, ([0] * len(self.limites), 0.))
+            for posicion, limite in enumerate(self.limites):
+                if valor <= limite:
+                    cubetas[posicion] += 1
+            self.valores[clave] = (cubetas, suma + valor)
+
+    def cronometrar(self, **etiquetas) -> 'Cronometro':
+        """
+        Devuelve un gestor de contexto que observa los segundos que tarda su bloque.
+        """
+        return Cronometro(self, etiquetas)
+
+    def muestras(self) -> List[str]:
+        lineas = []
+        with self.cerrojo:
+            for clave, (cubetas, suma) in sorted(self.valores.items()):
+                lineas += [f"{self._serie(clave, ('le', _formatear(limite)), '_bucket')} {cubetas[posicion]}"
+                           for posicion, limite in enumerate(self.limites)]
+                lineas.append(f'{self._serie(clave, sufijo="_sum")} {_formatear(suma)}')
+                lineas.append(f'{self._serie(clave, sufijo="_count")} {cubetas[-1]}')
+        return lineas
+
+
+class Cronometro(object):
+    def __init__(self, histograma: Histograma, etiquetas: Dict[str, str]):
+        self.histograma = histograma
+        self.etiquetas = etiquetas
+        self.inicio = None
+
+    def __enter__(self):
+        self.inicio = perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.histograma.observar(perf_counter() - self.inicio, **self.etiquetas)
+
+
+class RegistroMetricas(object):
+    def __init__(self):
+        """
+        Constructor de la clase 'RegistroMetricas': conjunto de métricas que se exponen juntas.
+        """
+        self.metricas = {}
+        self.cerrojo = Lock()
+
+    def _registrar(self, metrica: Metrica) -> Metrica:
+        with self.cerrojo:
+            # Si ya existe (por ejemplo, la de los tiempos de otro cerrojo) se reutiliza la registrada
+            return self.metricas.setdefault(metrica.nombre, metrica)
+
+    def contador(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()) -> ContadorMetrica:
+        return self._registrar(ContadorMetrica(nombre, ayuda, etiquetas))
+
+    def indicador(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()) -> Indicador:
+        return self._registrar(Indicador(nombre, ayuda, etiquetas))
+
+    def histograma(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = (),
+                   limites: Iterable[float] = LIMITES_SEGUNDOS) -> Histograma:
+        return self._registrar(Histograma(nombre, ayuda, etiquetas, limites))
+
+    def exponer(self) -> str:
+        """
+        Devuelve todas las métricas en el formato de texto de Prometheus.
+        :return: texto de las métricas
+        """
+        with self.cerrojo:
+            metricas = sorted(self.metricas.values(), key=lambda metrica: metrica.nombre)
+        return ''.join(linea + '\n' for metrica in metricas for linea in metrica.exponer())
+
+
+class CerrojoMedido(object):
+    def __init__(self, cerrojo, nombre: str, registro: RegistroMetricas):
+        """
+        Constructor de la clase 'CerrojoMedido': envuelve un cerrojo (Lock o RLock) usado con 'with' y observa cuánto
+        se espera para adquirirlo y cuánto se retiene. Con un RLock solo se mide la adquisición más externa de cada
+        hilo.
+        :param cerrojo: cerrojo envuelto.
+        :param nombre: nombre del cerrojo en las métricas.
+        :param registro: registro en el que se recogen las métricas.
+        """
+        self.cerrojo = cerrojo
+        self.nombre = nombre
+        self.hilos = local()
+        self.espera = registro.histograma('blockchain_cerrojo_espera_segundos',
+                                          'Tiempo de espera para adquirir los cerrojos de la blockchain', ('cerrojo',),
+                                          LIMITES_CERROJOS)
+        self.retencion = registro.histograma('blockchain_cerrojo_retencion_segundos',
+                                             'Tiempo durante el que se retienen los cerrojos de la blockchain',
+                                             ('cerrojo',), LIMITES_CERROJOS)
+
+    def __enter__(self):
+        profundidad = getattr(self.hilos, 'profundidad', 0)
+        inicio = perf_counter()
+        self.cerrojo.acquire()
+        if profundidad == 0:
+            self.hilos.adquirido = perf_counter()
+            self.espera.observar(self.hilos.adquirido - inicio, cerrojo=self.nombre)
+        self.hilos.profundidad = profundidad + 1
+        return self
+
+    def __exit__(self, *_):
+        self.hilos.profundidad -= 1
+        if self.hilos.profundidad == 0:
+            self.retencion.observar(perf_counter() - self.hilos.adquirido, cerrojo=self.nombre)
+        self.cerrojo.release()
+
+
+class PerfiladorMuestreo(object):
+    def __init__(self):
+        """
+        Constructor de la clase 'PerfiladorMuestreo'. Mientras está activo, un hilo toma cada cierto intervalo la pila
+        de todos los demás hilos del proceso y cuenta cuántas veces aparece cada una. Las pilas se devuelven en el
+        formato "colapsado" (funciones separadas por ';' seguidas del número de muestras) que usan las herramientas de
+        flame graphs. Está desactivado por defecto: solo consume tiempo mientras está activo.
+        """
+        self.muestras = Counter()
+        self.total = 0
+        self.intervalo = 0.01
+        self.parar = None
+        self.hilo = None
+        self.cerrojo = Lock()
+
+    @property
+    def activo(self) -> bool:
+        return self.hilo is not None and self.hilo.is_alive()
+
+    def activar(self, intervalo: float = 0.01):
+        """
+        Empieza (o continúa) a tomar muestras, descartando las anteriores si no estaba activo.
+        :param intervalo: segundos entre muestras (default: 0.01).
+        :return: None
+        """
+        with self.cerrojo:
+            self.intervalo = intervalo
+            if self.activo:
+                return
+            self.muestras, self.total = Counter(), 0
+            self.parar = Event()
+            self.hilo = Thread(target=self._muestrear, args=(self.parar,), daemon=True)
+            self.hilo.start()
+
+    def desactivar(self):
+        """
+        Deja de tomar muestras (las tomadas se conservan hasta la siguiente activación).
+        :return: None
+        """
+        with self.cerrojo:
+            if self.parar is not None:
+                self.parar.set()
+            self.hilo = None
+
+    def _muestrear(self, parar: Event):
+        propio = get_ident()
+        while not parar.wait(self.intervalo):
+            pilas = []
+            for hilo, marco in sys._current_frames().items():
+                if hilo == propio:
+                    continue
+                funciones = []
+                while marco is not None:
+                    codigo = marco.f_code
+                    fichero = os.path.basename(codigo.co_filename)
+                    funciones.append(f'{codigo.co_name} ({fichero}:{codigo.co_firstlineno})')
+                    marco = marco.f_back
+                pilas.append(';'.join(reversed(funciones)))
+            with self.cerrojo:
+                self.muestras.update(pilas)
+                self.total += 1
+
+    def colapsado(self) -> str:
+        """
+        Devuelve las pilas muestreadas en formato colapsado, de la más frecuente a la menos.
+        :return: texto con una pila por línea
+        """
+        with self.cerrojo:
+            return ''.join(f'{pila} {numero}\n' for pila, numero in self.muestras.most_common())
+
+    def estado(self) -> Dict:
+        """
+        Devuelve el estado del perfilador.
+        :return: Diccionario {'activo', 'intervalo', 'muestras', 'pilas'}
+        """
+        with self.cerrojo:
+            return {'activo': self.activo, 'intervalo': self.intervalo, 'muestras': self.total,
+                    'pilas': len(self.muestras)}
@@ -0,0 +1,240 @@
+"""
+Blockchain_red.py contiene la capa de comunicación entre nodos de la aplicación Blockchain_app.py. Todas las
+peticiones a otros nodos pasan por un único cliente que reutiliza las conexiones, limita el tiempo de cada petición,
+reintenta con esperas crecientes y deja de contactar temporalmente con los nodos que fallan de forma repetida. La
+duración de las peticiones, los bytes recibidos y los fallos de cada nodo se recogen en las métricas del nodo que usa
+el cliente (ver Blockchain_metricas). Incluye también la caché acotada de elementos ya vistos con la que los nodos
+descartan los anuncios repetidos de bloques y transacciones.
+
+AUTORES: SERGIO RODRÍGUEZ VIDAL Y JAIME PAZ RODRÍGUEZ
+"""
+
+import requests
+
+from Blockchain_metricas import RegistroMetricas
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+from threading import Lock
+from time import perf_counter, sleep, time
+from typing import Callable, Dict, Hashable, Iterable, List, Optional
+
+
+class ClientePares(object):
+    def __init__(self, timeout: float = 2., reintentos: int = 2, espera: float = 0.1, max_fallos: int = 3,
+                 enfriamiento: float = 30., hilos: int = 8, metricas: Optional[RegistroMetricas] = None):
+        """
+        Constructor de la clase 'ClientePares'.
+        :param timeout: tiempo máximo (en segundos) de cada intento de petición a un nodo.
+        :param reintentos: número de reintentos tras un primer intento fallido.
+        :param espera: espera antes del primer reintento; se duplica en cada reintento.
+        :param max_fallos: peticiones fallidas seguidas tras las que un nodo se considera caído.
+        :param enfriamiento: segundos durante los que no se contacta con un nodo caído.
+        :param hilos: número de peticiones simultáneas (y de conexiones reutilizables por nodo).
+        :param metricas: registro en el que se recogen las métricas de las peticiones (default: uno propio).
+        """
+        self.timeout = timeout
+        self.reintentos = reintentos
+        self.espera = espera
+        self.max_fallos = max_fallos
+        self.enfriamiento = enfriamiento
+
+        metricas = RegistroMetricas() if metricas is None else metricas
+        self.duracion_peticiones = metricas.histograma('blockchain_nodo_peticion_segundos',
+                                                       'Duracion de cada intento de peticion a otro nodo', ('nodo',))
+        self.bytes_recibidos = metricas.contador('blockchain_nodo_bytes_recibidos_total',
+                                                 'Bytes recibidos (tal como se transfieren) en las respuestas '
+                                                 'de otro nodo', ('nodo',))
+        self.peticiones_fallidas = metricas.contador('blockchain_nodo_peticiones_fallidas_total',
+                                                     'Intentos de peticion a otro nodo que han fallado', ('nodo',))
+
+        self.sesion = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=hilos, pool_maxsize=hilos)
+        self.sesion.mount('http://', adaptador)
+        self.sesion.mount('https://', adaptador)
+        self.ejecutor = ThreadPoolExecutor(max_workers=hilos)
+
+        # Fallos seguidos por nodo y momento hasta el que se deja de contactar con cada nodo caído
+        self.fallos = {}
+        self.suspendidos = {}
+        self.cerrojo = Lock()
+
+    def sano(self, nodo: str) -> bool:
+        """
+        Indica si se puede contactar con un nodo (no está caído o ya ha pasado su enfriamiento).
+        :param nodo: dirección del nodo.
+        :return: True o False
+        """
+        with self.cerrojo:
+            return self.suspendidos.get(nodo, 0.) <= time()
+
+    def _registrar_resultado(self, nodo: str, correcto: bool):
+        """
+        Actualiza el estado de salud de un nodo tras una petición.
+        """
+        with self.cerrojo:
+            if correcto:
+                self.fallos.pop(nodo, None)
+                self.suspendidos.pop(nodo, None)
+                return
+            self.fallos[nodo] = self.fallos.get(nodo, 0) + 1
+            if self.fallos[nodo] >= self.max_fallos:
+                self.suspendidos[nodo] = time() + self.enfriamiento
+
+    def registrar_fallo(self, nodo: str):
+        """
+        Cuenta como fallida una petición a un nodo que ha respondido con datos no válidos (por ejemplo, un cuerpo que no
+        es JSON o que no tiene la forma esperada).
+        :param nodo: dirección del nodo.
+        :return: None
+        """
+        self.peticiones_fallidas.incrementar(nodo=nodo)
+        self._registrar_resultado(nodo, False)
+
+    def peticion(self, metodo: str, nodo: str, ruta: str, **kwargs) -> Optional[requests.Response]:
+        """
+        Realiza una petición a un nodo, reintentando con esperas crecientes si no se puede conectar, no responde a
+        tiempo o responde con un error del servidor (5xx). Solo esos fallos cuentan para la salud del nodo: un error de
+        la petición (4xx, como una transacción que el nodo rechaza) es una respuesta válida y se devuelve sin
+        reintentar, por lo que quien llama debe comprobar respuesta.ok.
+        :param metodo: método HTTP ('GET', 'POST'...).
+        :param nodo: dirección del nodo.
+        :param ruta: ruta de la petición (por ejemplo '/chain').
+        :param kwargs: parámetros adicionales de requests (params, json, data, headers...).
+        :return: la respuesta, o None si el nodo está caído o todos los intentos fallaron.
+        """
+        if not self.sano(nodo):
+            return None
+        kwargs.setdefault('timeout', self.timeout)
+        espera = self.espera
+        for intento in range(self.reintentos + 1):
+            if intento > 0:
+                sleep(espera)
+                espera *= 2
+            inicio = perf_counter()
+            try:
+                respuesta = self.sesion.request(metodo, nodo.rstrip('/') + ruta, **kwargs)
+                # Se cuentan los bytes transferidos (comprimidos, si la respuesta lo está)
+                self.bytes_recibidos.incrementar(int(respuesta.headers.get('Content-Length', len(respuesta.content))),
+                                            nodo=nodo)
+            except requests.RequestException:
+                self.peticiones_fallidas.incrementar(nodo=nodo)
+                continue
+            finally:
+                self.duracion_peticiones.observar(perf_counter() - inicio, nodo=nodo)
+            if respuesta.status_code >= 500:
+                self.peticiones_fallidas.incrementar(nodo=nodo)
+                continue
+            if respuesta.ok:
+                self._registrar_resultado(nodo, True)
+            return respuesta
+        self._registrar_resultado(nodo, False)
+        return None
+
+    def get(self, nodo: str, ruta: str, **kwargs) -> Optional[requests.Response]:
+        """
+        Petición GET a un nodo (ver peticion).
+        """
+        return self.peticion('GET', nodo, ruta, **kwargs)
+
+    def post(self, nodo: str, ruta: str, **kwargs) -> Optional[requests.Response]:
+        """
+        Petición POST a un nodo (ver peticion).
+        """
+        return self.peticion('POST', nodo, ruta, **kwargs)
+
+    def difundir(self, metodo: str, nodos: Iterable[str], ruta: str,
+                 kwargs_por_nodo: Optional[Callable[[str], Dict]] = None, **kwargs) -> Dict[str, requests.Response]:
+        """
+        Realiza la misma petición a varios nodos en paralelo. Los nodos caídos se omiten y los que no responden a
+        tiempo o rechazan la petición (4xx) se descartan.
+        :param metodo: método HTTP ('GET', 'POST'...).
+        :param nodos: direcciones de los nodos.
+        :param ruta: ruta de la petición.
+        :param kwargs_por_nodo: función que devuelve parámetros adicionales propios de cada nodo (default: None).
+        :param kwargs: parámetros comunes de requests.
+        :return: diccionario nodo -> respuesta, solo con los nodos que respondieron correctamente.
+        """
+        futuros = {}
+        for nodo in nodos:
+            if not self.sano(nodo):
+                continue
+            kwargs_nodo = dict(kwargs, **(kwargs_por_nodo(nodo) if kwargs_por_nodo else {}))
+            futuros[nodo] = self.ejecutor.submit(self.peticion, metodo, nodo, ruta, **kwargs_nodo)
+        # Plazo máximo: todos los intentos con sus esperas
+        plazo = (self.reintentos + 1) * self.timeout + self.espera * (2 ** self.reintentos)
+        wait(futuros.values(), timeout=plazo)
+        return {nodo: futuro.result() for nodo, futuro in futuros.items()
+                if futuro.done() and futuro.exception() is None and futuro.result() is not None and
+                futuro.result().ok}
+
+    def difundir_sin_esperar(self, metodo: str, nodos: Iterable[str], ruta: str, **kwargs):
+        """
+        Realiza la misma petición a varios nodos en paralelo sin esperar sus respuestas (por ejemplo, para anunciar
+        algo). Los nodos caídos se omiten y los fallos solo cuentan para la salud de cada nodo.
+        :param metodo: método HTTP ('GET', 'POST'...).
+        :param nodos: direcciones de los nodos.
+        :param ruta: ruta de la petición.
+        :param kwargs: parámetros comunes de requests.
+        :return: None
+        """
+        for nodo in nodos:
+            if self.sano(nodo):
+                self.ejecutor.submit(self.peticion, metodo, nodo, ruta, **kwargs)
+
+    def estado(self) -> Dict:
+        """
+        Devuelve el estado de salud de los nodos con los que ha habido fallos.
+        :return: Diccionario nodo -> {'fallos', 'sano'}
+        """
+        with self.cerrojo:
+            fallos = dict(self.fallos)
+        return {nodo: {'fallos': numero, 'sano': self.sano(nodo)} for nodo, numero in fallos.items()}
+
+
+class CacheVistos(object):
+    def __init__(self, capacidad: int = 10000):
+        """
+        Constructor de la clase 'CacheVistos': recuerda los últimos elementos vistos (por ejemplo, hashes de bloques
+        anunciados) para no procesarlos dos veces. Cuando se llena olvida el que lleva más tiempo sin verse.
+        :param capacidad: número máximo de elementos que recuerda.
+        """
+        self.capacidad = capacidad
+        self.vistos = OrderedDict()
+        self.cerrojo = Lock()
+
+    def __len__(self):
+        return len(self.vistos)
+
+    def __contains__(self, elemento: Hashable):
+        with self.cerrojo:
+            return elemento in self.vistos
+
+    def marcar(self, elementos: Iterable[Hashable]) -> List[Hashable]:
+        """
+        Marca varios elementos como vistos.
+        :param elementos: elementos.
+        :return: los elementos que no se habían visto todavía, en el orden recibido
+        """
+        nuevos = []
+        with self.cerrojo:
+            for elemento in elementos:
+                if elemento in self.vistos:
+                    self.vistos.move_to_end(elemento)
+                    continue
+                self.vistos[elemento] = None
+                nuevos.append(elemento)
+            while len(self.vistos) > self.capacidad:
+                self.vistos.popitem(last=False)
+        return nuevos
+
+    def olvidar(self, elementos: Iterable[Hashable]):
+        """
+        Olvida varios elementos, que volverán a procesarse si se anuncian de nuevo (por ejemplo, si no se pudieron
+        descargar).
+        :param elementos: elementos.
+        :return: None
+        """
+        with self.cerrojo:
+            for elemento in elementos:
+                self.vistos.pop(elemento, None)
@@ -1,6 +1,8 @@
 """
 Fichero de pruebas en el que se hace uso de las principales funciones del programa a modo de ejemplo. Para su uso será
-necesario iniciar 3 terminales en los puertos 5000, 5001 y 5002 del host local.
+necesario iniciar 3 terminales en los puertos 5000, 5001 y 5002 del host local, con una recompensa por bloque de 100
+(por ejemplo, python Blockchain_app.py -p 5000 --recompensa 100). Una vez registrados los nodos, las transacciones y
+bloques de cada uno se anuncian a los demás, por lo que basta con enviarlos a un solo nodo.
 
 AUTORES: SERGIO RODRÍGUEZ VIDAL Y JAIME PAZ RODRÍGUEZ
 """
@@ -8,12 +10,20 @@ AUTORES: SERGIO RODRÍGUEZ VIDAL Y JAIME PAZ RODRÍGUEZ
 import requests
 import json
 
+from time import sleep
+
 # Cabecera JSON (común a todas)
 cabecera = {'Content-type': 'application/json', 'Accept': 'text/plain'}
 
 r = requests.get('http://localhost:5000/system')
 print(r.text)
 
+# Solo la recompensa de los bloques crea dinero: las cuentas que envían después minan un bloque cada una para tener
+# saldo
+for cuenta in ('nodoA', 'nodoC', 'nodoD'):
+    r = requests.get('http://localhost:5000/minar', params={'cuenta': cuenta})
+    print(r.text)
+
 # datos transaccion
 transaccion_nueva = {'origen': 'nodoA', 'destino': 'nodoB', 'cantidad': 10}
 r = requests.post('http://localhost:5000/transacciones/nueva', data=json.dumps(transaccion_nueva), headers=cabecera)
@@ -64,3 +74,11 @@ print(r.text)
 
 r = requests.get('http://localhost:5002/chain')
 print(r.text)
+
+r = requests.get('http://localhost:5002/saldo/nodoD')
+print(r.text)
+
+# El bloque minado en el puerto 5002 se ha anunciado al resto de nodos, que tienen ya el mismo saldo
+sleep(0.5)
+r = requests.get('http://localhost:5000/saldo/nodoD')
+print(r.text)
@@ -0,0 +1,218 @@
+"""
+Pruebas de regresión del proyecto. Se ejecutan con unittest (o con pytest) sin necesidad de lanzar nodos:
+
+$ python -m unittest Blockchain_test
+
+AUTORES: SERGIO RODRÍGUEZ VIDAL Y JAIME PAZ RODRÍGUEZ
+"""
+
+import Blockchain
+import Blockchain_app
+import Blockchain_red
+import os
+import requests
+import tempfile
+import unittest
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+from waitress.server import create_server
+
+
+class PruebasMempool(unittest.TestCase):
+    def test_retirar_y_anadir_de_nuevo(self):
+        """
+        Una transacción retirada y añadida de nuevo (como las que vuelven a quedar pendientes tras una reorganización)
+        se selecciona una sola vez.
+        """
+        mempool = Blockchain.Mempool(100, 1024 * 1024)
+        transaccion = Blockchain.Transaccion('cuentaA', 'cuentaB', 5, comision=1)
+        otra = Blockchain.Transaccion('cuentaA', 'cuentaC', 3)
+        mempool.anadir(transaccion)
+        mempool.anadir(otra)
+        mempool.retirar([transaccion.id])
+        mempool.anadir(transaccion)
+
+        seleccionadas = mempool.seleccionar(10)
+        self.assertEqual([t.id for t in seleccionadas], [transaccion.id, otra.id])
+        self.assertEqual(mempool.gasto_pendiente('cuentaA'), 9)
+
+
+def minar(blockchain: Blockchain.Blockchain, cuenta: str):
+    bloque = blockchain.nuevo_bloque(blockchain.ultimo_bloque.hash_bloque, minero=cuenta)
+    assert blockchain.integra_bloque(bloque, Blockchain.Blockchain.prueba_trabajo(bloque))
+
+
+class PruebasReorganizacion(unittest.TestCase):
+    def test_instantanea_anterior(self):
+        """
+        Una instantánea tomada antes de una reorganización sigue viendo su cadena, aunque la cadena y sus índices se
+        modifiquen en el sitio.
+        """
+        blockchain = Blockchain.Blockchain()
+        otra = Blockchain.Blockchain.desde_bloques(blockchain.cadena[:1])
+        for _ in range(2):
+            minar(blockchain, 'cuentaA')
+        for _ in range(3):
+            minar(otra, 'cuentaB')
+        anterior = blockchain.instantanea
+        descartados = anterior.bloques()
+        recompensa = descartados[1].transacciones[0]
+
+        self.assertTrue(blockchain.reemplazar_sufijo(1, [(bloque, bloque.hash_bloque) for bloque in otra.cadena[1:]]))
+        self.assertEqual(anterior.bloques(), descartados)
+        self.assertIs(anterior.ultimo_bloque, descartados[-1])
+        self.assertIs(anterior.bloque_por_hash(descartados[1].hash_bloque), descartados[1])
+        self.assertIsNone(anterior.bloque_por_hash(otra.cadena[1].hash_bloque))
+        self.assertEqual(anterior.buscar_transaccion(recompensa.id), (recompensa, descartados[1]))
+        self.assertIsNone(blockchain.buscar_transaccion(recompensa.id))
+        self.assertEqual(blockchain.instantanea.bloques(), otra.cadena)
+        self.assertEqual(blockchain.saldos, otra.saldos)
+
+
+class PruebasSaldos(unittest.TestCase):
+    def setUp(self):
+        self.blockchain = Blockchain.Blockchain(recompensa_bloque=10)
+        self.otra = Blockchain.Blockchain.desde_bloques(self.blockchain.cadena[:1], recompensa_bloque=10)
+
+    def test_pendientes_tras_reorganizacion(self):
+        """
+        Tras una reorganización que descarta el bloque que daba saldo a una cuenta, sus transacciones pendientes se
+        retiran.
+        """
+        minar(self.blockchain, 'cuentaA')
+        self.blockchain.anadir_transaccion(Blockchain.Transaccion('cuentaA', 'cuentaB', 10))
+        for _ in range(2):
+            minar(self.otra, 'cuentaM')
+
+        sufijo = [(bloque, bloque.hash_bloque) for bloque in self.otra.cadena[1:]]
+        self.assertTrue(self.blockchain.reemplazar_sufijo(1, sufijo))
+        self.assertEqual(self.blockchain.saldo('cuentaA'), {'saldo': 0, 'pendiente': 0, 'disponible': 0})
+        self.assertEqual(len(self.blockchain.transacciones_sin_confirmar), 0)
+
+    def test_pendientes_tras_integrar_bloque(self):
+        """
+        Un bloque de otro nodo que gasta el saldo de una cuenta retira las transacciones pendientes de esa cuenta que
+        ya no cubre, empezando por las de menor prioridad.
+        """
+        minar(self.blockchain, 'cuentaA')
+        self.otra.integra_bloque(self.blockchain.cadena[1], self.blockchain.cadena[1].hash_bloque)
+        prioritaria = Blockchain.Transaccion('cuentaA', 'cuentaB', 3, comision=1)
+        self.blockchain.anadir_transacciones([Blockchain.Transaccion('cuentaA', 'cuentaB', 4), prioritaria])
+        self.otra.anadir_transaccion(Blockchain.Transaccion('cuentaA', 'cuentaC', 6))
+        minar(self.otra, 'cuentaM')
+
+        bloque = self.otra.cadena[-1]
+        self.assertTrue(self.blockchain.integra_bloque(bloque, bloque.hash_bloque))
+        self.assertEqual(self.blockchain.saldo('cuentaA'), {'saldo': 4, 'pendiente': 4, 'disponible': 0})
+        self.assertEqual(list(self.blockchain.transacciones_sin_confirmar), [prioritaria])
+
+
+class NodoPrueba(object):
+    def __init__(self, directorio: str, nombre: str):
+        """
+        Nodo creado con create_app y servido con waitress en un hilo de este proceso, en un puerto libre.
+        """
+        self.app = Blockchain_app.create_app({'almacen': os.path.join(directorio, f'{nombre}.log')})
+        self.nodo = self.app.extensions['nodo']
+        self.servidor = create_server(self.app, host='127.0.0.1', port=0, threads=4)
+        self.direccion = f'http://127.0.0.1:{self.servidor.effective_port}/'
+        Thread(target=self.servidor.run, daemon=True).start()
+
+    def minar(self, cuenta: str):
+        minar(self.nodo.blockchain, cuenta)
+
+    def cerrar(self):
+        self.servidor.close()
+        self.nodo.blockchain.almacen.cerrar()
+
+
+class RespuestaNoJSON(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b'hola')
+
+    def log_message(self, *args):
+        pass
+
+
+class RespuestaConCodigo(BaseHTTPRequestHandler):
+    # Peticiones recibidas por ruta; la ruta es el código de estado con el que se responde (por ejemplo, /409)
+    peticiones = {}
+
+    def do_GET(self):
+        self.peticiones[self.path] = self.peticiones.get(self.path, 0) + 1
+        self.send_response(int(self.path.strip('/')))
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class PruebasRed(unittest.TestCase):
+    def setUp(self):
+        self.directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directorio.cleanup)
+
+    def test_nodo_con_respuesta_no_valida(self):
+        """
+        Un nodo que no responde con JSON no impide resolver los conflictos con el resto y cuenta como un fallo suyo.
+        """
+        erroneo = HTTPServer(('127.0.0.1', 0), RespuestaNoJSON)
+        Thread(target=erroneo.serve_forever, daemon=True).start()
+        self.addCleanup(erroneo.server_close)
+        self.addCleanup(erroneo.shutdown)
+        direccion_erronea = f'http://127.0.0.1:{erroneo.server_port}/'
+        origen, local = NodoPrueba(self.directorio.name, 'origen'), NodoPrueba(self.directorio.name, 'local')
+        self.addCleanup(origen.cerrar)
+        self.addCleanup(local.cerrar)
+        origen.minar('cuentaA')
+
+        local.nodo.nodos_red.update([direccion_erronea, origen.direccion])
+        self.assertTrue(local.nodo.resuelve_conflictos())
+        self.assertEqual(len(local.nodo.blockchain), 2)
+        self.assertEqual(local.nodo.cliente.estado()[direccion_erronea]['fallos'], 1)
+
+    def test_metricas_por_nodo(self):
+        """
+        Cada nodo sirve solo sus métricas, aunque haya varios en el mismo proceso.
+        """
+        origen, local = NodoPrueba(self.directorio.name, 'origen'), NodoPrueba(self.directorio.name, 'local')
+        self.addCleanup(origen.cerrar)
+        self.addCleanup(local.cerrar)
+        origen.minar('cuentaA')
+        self.assertTrue(local.nodo.cliente.get(origen.direccion, '/chain').ok)
+
+        metricas_origen = requests.get(origen.direccion + 'metrics').text
+        metricas_local = requests.get(local.direccion + 'metrics').text
+        # Cada nodo registra su primer bloque en su almacén; el origen, además, el bloque minado
+        self.assertIn('blockchain_persistencia_segundos_count 2\n', metricas_origen)
+        self.assertIn('blockchain_persistencia_segundos_count 1\n', metricas_local)
+        self.assertIn('blockchain_nodo_peticion_segundos_count{', metricas_local)
+        self.assertNotIn('blockchain_nodo_peticion_segundos_count{', metricas_origen)
+
+    def test_reintentos_segun_codigo(self):
+        """
+        Los errores de la petición (4xx) se devuelven sin reintentar ni contar como fallo del nodo; los errores del
+        servidor (5xx) se reintentan y cuentan como fallo.
+        """
+        servidor = HTTPServer(('127.0.0.1', 0), RespuestaConCodigo)
+        Thread(target=servidor.serve_forever, daemon=True).start()
+        self.addCleanup(servidor.server_close)
+        self.addCleanup(servidor.shutdown)
+        direccion = f'http://127.0.0.1:{servidor.server_port}'
+        cliente = Blockchain_red.ClientePares(reintentos=2, espera=0.01)
+
+        respuesta = cliente.get(direccion, '/409')
+        self.assertEqual(respuesta.status_code, 409)
+        self.assertEqual(RespuestaConCodigo.peticiones['/409'], 1)
+        self.assertEqual(cliente.estado(), {})
+
+        self.assertIsNone(cliente.get(direccion, '/503'))
+        self.assertEqual(RespuestaConCodigo.peticiones['/503'], 3)
+        self.assertEqual(cliente.estado()[direccion]['fallos'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()